@@ -38,10 +38,21 @@ class RTPCon:
 
 
     def packRTP(self, payload, seq):
+        '''
+        :return: (RTP头部, 负载)，发送时不拼接
+        '''
         V, P, X, CC, M, PT, seqNum, SSRC = 2, 0, 0, 0, 0, 26, seq, 0
         rtpPacket = RtpPacket()
         rtpPacket.encode(V, P, X, CC, seqNum, M, PT, SSRC, payload)
-        return rtpPacket.getPacket()
+        return rtpPacket.getBuffers()
+
+
+    def sendRTP(self, buffers, addr):
+        '''有sendmsg时按分散-聚集方式发送头部和负载，否则拼接后发送'''
+        if hasattr(self.rtp_socket, 'sendmsg'):
+            self.rtp_socket.sendmsg(buffers, [], 0, addr)
+        else:
+            self.rtp_socket.sendto(b''.join(buffers), addr)
 
 
     def play(self):
@@ -51,7 +62,7 @@ class RTPCon:
             if ret:
                 frame, seqnum = ret
                 print('\nSeq Num: ', seqnum)
-                self.rtp_socket.sendto(self.packRTP(frame, seqnum), (self.addr[0], self.client_rtp_port))
+                self.sendRTP(self.packRTP(frame, seqnum), (self.addr[0], self.client_rtp_port))
                 time.sleep(0.5)
             else:
                 break
@@ -0,0 +1,165 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from Constants import *
+from Server import ServerWorker
+from UdpBatch import BatchSender
+
+
+class LoopSocket:
+    '''把asyncio的StreamWriter包装成ResponseSender需要的套接字接口，可以在任意线程中发送'''
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+
+    def send(self, data):
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+        return len(data)
+
+    def getsockname(self):
+        return self.writer.get_extra_info('sockname')
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class RtpProtocol(asyncio.DatagramProtocol):
+    '''所有会话共用的RTP发送端点'''
+
+    def __init__(self):
+        self.transport = None
+        self.batch_sender = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.batch_sender = BatchSender(transport.get_extra_info('socket'), transport.sendto)
+
+    def sendto(self, packet, addr):
+        if self.transport is not None:
+            self.transport.sendto(packet, addr)
+
+    def sendBatch(self, packets, addr):
+        if self.batch_sender is not None:
+            self.batch_sender.sendBatch(packets, addr)
+
+
+class AsyncServerWorker(ServerWorker):
+    '''
+    事件循环中的单个客户端会话
+    RTSP请求沿用ServerWorker的解析和应答逻辑，放到控制线程池中处理；编解码放到媒体线程池中，发送在事件循环中按帧率进行
+    '''
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.loop = server.loop
+        self.reader = reader
+        self.writer = writer
+        self.stream_task = None
+        self.media_call = None
+        ServerWorker.__init__(self, LoopSocket(writer, server.loop), writer.get_extra_info('peername'))
+
+    def createRtpSocket(self):
+        return None
+
+    def createBatchSender(self):
+        return self.server.rtp.batch_sender
+
+    def createThreads(self):
+        pass
+
+    def configureStreams(self):
+        '''在控制线程中执行：先停下上一次播放的发送任务并等它正在进行的编码返回，再修改流的设置'''
+        asyncio.run_coroutine_threadsafe(self.stopStreaming(), self.loop).result()
+        ServerWorker.configureStreams(self)
+
+    def startStreaming(self):
+        self.loop.call_soon_threadsafe(self.startTask)
+
+    def startTask(self):
+        self.stream_task = self.loop.create_task(self.stream())
+
+    async def stopStreaming(self):
+        task, self.stream_task = self.stream_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.wait([task])
+        call, self.media_call = self.media_call, None
+        if call is not None:
+            await asyncio.wait([call])
+            if not call.cancelled():
+                call.exception()
+
+    async def runMedia(self, func):
+        '''
+        在媒体线程池中执行func；发送任务被取消时调用本身仍在进行，记在media_call中供stopStreaming等待
+        '''
+        self.media_call = self.loop.run_in_executor(self.server.executor, func)
+        return await asyncio.shield(self.media_call)
+
+    async def stream(self):
+        addr = (self.client_addr, self.client_rtp_port)
+        interval = 1 / self.video_framerate if self.video_framerate > 0 else 1 / DEFAULT_VIDEO_FRAMERATE
+        deadline = self.loop.time()
+        frames = 0
+        while self.state == PLAYING:
+            packets = await self.runMedia(self.video_stream.nextPackets)
+            if packets is None or self.state != PLAYING:
+                break
+            late = self.loop.time() > deadline
+            self.server.rtp.sendBatch(packets, addr)
+            self.stats.video.record(packets)
+            text = self.subtitle_stream.nextPackets(self.video_stream.timestamp)
+            if text:
+                self.server.rtp.sendBatch(text, addr)
+            self.adaptQuality(late)
+            frames += 1
+            if frames % AUDIO_FRAMES_PER_CHUNK == 0:
+                packet = await self.runMedia(self.audio_stream.nextPacket)
+                if packet is not None:
+                    self.server.rtp.sendBatch([packet], addr)
+                    self.stats.audio.record([packet])
+            deadline += interval
+            await asyncio.sleep(max(deadline - self.loop.time(), 0))
+
+    async def listenAsync(self):
+        while True:
+            try:
+                data = await self.reader.read(MAX_RTSP_BANDWIDTH)
+            except ConnectionError:
+                break
+            if not data:
+                break
+            try:
+                await self.loop.run_in_executor(None, self.handleRtspRequest, data.decode('utf-8'))
+            except Exception:
+                if self.client_teardown:
+                    break
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+        self.dropSession()
+        self.writer.close()
+
+
+class AsyncServer:
+    def __init__(self, port=SERVER_RTSP_PORT, workers=ASYNC_MEDIA_WORKERS):
+        self.port = port
+        self.workers = workers
+        self.loop = None
+        self.rtp = None
+        self.executor = None
+
+    async def handleConnection(self, reader, writer):
+        print('connected to', writer.get_extra_info('peername'), '...')
+        worker = AsyncServerWorker(self, reader, writer)
+        await worker.listenAsync()
+
+    async def serve(self, max_connections=ASYNC_BACKLOG):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        _, self.rtp = await self.loop.create_datagram_endpoint(RtpProtocol, local_addr=('0.0.0.0', SERVER_RTP_PORT))
+        server = await asyncio.start_server(self.handleConnection, '0.0.0.0', self.port, backlog=max_connections)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, max_connections=ASYNC_BACKLOG):
+        asyncio.run(self.serve(max_connections))
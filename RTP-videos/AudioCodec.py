@@ -0,0 +1,172 @@
+'''
+音频负载编解码
+97: 原始float32立体声；96: L16，网络字节序的int16立体声；98: IMA-ADPCM，每个样本4比特
+ADPCM负载格式：头部(样本数, 块长) | 各通道各块的初始预测值(int16) | 初始步长序号(uint8) | 按块排列的4比特码
+每个块独立编码，所有块作为NumPy数组的各个分量并行迭代，不需要逐样本的Python循环
+'''
+
+import struct
+import numpy as np
+from Constants import *
+
+AUDIO_PAYLOAD_NAMES = {
+    AUDIO_PAYLOAD_FLOAT: 'FLOAT32',
+    AUDIO_PAYLOAD_L16: 'L16',
+    AUDIO_PAYLOAD_ADPCM: 'IMA-ADPCM'
+}
+
+ADPCM_HEADER = struct.Struct('!IH')
+
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+], dtype=np.int32)
+
+INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+
+def toInt16(samples):
+    '''
+    :param samples: [-1, 1] 范围内的float32数组
+    :return: 同形状的int16数组
+    '''
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def encodeL16(samples):
+    return toInt16(samples).astype('>i2').tobytes()
+
+
+def decodeL16(payload):
+    return np.frombuffer(payload, dtype='>i2').astype(np.int16)
+
+
+def initialIndex(lanes):
+    '''按每块相邻样本差的平均幅度选择初始步长，使各块开头就能跟上信号'''
+    diff = np.abs(np.diff(lanes, axis=1)).mean(axis=1) if lanes.shape[1] > 1 else np.zeros(len(lanes))
+    return np.clip(np.searchsorted(STEP_TABLE, diff), 0, len(STEP_TABLE) - 1).astype(np.int32)
+
+
+def adpcmStep(code, predictor, index):
+    '''
+    按4比特码更新预测值和步长序号
+    :return: (新预测值, 新步长序号)
+    '''
+    step = STEP_TABLE[index]
+    delta = (step >> 3) + step * (code >> 2 & 1) + (step >> 1) * (code >> 1 & 1) + (step >> 2) * (code & 1)
+    predictor = np.clip(np.where(code & 8, predictor - delta, predictor + delta), -32768, 32767)
+    index = np.clip(index + INDEX_TABLE[code], 0, len(STEP_TABLE) - 1)
+    return predictor, index
+
+
+def encodeAdpcm(samples, block=ADPCM_BLOCK):
+    '''
+    :param samples: 形状为 (样本数, 2) 的float32数组
+    :param block: 每块的样本数
+    :return: ADPCM负载
+    '''
+    pcm = toInt16(samples).astype(np.int32)
+    count, channels = pcm.shape
+    blocks = max((count + block - 1) // block, 1)
+    padded = np.zeros((channels, blocks * block), dtype=np.int32)
+    padded[:, :count] = pcm.T
+    padded[:, count:] = padded[:, count - 1:count] if count > 0 else 0
+    lanes = padded.reshape(channels * blocks, block)
+    predictor = lanes[:, 0].copy()
+    index = initialIndex(lanes)
+    first_predictor, first_index = predictor.copy(), index.copy()
+    codes = np.zeros(lanes.shape, dtype=np.uint8)
+    for t in range(1, block):
+        diff = lanes[:, t] - predictor
+        negative = diff < 0
+        diff = np.abs(diff)
+        step = STEP_TABLE[index]
+        high = diff >= step
+        diff -= step * high
+        middle = diff >= step >> 1
+        diff -= (step >> 1) * middle
+        low = diff >= step >> 2
+        delta = (step >> 3) + step * high + (step >> 1) * middle + (step >> 2) * low
+        predictor = np.clip(np.where(negative, predictor - delta, predictor + delta), -32768, 32767)
+        code = negative * 8 + high * 4 + middle * 2 + low
+        index = np.clip(index + INDEX_TABLE[code], 0, len(STEP_TABLE) - 1)
+        codes[:, t] = code
+    nibbles = (codes[:, 0::2] << 4) | codes[:, 1::2]
+    return b''.join((
+        ADPCM_HEADER.pack(count, block),
+        first_predictor.astype('>i2').tobytes(),
+        first_index.astype(np.uint8).tobytes(),
+        nibbles.tobytes()
+    ))
+
+
+def decodeAdpcm(payload, channels=2):
+    '''
+    :param payload: ADPCM负载
+    :param channels: 声道数
+    :return: 交错排列的int16样本
+    '''
+    count, block = ADPCM_HEADER.unpack_from(payload)
+    blocks = max((count + block - 1) // block, 1)
+    total = channels * blocks
+    offset = ADPCM_HEADER.size
+    predictor = np.frombuffer(payload, dtype='>i2', count=total, offset=offset).astype(np.int32)
+    offset += 2 * total
+    index = np.frombuffer(payload, dtype=np.uint8, count=total, offset=offset).astype(np.int32)
+    offset += total
+    nibbles = np.frombuffer(payload, dtype=np.uint8, count=total * (block // 2), offset=offset)
+    nibbles = nibbles.reshape(total, block // 2)
+    codes = np.empty((total, block), dtype=np.int32)
+    codes[:, 0::2] = nibbles >> 4
+    codes[:, 1::2] = nibbles & 15
+    lanes = np.empty((total, block), dtype=np.int16)
+    lanes[:, 0] = predictor
+    for t in range(1, block):
+        predictor, index = adpcmStep(codes[:, t], predictor, index)
+        lanes[:, t] = predictor
+    return lanes.reshape(channels, blocks * block)[:, :count].T.copy()
+
+
+def encodeAudio(payload_type, samples):
+    '''
+    :param payload_type: 负载类型
+    :param samples: 形状为 (样本数, 2) 的float32数组
+    :return: RTP负载
+    '''
+    if payload_type == AUDIO_PAYLOAD_L16:
+        return encodeL16(samples)
+    if payload_type == AUDIO_PAYLOAD_ADPCM:
+        return encodeAdpcm(samples)
+    return memoryview(np.ascontiguousarray(samples, dtype=np.float32)).cast('B')
+
+
+def decodeAudio(payload_type, payload):
+    '''
+    :param payload_type: 负载类型
+    :param payload: RTP负载
+    :return: 可以直接写入声卡的数据，样本格式见audioDtype
+    '''
+    if payload_type == AUDIO_PAYLOAD_L16:
+        return decodeL16(payload)
+    if payload_type == AUDIO_PAYLOAD_ADPCM:
+        return decodeAdpcm(payload)
+    return payload
+
+
+def audioDtype(payload_type):
+    return 'float32' if payload_type == AUDIO_PAYLOAD_FLOAT else 'int16'
+
+
+def chooseAudioPayload(offered):
+    '''
+    :param offered: 服务器在SDP中提供的负载类型
+    :return: 按客户端偏好选出的负载类型
+    '''
+    for payload_type in AUDIO_PAYLOAD_PREFERENCE:
+        if payload_type in offered:
+            return payload_type
+    return AUDIO_PAYLOAD_FLOAT
@@ -0,0 +1,122 @@
+import os
+import threading
+import numpy as np
+from Constants import *
+
+
+def pcmCacheName(filename):
+    return os.path.splitext(filename)[0] + PCM_CACHE_SUFFIX
+
+
+def decodeBlock(clip, start, end, channels=2):
+    '''
+    一次解码一段音频
+    :param clip: moviepy的AudioFileClip
+    :param start: 开始样本序号
+    :param end: 结束样本序号（不含）
+    :param channels: 输出的声道数
+    :return: 形状为 (样本数, channels) 的float32数组
+    '''
+    block = np.empty((max(end - start, 0), channels), dtype=np.float32)
+    for offset in range(start, end, AUDIO_DECODE_CHUNK):
+        stop = min(offset + AUDIO_DECODE_CHUNK, end)
+        piece = clip.get_frame(np.arange(offset, stop) / clip.fps)
+        piece = np.asarray(piece, dtype=np.float32).reshape(-1, clip.nchannels)
+        block[offset - start:stop - start] = piece[:, :channels] if clip.nchannels >= channels else piece[:, :1]
+    return block
+
+
+class ClipSamples:
+    '''按大块解码音频轨道，块内的读取直接返回切片'''
+
+    def __init__(self, clip, block_seconds=AUDIO_BLOCK_SECONDS):
+        self.clip = clip
+        self.block_size = int(block_seconds * clip.fps)
+        self.total = int(clip.duration * clip.fps)
+        self.block_start = 0
+        self.block = np.zeros((0, 2), dtype=np.float32)
+
+    def __len__(self):
+        return self.total
+
+    def load(self, start):
+        self.block_start = start - start % self.block_size
+        end = min(self.block_start + self.block_size, self.total)
+        self.block = decodeBlock(self.clip, self.block_start, end)
+
+    def __getitem__(self, index):
+        start, stop = index.start, min(index.stop, self.total)
+        if start >= stop:
+            return self.block[:0]
+        if not self.block_start <= start < self.block_start + len(self.block):
+            self.load(start)
+        offset = start - self.block_start
+        if stop - self.block_start <= len(self.block):
+            return self.block[offset:stop - self.block_start]
+        head = self.block[offset:]
+        self.load(self.block_start + self.block_size)
+        return np.concatenate((head, self.block[:stop - self.block_start]))
+
+
+def buildPcmCache(filename):
+    '''把整条音轨解码成float32写入.npy文件，之后可以直接内存映射'''
+    from moviepy.editor import AudioFileClip
+    clip = AudioFileClip(filename)
+    name = pcmCacheName(filename)
+    total = int(clip.duration * clip.fps)
+    block_size = int(AUDIO_BLOCK_SECONDS * clip.fps)
+    try:
+        samples = np.lib.format.open_memmap(name + '.tmp', mode='w+', dtype=np.float32, shape=(total, 2))
+        for start in range(0, total, block_size):
+            end = min(start + block_size, total)
+            block = decodeBlock(clip, start, end)
+            samples[start:start + len(block)] = block
+        samples.flush()
+        del samples
+        os.replace(name + '.tmp', name)
+    except OSError:
+        # 写到一半失败时删掉临时文件，并允许之后的会话重新生成
+        try:
+            os.remove(name + '.tmp')
+        except OSError:
+            pass
+        with pcm_lock:
+            pcm_builds.pop(filename, None)
+    finally:
+        clip.close()
+
+
+pcm_builds = {}
+pcm_lock = threading.Lock()
+pcm_cache_enabled = AUDIO_PCM_CACHE
+
+
+def configurePcmCache(enabled):
+    '''
+    :param enabled: 是否在媒体文件旁生成PCM缓存，关闭时只使用已有的缓存
+    '''
+    global pcm_cache_enabled
+    pcm_cache_enabled = enabled
+
+
+def openPcm(filename):
+    '''
+    打开媒体文件的PCM缓存；没有缓存且允许生成时在后台线程中生成，本次返回None
+    :param filename: 原始媒体文件名
+    :return: 内存映射的 (样本数, 2) float32数组，或None
+    '''
+    name = pcmCacheName(filename)
+    if os.path.exists(name) and os.path.getmtime(name) >= os.path.getmtime(filename):
+        try:
+            return np.load(name, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+    if not pcm_cache_enabled:
+        return None
+    with pcm_lock:
+        if filename not in pcm_builds:
+            builder = threading.Thread(target=buildPcmCache, args=(filename,))
+            builder.setDaemon(True)
+            builder.start()
+            pcm_builds[filename] = builder
+    return None
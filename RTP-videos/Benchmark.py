@@ -0,0 +1,322 @@
+'''
+端到端性能测试
+在工作目录中生成合成的测试视频和字幕：视频帧由NumPy生成、OpenCV写入，音轨由NumPy生成后用moviepy附带的ffmpeg合入
+然后在回环地址上启动Server.py，用LoadClient按不同并发数驱动会话
+记录每个会话的帧率、每个会话占用的服务器CPU、服务器内存峰值、包速率和跳转时间，结果写成JSON，便于在提交之间比较
+
+用法：python Benchmark.py --sessions 1,10,50 --seconds 10 --output results.json [--baseline old.json]
+传给服务器的选项以短横线开头，要写成 --server-args=--async 或 --server-args="--async --encode-workers 2"
+'''
+
+import os
+import sys
+import json
+import time
+import wave
+import shlex
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import datetime
+import resource
+import cv2
+import numpy as np
+import srt
+from Constants import *
+from LoadClient import runSessions, parseScript, summarize
+from RtspTools import setVerbose
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Server.py')
+COMPARED_METRICS = (
+    ('fps_mean', 1),
+    ('cpu_per_session', -1),
+    ('server_rss_peak_mb', -1),
+    ('seek_ms_mean', -1),
+    ('first_frame_ms_mean', -1)
+)
+
+
+def writeVideo(filename, seconds, framerate, size):
+    '''
+    生成无声视频：滚动的彩条叠加噪声纹理和帧号，画面每帧都在变化，JPEG大小接近真实视频
+    '''
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    bars = np.stack([np.tile(x, (height, 1)),
+                     np.tile(x[::-1], (height, 1)),
+                     np.tile(np.linspace(0, 255, height, dtype=np.float32)[:, None], (1, width))], axis=2)
+    texture = np.random.default_rng(0).normal(0, 24, (height, width, 3)).astype(np.float32)
+    texture = cv2.GaussianBlur(texture, (5, 5), 1.5)
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'mp4v'), framerate, size)
+    for index in range(int(seconds * framerate)):
+        shift = (index * 4) % width
+        frame = np.clip(np.roll(bars, shift, axis=1) + np.roll(texture, index, axis=0), 0, 255).astype(np.uint8)
+        cv2.putText(frame, '%06d' % index, (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+
+
+def writeAudio(filename, seconds, samplerate):
+    '''生成立体声16位WAV：左右声道是频率缓慢变化的正弦波'''
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    left = 0.3 * np.sin(2 * np.pi * (220 + 20 * np.sin(t)) * t)
+    right = 0.3 * np.sin(2 * np.pi * 330 * t)
+    samples = (np.stack([left, right], axis=1) * 32767).astype('<i2')
+    with wave.open(filename, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(samplerate)
+        f.writeframes(samples.tobytes())
+
+
+def writeSubtitles(filename, seconds, interval=2.0):
+    '''每隔interval秒一条字幕，每条显示interval的一半'''
+    cues = []
+    for (i, start) in enumerate(np.arange(0, seconds, interval)):
+        cues.append(srt.Subtitle(i + 1, datetime.timedelta(seconds=float(start)),
+                                 datetime.timedelta(seconds=float(start + interval / 2)), 'Cue %d' % (i + 1)))
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(srt.compose(cues))
+
+
+def makeSyntheticMedia(directory, seconds, framerate=BENCH_FRAMERATE, size=HIGH_RESOLUTION,
+                       samplerate=DEFAULT_AUDIO_SAMPLERATE):
+    '''
+    在 directory/videos 下生成测试视频和同名字幕，参数相同的文件已存在时直接复用
+    :return: 视频文件名（不含目录）
+    '''
+    from imageio_ffmpeg import get_ffmpeg_exe
+    name = 'bench_%dx%d_%g_%d' % (size[0], size[1], framerate, seconds)
+    videos = os.path.join(directory, FILENAME_PREFIX)
+    os.makedirs(videos, exist_ok=True)
+    target = os.path.join(videos, name + '.mp4')
+    if os.path.exists(target):
+        return name + '.mp4'
+    silent = os.path.join(videos, name + '.video.mp4')
+    audio = os.path.join(videos, name + '.wav')
+    writeVideo(silent, seconds, framerate, size)
+    writeAudio(audio, seconds, samplerate)
+    subprocess.run([get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-i', silent, '-i', audio,
+                    '-c:v', 'copy', '-c:a', 'aac', '-shortest', target + '.tmp.mp4'], check=True)
+    os.replace(target + '.tmp.mp4', target)
+    os.remove(silent)
+    os.remove(audio)
+    writeSubtitles(os.path.join(videos, name + '.srt'), seconds)
+    return name + '.mp4'
+
+
+def readCpuSeconds(pid):
+    '''
+    :return: 进程累计的用户态和内核态CPU时间（秒），不支持/proc时为None
+    '''
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def readRssMb(pid):
+    '''
+    :return: 进程当前的常驻内存（MB），不支持/proc时为None
+    '''
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class ServerProcess:
+    '''在子进程中运行Server.py，并定期采样其内存'''
+
+    def __init__(self, directory, port, extra_args=()):
+        self.directory = directory
+        self.port = port
+        self.extra_args = list(extra_args)
+        self.process = None
+        self.log = None
+        self.rss_peak = None
+        self.sampler = None
+
+    def start(self):
+        self.log = open(os.path.join(self.directory, 'server_%d.log' % self.port), 'w')
+        command = [sys.executable, SERVER_SCRIPT, '--port', str(self.port), '--quiet'] + self.extra_args
+        self.process = subprocess.Popen(command, cwd=self.directory, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + BENCH_SERVER_STARTUP
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('server exited, see %s' % self.log.name)
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError('server did not start listening on port %d' % self.port)
+        self.sampler = threading.Thread(target=self.sample)
+        self.sampler.setDaemon(True)
+        self.sampler.start()
+
+    def sample(self):
+        while self.process.poll() is None:
+            rss = readRssMb(self.process.pid)
+            if rss is not None:
+                self.rss_peak = max(self.rss_peak or 0, rss)
+            time.sleep(BENCH_SAMPLE_INTERVAL)
+
+    def cpuSeconds(self):
+        return readCpuSeconds(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+def runLevel(directory, filename, sessions, seconds, port, rtp_base, server_args=()):
+    '''
+    启动一个新的服务器，运行一轮指定并发数的测试
+    每个会话先播放一半时长，跳转到中间位置，再播放另一半
+    :return: 该并发数下的结果
+    '''
+    script = parseScript('play:%g,seek:500,play:%g' % (seconds / 2, seconds / 2))
+    server = ServerProcess(directory, port, server_args)
+    server.start()
+    try:
+        cpu_before = server.cpuSeconds()
+        client_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.monotonic()
+        reports = runSessions('127.0.0.1', port, sessions, script, filename, rtp_base, ramp=BENCH_RAMP)
+        wall = time.monotonic() - started
+        cpu_after = server.cpuSeconds()
+        client_after = resource.getrusage(resource.RUSAGE_SELF)
+        rss_now = readRssMb(server.process.pid)
+    finally:
+        server.stop()
+    ok = [report for report in reports if report['error'] is None]
+    seeks = [report['seek_ms']['mean'] / 1000 for report in ok if report['seek_ms'] is not None]
+    first_frames = [report['first_frame_ms'] / 1000 for report in ok if report['first_frame_ms'] is not None]
+    server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    fps = [report['fps'] for report in ok]
+    seek = summarize(seeks)
+    first_frame = summarize(first_frames)
+    return {
+        'sessions': sessions,
+        'failed': len(reports) - len(ok),
+        'wall_seconds': wall,
+        'fps_mean': sum(fps) / len(fps) if fps else 0.0,
+        'fps_min': min(fps, default=0.0),
+        'fps_per_session': fps,
+        'video_loss_mean': sum(report['video_loss'] for report in ok) / len(ok) if ok else 0.0,
+        'packet_rate': sum(report['packets'] for report in ok) / wall,
+        'mbps_total': sum(report['mbps'] for report in ok),
+        'server_cpu_seconds': server_cpu,
+        'cpu_per_session': server_cpu / wall / sessions if server_cpu is not None else None,
+        'client_cpu_seconds': (client_after.ru_utime + client_after.ru_stime
+                               - client_before.ru_utime - client_before.ru_stime),
+        'server_rss_peak_mb': max(filter(None, (server.rss_peak, rss_now)), default=None),
+        'seek_ms_mean': seek['mean'] if seek else None,
+        'seek_ms_max': seek['max'] if seek else None,
+        'first_frame_ms_mean': first_frame['mean'] if first_frame else None,
+        'first_frame_ms_max': first_frame['max'] if first_frame else None
+    }
+
+
+def gitRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(SERVER_SCRIPT)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compareResults(current, baseline, threshold=BENCH_REGRESSION):
+    '''
+    按并发数对比两次结果，变差超过threshold（相对值）的指标视为退化
+    :return: [(并发数, 指标, 基线值, 当前值, 是否退化), ...]
+    '''
+    previous = {level['sessions']: level for level in baseline.get('levels', [])}
+    rows = []
+    for level in current['levels']:
+        old = previous.get(level['sessions'])
+        if old is None:
+            continue
+        for (metric, direction) in COMPARED_METRICS:
+            before, after = old.get(metric), level.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * direction
+            rows.append((level['sessions'], metric, before, after, change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', default='1,10,50', help='comma separated concurrency levels')
+    parser.add_argument('--seconds', type=float, default=10, help='playing time of every session')
+    parser.add_argument('--workdir', default=None, help='where media and server logs are kept, reused between runs')
+    parser.add_argument('--port', type=int, default=BENCH_PORT)
+    parser.add_argument('--rtp-base', type=int, default=LOAD_RTP_BASE)
+    parser.add_argument('--pack', action='store_true', help='serve the media from a MediaPack container')
+    parser.add_argument('--server-args', default='',
+                        help='extra Server.py arguments; use the = form because they start with a dash, '
+                             'e.g. --server-args=--async or --server-args="--async --encode-workers 2"')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', default=None, help='earlier results to compare against')
+    args = parser.parse_args()
+    setVerbose(False)
+
+    directory = args.workdir or tempfile.mkdtemp(prefix='rtp-bench-')
+    os.makedirs(directory, exist_ok=True)
+    filename = makeSyntheticMedia(directory, 2 * args.seconds + BENCH_MEDIA_MARGIN)
+    media = os.path.join(directory, FILENAME_PREFIX, filename)
+    if args.pack:
+        from MediaPack import MediaPacker, packName
+        if not os.path.exists(packName(media)):
+            MediaPacker(media).run()
+
+    levels = []
+    for (i, sessions) in enumerate(int(value) for value in args.sessions.split(',')):
+        print('running %d session(s) ...' % sessions)
+        level = runLevel(directory, filename, sessions, args.seconds, args.port + i, args.rtp_base,
+                         shlex.split(args.server_args))
+        print('  %.1f fps (min %.1f), %.3f cores/session, %.0f MB, %.0f packets/s, seek %s ms' % (
+            level['fps_mean'], level['fps_min'], level['cpu_per_session'] or 0, level['server_rss_peak_mb'] or 0,
+            level['packet_rate'], '%.0f' % level['seek_ms_mean'] if level['seek_ms_mean'] is not None else '-'))
+        levels.append(level)
+
+    results = {
+        'revision': gitRevision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {'python': platform.python_version(), 'system': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {'seconds': args.seconds, 'media': filename, 'pack': args.pack, 'server_args': args.server_args},
+        'levels': levels
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('written', args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for (sessions, metric, before, after, regressed) in compareResults(results, baseline):
+            print('%4d %-20s %10.3f -> %10.3f%s' % (sessions, metric, before, after, '  REGRESSION' if regressed else ''))
+    if args.workdir is None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
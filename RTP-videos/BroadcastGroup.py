@@ -0,0 +1,151 @@
+'''
+广播组
+在一个时间窗口内从头播放同一文件、且分辨率、倍速和音频格式都相同的会话共用一条生产流水线
+每帧只解码编码一次，同样的包通过调度器发往组内每个成员的地址，同一刻度的包合并成一次批量发送
+'''
+
+import time
+import threading
+from Constants import *
+from MediaStream import VideoStream, AudioStream, SubtitleStream
+from PacingScheduler import getPacingScheduler
+
+
+class BroadcastGroup:
+    def __init__(self, key, media, sender):
+        self.key = key
+        self.media = media
+        self.sender = sender
+        _, lowres, step, audio_payload = key
+        self.event = threading.Event()
+        self.video_stream = VideoStream(media, self.event, step=step, lowres=lowres)
+        self.framerate = self.video_stream.getFramerate()
+        self.subtitle_stream = SubtitleStream(media, self.framerate)
+        self.audio_stream = AudioStream(media, self.event, step=step, vfps=self.framerate,
+                                        seekindex=self.video_stream.getSeekIndex())
+        self.audio_stream.setPayloadType(audio_payload)
+        self.members = {}
+        self.lock = threading.Lock()
+        self.created = time.monotonic()
+        self.closed = False
+        self.pacer = getPacingScheduler()
+        self.thread = None
+
+    def isJoinable(self, window):
+        return not self.closed and time.monotonic() - self.created <= window
+
+    def join(self, session_id, addr, stats):
+        with self.lock:
+            self.members[session_id] = (addr, stats)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def leave(self, session_id):
+        '''
+        :return: 组内剩余的成员数
+        '''
+        with self.lock:
+            self.members.pop(session_id, None)
+            remaining = len(self.members)
+            if remaining == 0:
+                self.close()
+        return remaining
+
+    def close(self):
+        self.closed = True
+        self.video_stream.close()
+        self.audio_stream.close()
+
+    def getSequenceNumbers(self):
+        '''
+        :return: (视频序号, 音频序号)，离开组的会话从这里继续编号，接收端不会把后续的包当作过期包丢弃
+        '''
+        return self.video_stream.frameseq, self.audio_stream.frameseq
+
+    def fanOut(self, packets, media_type, deadline, spread=0.0):
+        with self.lock:
+            members = list(self.members.values())
+        for (addr, stats) in members:
+            self.pacer.schedule(self.sender, packets, addr, deadline, spread)
+            if media_type == VIDEO:
+                stats.video.record(packets)
+            elif media_type == AUDIO:
+                stats.audio.record(packets)
+
+    def run(self):
+        interval = 1 / self.framerate if self.framerate > 0 else 1 / DEFAULT_VIDEO_FRAMERATE
+        start = time.monotonic()
+        frames = 0
+        self.event.set()
+        self.video_stream.yieldFrame()
+        self.audio_stream.yieldFrame()
+        while not self.closed:
+            packets = self.video_stream.nextFrame(RTP_TIMEOUT)
+            if packets is None:
+                continue
+            deadline = start + frames * interval
+            frames += 1
+            self.pacer.waitUntil(deadline - PACING_LEAD)
+            self.fanOut(packets, VIDEO, deadline, interval)
+            text = self.subtitle_stream.nextPackets(self.video_stream.timestamp)
+            if text:
+                self.fanOut(text, SUBTITLE, deadline)
+            if frames % AUDIO_FRAMES_PER_CHUNK == 0:
+                packet = self.audio_stream.nextFrame(RTP_TIMEOUT)
+                if packet is not None:
+                    self.fanOut([packet], AUDIO, deadline)
+
+
+class BroadcastRegistry:
+    '''按播放设置查找可以加入的广播组，window为0时不启用广播'''
+
+    def __init__(self, window=BROADCAST_WINDOW):
+        self.window = window
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def join(self, key, media, sender, session_id, addr, stats):
+        '''
+        加入或新建一个广播组
+        :param key: (文件名, 是否低分辨率, 倍速, 音频负载类型)
+        :param media: 媒体文件路径
+        :param sender: 新建组时使用的BatchSender
+        :param session_id: 会话号
+        :param addr: 成员的RTP地址
+        :param stats: 成员的SessionStats，记录发给它的包
+        :return: 加入的广播组
+        '''
+        with self.lock:
+            group = self.groups.get(key)
+            if group is not None and group.isJoinable(self.window):
+                group.join(session_id, addr, stats)
+                return group
+        # 新建组要打开媒体文件，在锁外进行，不阻塞其他内容的会话；插入前再查一次，同时新建的会话只保留一个组
+        created = BroadcastGroup(key, media, sender)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None or not group.isJoinable(self.window):
+                group, created = created, None
+                self.groups[key] = group
+            group.join(session_id, addr, stats)
+        if created is not None:
+            created.close()
+        return group
+
+    def leave(self, group, session_id):
+        with self.lock:
+            if group.leave(session_id) == 0 and self.groups.get(group.key) is group:
+                del self.groups[group.key]
+
+
+broadcast_registry = BroadcastRegistry()
+
+
+def configureBroadcast(window):
+    broadcast_registry.window = window
+
+
+def getBroadcastRegistry():
+    return broadcast_registry
@@ -1,14 +1,22 @@
-import socket, threading
-from RtpPacket import RtpPacket
-from utils import LinkList
+import socket, threading, time, random
+from RtpPacket import HEADER_SIZE, parseHeader
+from RtpJpeg import unpackJpegHeader, JPEG_HEADER_SIZE
+from RtpText import unpackCue, CueTrack
+from AudioCodec import chooseAudioPayload, decodeAudio, audioDtype
+from RtcpPacket import splitCompound, RTCP_SR
+from RtcpStats import ReceiverStats
+from JitterBuffer import JitterBuffer
+from FrameAssembler import FrameAssembler
+from FrameDecoder import FrameDecoder
+from Preroll import PrerollController
+from SubtitleOverlay import drawSubtitleImage
+from utils import RingBuffer
 import sounddevice as sd
 from Exception import *
 from Constants import *
 from RtspTools import ResponseParser, RequestSender
 from ClientUI import ClientUI
 from tkinter import Tk
-from PIL import Image
-from io import BytesIO
 
 
 class ClientController:
@@ -31,25 +39,32 @@ class ClientController:
 
         self.rtp_socket = None
         self.rtsp_socket = None
+        self.rtcp_socket = None
+        self.server_rtcp_port = SERVER_RTCP_PORT
+        self.reception_stats = None
 
         self.video_framerate = 0
         self.audio_samplerate = 0
+        self.audio_payload = AUDIO_PAYLOAD_FLOAT
+        self.subtitle_payload = None
         self.total_frames = 0
-        self.video_frame_seq = 0
-        self.audio_frame_seq = 0
-        self.frame_buffer = b''
-        self.video_buffer = LinkList()
-        self.audio_buffer = LinkList()
+        self.cues = CueTrack()
+        self.video_jitter = JitterBuffer(isStart=lambda fragment: fragment[0] == 0)
+        self.assembler = FrameAssembler()
+        self.audio_jitter = JitterBuffer()
+        self.receive_reset = False
+        self.video_buffer = RingBuffer(CLIENT_VIDEO_BUFFER)
+        self.audio_buffer = RingBuffer(CLIENT_AUDIO_BUFFER)
+        self.decoder = FrameDecoder(lambda timeout: self.video_buffer.pop(timeout), self.getDisplayTarget)
+        self.preroll = PrerollController(self.getBufferedMs)
 
         self.video_thread = None
         self.audio_thread = None
         self.receive_thread = None
         self.listen_thread = None
+        self.rtcp_thread = None
 
         self.event = None
-        self.video_consume_semaphore = None
-        self.audio_consume_semaphore = None
-        self.synchronize_semaphore = None
         self.current_timestamp = 0
 
         self.step = 1
@@ -62,7 +77,6 @@ class ClientController:
         self.fullscreen = False
         self.changeFullscreen = False
         self.subtitleRequired = False
-        self.switchSubtitle = False
 
     def connect(self):
         self.rtsp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -90,19 +104,52 @@ class ClientController:
 
     def play(self):
         if self.state == READY:
+            self.restartDecoder()
+            self.resetReception()
+            self.preroll.reset()
+            self.cues.clear()
             self.event.set()
             self.createThreads()
             self.sendPlay()
 
     def reposition(self, permillage):
         if self.state == READY:
-            self.video_buffer = LinkList()
-            self.audio_buffer = LinkList()
+            self.video_buffer = RingBuffer(CLIENT_VIDEO_BUFFER)
+            self.audio_buffer = RingBuffer(CLIENT_AUDIO_BUFFER)
             startPosition = int(permillage / 1000 * self.total_frames)
+            self.restartDecoder()
+            self.resetReception()
+            self.preroll.reset()
+            self.cues.clear()
             self.sendReposition(startPosition)
             self.event.set()
 
+    def restartDecoder(self):
+        '''暂停或跳转后丢弃解码中的旧帧，播放时钟按当前帧率和倍速重新对齐'''
+        self.decoder.flush()
+        self.decoder.clock.setRate(self.video_framerate, self.step)
+
+    def resetReception(self):
+        '''暂停或跳转前收到的残帧不再等待，由接收线程在处理下一个包之前清空抖动缓冲区和拼装缓冲区'''
+        self.receive_reset = True
+
+    def getDisplayTarget(self):
+        '''
+        :return: (显示尺寸, 是否使用快速缩放)，全屏时放大到屏幕尺寸
+        '''
+        if self.fullscreen:
+            return (self.screen_width, self.screen_height), True
+        return HIGH_RESOLUTION, False
+
+    def getBufferedMs(self):
+        '''
+        :return: 已收到但还没显示的视频时长（毫秒），包括已解码等待显示的帧
+        '''
+        framerate = self.video_framerate if self.video_framerate > 0 else DEFAULT_VIDEO_FRAMERATE
+        return (self.video_buffer.len() + self.decoder.decoded.len()) * 1000 / framerate
+
     def createThreads(self):
+        self.decoder.start(backlog=lambda: self.video_buffer.len())
         if self.audio_thread is None:
             self.audio_thread = threading.Thread(target=self.playAudio)
             self.audio_thread.setDaemon(True)
@@ -115,90 +162,138 @@ class ClientController:
             self.listen_thread = threading.Thread(target=self.listenForRtp)
             self.listen_thread.setDaemon(True)
             self.listen_thread.start()
+        if self.rtcp_thread is None:
+            self.rtcp_thread = threading.Thread(target=self.exchangeRtcp)
+            self.rtcp_thread.setDaemon(True)
+            self.rtcp_thread.start()
 
     def playVideo(self):
-        while self.video_buffer.len() < 20:
-            pass
         while True:
             try:
                 if self.teardown_acked:
                     return
                 self.event.wait()
-                self.video_consume_semaphore.acquire()
-                current_frame, self.current_timestamp = self.retrieveFrame(mediatype=VIDEO)
-                current_image = Image.open(BytesIO(current_frame))
-                if self.fullscreen:
-                    current_image = current_image.resize((self.screen_width, self.screen_height), Image.ANTIALIAS)
-                elif self.low_resolution:
-                    current_image = current_image.resize((480, 270), Image.ANTIALIAS)
+                if not self.preroll.waitForPlayback():
+                    continue
+                frame = self.decoder.nextFrame()
+                if frame is None:
+                    continue
+                current_image, timestamp = frame
+                if not self.decoder.waitForDisplay(timestamp, self.video_control_event.wait):
+                    continue
+                self.current_timestamp = timestamp
+                if self.subtitleRequired:
+                    drawSubtitleImage(current_image, self.cues.lookup(timestamp))
                 self.client_ui.updateMovie(current_image)
-                if not self.fullscreen:
-                    self.video_control_event.wait(TIME_ELAPSED)
             except:
                 continue
 
     def playAudio(self):
-        while self.video_buffer.len() < 20:
-            pass
         while True:
             try:
                 if self.teardown_acked:
                     return
                 self.event.wait()
-                self.audio_consume_semaphore.acquire()
-                if not self.is_mute:
-                    self.audio_stream.write(self.retrieveFrame(mediatype=AUDIO))
+                if not self.preroll.waitForPlayback():
+                    continue
+                frame = self.retrieveFrame(mediatype=AUDIO)
+                if frame is not None and not self.is_mute:
+                    self.audio_stream.write(decodeAudio(self.audio_payload, frame))
             except:
                 continue
 
     def listenForRtp(self):
+        '''接收RTP包：数据报读入预先分配的缓冲区，头部和分片都通过memoryview解析，不再逐包分配对象'''
         print('\nListening...')
+        buffer = bytearray(MAX_UDP_BANDWIDTH)
+        view = memoryview(buffer)
         while True:
             try:
                 if self.teardown_acked:
                     return
                 self.event.wait()
-                data = self.rtp_socket.recv(MAX_UDP_BANDWIDTH)
-                if data:
-                    packet = RtpPacket()
-                    packet.decode(data)
-                    current_frame_seq = packet.seqNum()
-                    marker = packet.getMarker()
-                    media_type = packet.getType()
-                    self.receiveIncomingPacket(packet, current_frame_seq, marker, media_type)
+                size = self.rtp_socket.recv_into(buffer)
+                if size >= HEADER_SIZE:
+                    self.receiveIncomingPacket(view[:size], time.time())
+            except socket.timeout:
+                continue
             except:
                 break
 
-    def receiveIncomingPacket(self, packet, seq, marker, media_type):
-        if media_type == VIDEO:
-            if seq > self.video_frame_seq:
-                self.video_frame_seq = seq
-                payload = packet.getPayload()
-                timestamp = packet.timestamp()
-                self.restoreFrame(payload, marker, timestamp, VIDEO)
-        if media_type == AUDIO:
-            if seq > self.audio_frame_seq:
-                self.audio_frame_seq = seq
-                payload = packet.getPayload()
-                timestamp = packet.timestamp()
-                self.restoreFrame(payload, marker, timestamp, AUDIO)
-
-    def restoreFrame(self, payload, marker, timestamp, mediatype):
+    def exchangeRtcp(self):
+        '''接收服务器的发送者报告，每隔RTCP_INTERVAL秒回复一个接收者报告'''
+        next_report = time.time() + RTCP_INTERVAL
+        while not self.teardown_acked:
+            try:
+                self.rtcp_socket.settimeout(max(next_report - time.time(), 0.01))
+                data = self.rtcp_socket.recv(MAX_UDP_BANDWIDTH)
+                for packet in splitCompound(data):
+                    if packet.packetType() == RTCP_SR:
+                        self.reception_stats.onSenderReport(packet, time.time())
+            except socket.timeout:
+                pass
+            except OSError:
+                return
+            if time.time() >= next_report:
+                next_report += RTCP_INTERVAL
+                if self.state == PLAYING:
+                    try:
+                        self.rtcp_socket.sendto(self.reception_stats.makeReceiverReport(time.time()),
+                                                (self.server_addr, self.server_rtcp_port))
+                    except OSError:
+                        return
+
+    def receiveIncomingPacket(self, view, arrival):
+        if self.receive_reset:
+            self.receive_reset = False
+            self.video_jitter.reset()
+            self.audio_jitter.reset()
+            self.assembler.reset()
+        seq, marker, payload_type, timestamp = parseHeader(view)
+        if payload_type == VIDEO_PAYLOAD_TYPE:
+            self.reception_stats.onPacket(VIDEO, seq, timestamp, arrival)
+            offset = unpackJpegHeader(view[HEADER_SIZE:])[0]
+            fragment = view[HEADER_SIZE + JPEG_HEADER_SIZE:]
+            if self.video_jitter.accepts(seq):
+                self.assembler.write(timestamp, offset, fragment)
+            frames = self.video_jitter.push(seq, timestamp, marker, (offset, len(fragment)))
+            for (timestamp, fragments) in frames:
+                self.restoreFrame(fragments, timestamp, VIDEO)
+        elif payload_type in AUDIO_PAYLOAD_TYPES:
+            self.reception_stats.onPacket(AUDIO, seq, timestamp, arrival)
+            frames = self.audio_jitter.push(seq, timestamp, marker, bytes(view[HEADER_SIZE:]))
+            for (timestamp, payloads) in frames:
+                self.restoreFrame(payloads, timestamp, AUDIO)
+        elif payload_type == self.subtitle_payload:
+            self.cues.add(*unpackCue(view[HEADER_SIZE:]))
+
+    def restoreFrame(self, payloads, timestamp, mediatype):
+        '''
+        把抖动缓冲区交出的一帧放入播放缓冲区
+        视频分片在收到时已经写入拼装缓冲区，这里只检查各分片的 (偏移, 长度) 是否首尾相接，不相接的帧丢弃
+        '''
         if mediatype == VIDEO:
-            self.frame_buffer += payload
-            if marker:
-                self.video_buffer.push((self.frame_buffer, timestamp))
-                self.video_consume_semaphore.release()
-                self.frame_buffer = b''
+            size = 0
+            for (offset, length) in payloads:
+                if offset != size:
+                    return
+                size += length
+            frame = self.assembler.take(timestamp, size)
+            if frame is not None:
+                self.video_buffer.push((frame, timestamp), 0)
+                if self.total_frames and timestamp + self.step >= self.total_frames:
+                    self.preroll.finish()
+                else:
+                    self.preroll.onData()
         if mediatype == AUDIO:
-            self.audio_buffer.push(payload)
-            self.audio_consume_semaphore.release()
+            for payload in payloads:
+                self.audio_buffer.push(payload, 0)
 
     def retrieveFrame(self, mediatype):
         if mediatype == VIDEO:
-            return self.video_buffer.pop()
+            return self.video_buffer.pop(RTP_TIMEOUT)
         if mediatype == AUDIO:
-            return self.audio_buffer.pop()
+            return self.audio_buffer.pop(RTP_TIMEOUT)
 
     def receiveResponse(self):
         while True:
@@ -227,6 +322,7 @@ class ClientController:
                 status_code = my_parser.getStatusCode()
                 if status_code == 200:
                     if self.request_sent == SETUP:
+                        self.server_rtcp_port = my_parser.getServerPorts()[1]
                         self.handleSetup()
                     if self.request_sent == PLAY:
                         self.handlePlay()
@@ -236,6 +332,8 @@ class ClientController:
                         self.handleTeardown()
                     if self.request_sent == DESCRIBE:
                         self.video_framerate, self.audio_samplerate, self.total_frames = my_parser.getAVParameters()
+                        self.audio_payload = chooseAudioPayload(my_parser.getAudioPayloads())
+                        self.subtitle_payload = my_parser.getSubtitlePayload()
                         print('tf', self.total_frames)
                         self.handleDescribe()
 
@@ -245,9 +343,6 @@ class ClientController:
         self.event = threading.Event()
         self.video_control_event = threading.Event()
         self.audio_control_event = threading.Event()
-        self.video_consume_semaphore = threading.Semaphore(0)
-        self.audio_consume_semaphore = threading.Semaphore(0)
-        self.synchronize_semaphore = threading.Semaphore(0)
 
     def handlePlay(self):
         self.state = PLAYING
@@ -259,23 +354,18 @@ class ClientController:
         self.event.clear()
         if self.changeSpeed:
             self.changeSpeed = False
-            self.video_buffer = LinkList()
-            self.audio_buffer = LinkList()
+            self.video_buffer = RingBuffer(CLIENT_VIDEO_BUFFER)
+            self.audio_buffer = RingBuffer(CLIENT_AUDIO_BUFFER)
             self.play()
         if self.audio_bias_set:
             self.audio_bias_set = False
-            self.video_buffer = LinkList()
-            self.audio_buffer = LinkList()
+            self.video_buffer = RingBuffer(CLIENT_VIDEO_BUFFER)
+            self.audio_buffer = RingBuffer(CLIENT_AUDIO_BUFFER)
             self.play()
         if self.changeResolution:
             self.changeResolution = False
-            self.video_buffer = LinkList()
-            self.audio_buffer = LinkList()
-            self.play()
-        if self.switchSubtitle:
-            self.switchSubtitle = False
-            self.video_buffer = LinkList()
-            self.audio_buffer = LinkList()
+            self.video_buffer = RingBuffer(CLIENT_VIDEO_BUFFER)
+            self.audio_buffer = RingBuffer(CLIENT_AUDIO_BUFFER)
             self.play()
 
     def handleTeardown(self):
@@ -284,7 +374,17 @@ class ClientController:
         self.rtsp_socket.shutdown(socket.SHUT_RDWR)
         self.rtsp_socket.close()
         self.rtp_socket.close()
+        self.rtcp_socket.close()
         self.event.clear()
+        self.decoder.close()
+        print('jitter buffer', self.getJitterStats(), 'dropped before display', self.decoder.dropped)
+        print('buffering', self.preroll.getStats())
+
+    def getJitterStats(self):
+        '''
+        :return: 视频和音频抖动缓冲区的迟到、丢失、重复等统计
+        '''
+        return {'video': self.video_jitter.getStats(), 'audio': self.audio_jitter.getStats()}
 
     def handleDescribe(self):
         self.channels = 2
@@ -292,14 +392,15 @@ class ClientController:
         self.audio_stream = sd.RawOutputStream(
             samplerate=self.audio_samplerate,
             channels=self.channels,
-            dtype='float32'
+            dtype=audioDtype(self.audio_payload)
         )
         self.audio_stream.start()
 
     def sendSetup(self):
         if self.state == INIT:
             self.rtsp_seq += 1
-            my_sender = RequestSender(self.rtsp_socket, self.filename, self.rtp_port, self.rtsp_seq, self.session_id)
+            my_sender = RequestSender(self.rtsp_socket, self.filename, self.rtp_port, self.rtsp_seq, self.session_id,
+                                      audioPayload=self.audio_payload)
             self.request_sent = SETUP
             my_sender.sendSetup()
 
@@ -312,8 +413,7 @@ class ClientController:
                 self.session_id, step=self.step,
                 startPosition=self.current_timestamp,
                 audiobias=self.audio_bias,
-                lowres=self.low_resolution,
-                subtitleRequired=self.subtitleRequired
+                lowres=self.low_resolution
             )
             self.request_sent = PLAY
             my_sender.sendPlay()
@@ -341,8 +441,7 @@ class ClientController:
                 self.session_id, step=self.step,
                 startPosition=startPosition,
                 audiobias=self.audio_bias,
-                lowres=self.low_resolution,
-                subtitleRequired=self.subtitleRequired
+                lowres=self.low_resolution
             )
             self.request_sent = PLAY
             my_sender.sendPlay()
@@ -362,6 +461,12 @@ class ClientController:
             self.rtp_socket.bind(('', self.rtp_port))
         except:
             raise BindError
+        self.rtcp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.rtcp_socket.bind(('', self.rtp_port + 1))
+        except:
+            raise BindError
+        self.reception_stats = ReceiverStats(random.getrandbits(32), self.video_framerate, self.audio_samplerate)
 
     def activateSliderUpdate(self):
         if self.state == PLAYING:
@@ -399,10 +504,8 @@ class ClientController:
         self.fullscreen = isFullscreen
 
     def showSubtitle(self, isSubtitleRequired):
+        '''字幕由服务器的字幕轨单独发送，在本地叠加，切换时不需要重新请求播放'''
         self.subtitleRequired = isSubtitleRequired
-        if self.state == PLAYING:
-            self.switchSubtitle = True
-            self.sendPause()
 
 class Client:
     def __init__(self, serveraddr, serverport, rtpport, url):
@@ -4,13 +4,14 @@ TIME_ELAPSED = 0.017
 
 UNDEFINED, INIT, READY, PLAYING = 0, 1, 2, 3
 NULLREQ, SETUP, PLAY, PAUSE, TEARDOWN, DESCRIBE = -1, 0, 1, 2, 3, 4
-VIDEO, AUDIO = 0, 1
+VIDEO, AUDIO, SUBTITLE = 0, 1, 2
 
 HEADER_SIZE = 12
 RTP_TIMEOUT = 0.5
 RTSP_TIMEOUT = 0.5
 
-MIN_BUFFERING = 20
+PREROLL_LOW_MS = 100
+PREROLL_HIGH_MS = 700
 
 SERVER_RTSP_PORT = 8554
 SERVER_RTP_PORT = 55532
@@ -32,4 +33,103 @@ METHOD_MAP = {
 
 DEFAULT_VIDEO_FRAMERATE = 29.97
 DEFAULT_AUDIO_SAMPLERATE = 44100
-DEFAULT_APV = 4 * int(DEFAULT_AUDIO_SAMPLERATE / DEFAULT_VIDEO_FRAMERATE)
\ No newline at end of file
+DEFAULT_APV = 4 * int(DEFAULT_AUDIO_SAMPLERATE / DEFAULT_VIDEO_FRAMERATE)
+
+HIGH_RESOLUTION = (480, 270)
+LOW_RESOLUTION = (320, 180)
+
+FRAME_CACHE_BUDGET = 256 * 1024 * 1024
+FRAME_CACHE_WAIT = 1.0
+MAX_GRAB_GAP = 30
+
+PACK_SUFFIX = '.pack'
+SEEK_INDEX_SUFFIX = '.seek.npz'
+SEEK_MATCH_FRAMES = 90
+
+ASYNC_BACKLOG = 512
+ASYNC_MEDIA_WORKERS = 8
+AUDIO_FRAMES_PER_CHUNK = 4
+
+RTP_MTU = 1400
+VIDEO_PAYLOAD_TYPE = 26
+UDP_BATCH_SIZE = 64
+STATS_INTERVAL = 5
+
+PACING_TICK = 0.002
+PACING_SLOTS = 1024
+PACING_LEAD = 0.1
+
+SERVER_VIDEO_BUFFER = 8
+SERVER_AUDIO_BUFFER = 4
+CLIENT_VIDEO_BUFFER = 300
+CLIENT_AUDIO_BUFFER = 100
+
+AUDIO_BLOCK_SECONDS = 30
+AUDIO_DECODE_CHUNK = 50000
+AUDIO_PCM_CACHE = False
+PCM_CACHE_SUFFIX = '.pcm.npy'
+
+AUDIO_PAYLOAD_FLOAT = 97
+AUDIO_PAYLOAD_L16 = 96
+AUDIO_PAYLOAD_ADPCM = 98
+AUDIO_PAYLOAD_TYPES = (AUDIO_PAYLOAD_FLOAT, AUDIO_PAYLOAD_L16, AUDIO_PAYLOAD_ADPCM)
+AUDIO_PAYLOAD_PREFERENCE = (AUDIO_PAYLOAD_ADPCM, AUDIO_PAYLOAD_L16, AUDIO_PAYLOAD_FLOAT)
+ADPCM_BLOCK = 64
+
+ENCODE_WORKERS = 0
+ENCODE_QUEUE_DEPTH = 16
+
+BROADCAST_WINDOW = 0
+
+RTCP_INTERVAL = 5
+VIDEO_SSRC = 0
+AUDIO_SSRC = 1
+SUBTITLE_SSRC = 2
+VIDEO_CLOCK_RATE = 90000
+
+JPEG_DEFAULT_QUALITY = 95
+QUALITY_LADDER = [
+    (HIGH_RESOLUTION, 95), (HIGH_RESOLUTION, 70),
+    (LOW_RESOLUTION, 95), (LOW_RESOLUTION, 70), (LOW_RESOLUTION, 45), (LOW_RESOLUTION, 25)
+]
+LADDER_LOSS_DOWN = 0.05
+LADDER_LOSS_UP = 0.01
+LADDER_JITTER_DOWN = 9000
+LADDER_LATE_DOWN = 0.2
+LADDER_LATE_UP = 0.02
+LADDER_HOLD = 2
+
+JITTER_WINDOW = 128
+
+ASSEMBLY_FRAMES = 16
+ASSEMBLY_CAPACITY = 64 * 1024
+
+DECODE_WORKERS = 2
+DECODE_QUEUE_DEPTH = 4
+DECODE_LATE = 0.05
+CLOCK_RESYNC = 1.0
+
+RTSP_RESPONSE_TIMEOUT = 5
+LOAD_RTP_BASE = 40000
+LOAD_RAMP = 0.05
+
+BENCH_PORT = 8654
+BENCH_FRAMERATE = 30
+BENCH_RAMP = 0.02
+BENCH_MEDIA_MARGIN = 5
+BENCH_SERVER_STARTUP = 10
+BENCH_SAMPLE_INTERVAL = 0.5
+BENCH_REGRESSION = 0.1
+
+MICRO_BUDGET = 0.2
+MICRO_REPEAT = 7
+MICRO_ALLOC_OPS = 1000
+MICRO_REGRESSION = 0.5
+MICRO_NOISE_NS = 50
+MICRO_RETRIES = 2
+
+SUBTITLE_ORIGIN = (50, 50)
+SUBTITLE_FONT_SCALE = 0.5
+SUBTITLE_MASK_CACHE = 256
+SUBTITLE_PAYLOAD_TYPE = 99
+SUBTITLE_REPEAT = 1.0
@@ -0,0 +1,140 @@
+'''
+多进程JPEG编码
+解码后的帧写入共享内存中的槽位，工作进程从槽位中读出原图，完成缩放和编码后返回JPEG字节流
+槽位数即队列深度，槽位用完时提交者阻塞，避免解码远远跑在编码前面
+'''
+
+import queue
+import threading
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from Constants import *
+
+
+def encodeImage(frame, size, quality=JPEG_DEFAULT_QUALITY):
+    '''
+    缩放并编码一帧
+    :param frame: 解码后的BGR图像
+    :param size: 输出分辨率
+    :param quality: JPEG质量
+    :return: JPEG字节流
+    '''
+    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+attached = {}
+
+
+def attachArena(name):
+    '''挂载主进程创建的共享内存；共享内存由主进程负责释放，不能让工作进程退出时把它当作泄漏清理掉'''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        arena = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(arena._name, 'shared_memory')
+        return arena
+
+
+def encodeShared(name, offset, shape, size, quality):
+    '''工作进程中执行：从共享内存的槽位中取出原图并编码，每块共享内存在进程内只挂载一次'''
+    arena = attached.get(name)
+    if arena is None:
+        arena = attachArena(name)
+        attached[name] = arena
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=arena.buf, offset=offset)
+    return encodeImage(frame, size, quality)
+
+
+class SlotArena:
+    '''一块共享内存，分成depth个大小相同的槽位，每个槽位放一帧原图'''
+
+    def __init__(self, slot_bytes, depth):
+        self.slot_bytes = slot_bytes
+        self.memory = shared_memory.SharedMemory(create=True, size=slot_bytes * depth)
+        self.free = queue.Queue()
+        for i in range(depth):
+            self.free.put(i * slot_bytes)
+
+    def acquire(self):
+        return self.free.get()
+
+    def release(self, offset):
+        self.free.put(offset)
+
+    def write(self, offset, frame):
+        target = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.memory.buf, offset=offset)
+        target[...] = frame
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+class EncodePool:
+    '''
+    所有会话共用的编码进程池
+    每种原图尺寸对应一块共享内存，按提交顺序返回Future，调用者按顺序取结果即可保证帧序
+    创建时立即启动工作进程，应在服务器开始接受连接之前调用
+    '''
+
+    def __init__(self, workers=ENCODE_WORKERS, depth=ENCODE_QUEUE_DEPTH):
+        self.workers = workers
+        self.depth = depth
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.arenas = {}
+        self.lock = threading.Lock()
+        self.executor.submit(int).result()
+
+    def getArena(self, nbytes):
+        with self.lock:
+            arena = self.arenas.get(nbytes)
+            if arena is None:
+                arena = SlotArena(nbytes, self.depth)
+                self.arenas[nbytes] = arena
+            return arena
+
+    def submit(self, frame, size, quality=JPEG_DEFAULT_QUALITY):
+        '''
+        提交一帧编码任务，没有空闲槽位时阻塞
+        :param frame: 解码后的BGR图像
+        :param size: 输出分辨率
+        :param quality: JPEG质量
+        :return: 结果为JPEG字节流的Future
+        '''
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        arena = self.getArena(frame.nbytes)
+        offset = arena.acquire()
+        arena.write(offset, frame)
+        future = self.executor.submit(encodeShared, arena.memory.name, offset, frame.shape, size, quality)
+        future.add_done_callback(lambda _: arena.release(offset))
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown()
+        with self.lock:
+            for arena in self.arenas.values():
+                arena.close()
+            self.arenas.clear()
+
+
+encode_pool = None
+
+
+def configureEncodePool(workers=ENCODE_WORKERS, depth=ENCODE_QUEUE_DEPTH):
+    '''
+    启用或关闭编码进程池，workers为0时在生产者线程中直接编码
+    '''
+    global encode_pool
+    if encode_pool is not None:
+        encode_pool.shutdown()
+        encode_pool = None
+    if workers > 0:
+        encode_pool = EncodePool(workers, depth)
+    return encode_pool
+
+
+def getEncodePool():
+    return encode_pool
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from Constants import *
+
+
+class FrameAssembler:
+    '''
+    按时间戳把视频分片直接写到帧缓冲区中分片偏移对应的位置
+    帧缓冲区是可重用的bytearray，容量不够时按倍数扩大；交出或淘汰的缓冲区回到空闲列表，稳定后不再分配
+    同时拼装的帧数有上限，超出时淘汰最早开始拼装的帧（丢帧或迟到包留下的残帧）
+    '''
+
+    def __init__(self, slots=ASSEMBLY_FRAMES, capacity=ASSEMBLY_CAPACITY):
+        self.slots = slots
+        self.capacity = capacity
+        self.frames = OrderedDict()
+        self.free = []
+
+    def acquire(self, timestamp):
+        buffer = self.frames.get(timestamp)
+        if buffer is None:
+            if len(self.frames) >= self.slots:
+                _, evicted = self.frames.popitem(last=False)
+                self.free.append(evicted)
+            buffer = self.free.pop() if self.free else bytearray(self.capacity)
+            self.frames[timestamp] = buffer
+        return buffer
+
+    def write(self, timestamp, offset, data):
+        '''
+        :param timestamp: 帧的RTP时间戳
+        :param offset: 分片在帧内的偏移
+        :param data: 分片数据（memoryview）
+        '''
+        buffer = self.acquire(timestamp)
+        end = offset + len(data)
+        if end > len(buffer):
+            grown = bytearray(max(end, 2 * len(buffer)))
+            grown[:len(buffer)] = buffer
+            self.frames[timestamp] = buffer = grown
+        buffer[offset:end] = data
+
+    def take(self, timestamp, size):
+        '''
+        取出拼好的一帧
+        :param size: 帧的总字节数
+        :return: 帧数据，这一帧的缓冲区已被淘汰时为None
+        '''
+        buffer = self.frames.pop(timestamp, None)
+        if buffer is None:
+            return None
+        frame = bytes(memoryview(buffer)[:size])
+        self.free.append(buffer)
+        return frame
+
+    def reset(self):
+        self.free.extend(self.frames.values())
+        self.frames.clear()
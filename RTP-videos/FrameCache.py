@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from Constants import *
+
+
+class FrameCache:
+    '''
+    进程内共享的已编码帧缓存
+    键为 (文件名, 帧序号, 分辨率, JPEG质量)，值为JPEG字节流，按内存预算做LRU淘汰
+    压缩后的音频负载也以 (文件名, 开始样本, 段长, 负载类型) 为键存放在这里
+    '''
+
+    def __init__(self, budget=FRAME_CACHE_BUDGET):
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def begin(self, key, timeout=FRAME_CACHE_WAIT):
+        '''
+        查询缓存
+        :param key: 帧的键
+        :param timeout: 其他会话正在编码同一帧时的最长等待时间
+        :return: (字节流, 预约)；命中时预约为None，未命中时字节流为None，此时调用者负责编码并用这个预约调用finish
+        '''
+        with self.lock:
+            data = self.lookup(key)
+            if data is not None:
+                return data, None
+            event = self.pending.get(key)
+            if event is None:
+                ticket = self.pending[key] = threading.Event()
+                self.misses += 1
+                return None, ticket
+        event.wait(timeout)
+        with self.lock:
+            data = self.lookup(key)
+            if data is not None:
+                return data, None
+            # 等待超时后自己编码；原来的预约仍未结束时不占用它，其他会话继续等原来的编码者
+            ticket = threading.Event()
+            if key not in self.pending:
+                self.pending[key] = ticket
+            self.misses += 1
+            return None, ticket
+
+    def finish(self, key, data, ticket):
+        '''
+        写回编码结果，只有预约仍属于调用者时才结束它并唤醒等待同一帧的会话
+        :param key: 帧的键
+        :param data: 编码后的字节流，编码失败时为None
+        :param ticket: begin返回的预约
+        '''
+        with self.lock:
+            if data is not None and len(data) <= self.budget:
+                old = self.entries.pop(key, None)
+                if old is not None:
+                    self.size -= len(old)
+                self.entries[key] = data
+                self.size += len(data)
+                while self.size > self.budget:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+            if self.pending.get(key) is ticket:
+                del self.pending[key]
+        ticket.set()
+
+    def lookup(self, key):
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return data
+
+    def getStats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+shared_cache = FrameCache()
+
+
+def getSharedCache():
+    return shared_cache
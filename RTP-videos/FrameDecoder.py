@@ -0,0 +1,180 @@
+'''
+客户端视频解码
+收到的JPEG在小线程池中提前解码（Pillow解码和缩放时释放GIL），播放线程只负责按时显示
+目标尺寸小于原图时用draft让解码器直接按1/2、1/4、1/8比例解码；全屏放大用双线性插值代替Lanczos
+已经落后于播放时钟、且后面还有更新的帧在排队的帧直接丢弃，不再解码
+'''
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+from Constants import *
+from utils import RingBuffer
+
+
+def decodeJpeg(data, size, fast=False):
+    '''
+    解码并缩放到目标尺寸
+    :param data: JPEG字节流
+    :param size: 目标尺寸
+    :param fast: 是否使用较快的缩放算法
+    :return: PIL图像
+    '''
+    image = Image.open(BytesIO(data))
+    if size[0] < image.size[0] and size[1] < image.size[1]:
+        image.draft('RGB', size)
+    if image.size != size:
+        return image.resize(size, Image.BILINEAR if fast else Image.LANCZOS)
+    image.load()
+    return image
+
+
+class PlaybackClock:
+    '''
+    把视频时间戳（帧号）换算成显示时刻
+    时钟在第一帧显示时对齐，跳转或恢复播放后重新对齐
+    '''
+
+    def __init__(self, framerate=DEFAULT_VIDEO_FRAMERATE, step=1):
+        self.rate = framerate * step
+        self.base = None
+
+    def setRate(self, framerate, step=1):
+        self.rate = (framerate if framerate > 0 else DEFAULT_VIDEO_FRAMERATE) * step
+        self.base = None
+
+    def resync(self):
+        self.base = None
+
+    def start(self, timestamp, now=None):
+        self.base = (time.monotonic() if now is None else now, timestamp)
+
+    def due(self, timestamp):
+        '''
+        :return: 该帧应当显示的时刻，时钟未对齐时为None
+        '''
+        if self.base is None:
+            return None
+        return self.base[0] + (timestamp - self.base[1]) / self.rate
+
+    def lateness(self, timestamp, now=None):
+        '''
+        :return: 该帧落后于显示时刻的秒数，提前时为负，时钟未对齐时为0
+        '''
+        due = self.due(timestamp)
+        if due is None:
+            return 0.0
+        return (time.monotonic() if now is None else now) - due
+
+
+class FrameDecoder:
+    def __init__(self, source, target, workers=DECODE_WORKERS, depth=DECODE_QUEUE_DEPTH):
+        '''
+        :param source: 取一帧的函数，参数为超时，返回 (JPEG, 时间戳) 或None
+        :param target: 返回 (目标尺寸, 是否快速缩放) 的函数
+        :param workers: 解码线程数，也是提前解码的帧数
+        :param depth: 已解码帧队列的长度
+        '''
+        self.source = source
+        self.target = target
+        self.workers = max(1, workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.decoded = RingBuffer(depth)
+        self.clock = PlaybackClock()
+        self.backlog = lambda: 0
+        self.closed = False
+        self.generation = 0
+        self.dropped = 0
+        self.thread = None
+
+    def start(self, backlog=None):
+        '''
+        :param backlog: 返回解码队列之前还有多少帧在等待的函数，用于判断迟到的帧是否可以丢弃
+        '''
+        if backlog is not None:
+            self.backlog = backlog
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def isLate(self, timestamp, waiting):
+        return waiting > 0 and self.clock.lateness(timestamp) > DECODE_LATE
+
+    def run(self):
+        pending = deque()
+        while not self.closed:
+            while len(pending) < self.workers:
+                frame = self.source(0 if pending else RTP_TIMEOUT)
+                if frame is None:
+                    break
+                data, timestamp = frame
+                if self.isLate(timestamp, self.backlog()):
+                    self.dropped += 1
+                    continue
+                size, fast = self.target()
+                try:
+                    future = self.pool.submit(decodeJpeg, data, size, fast)
+                except RuntimeError:
+                    return
+                pending.append((future, timestamp, self.generation))
+            if not pending:
+                continue
+            future, timestamp, generation = pending.popleft()
+            try:
+                image = future.result()
+            except Exception:
+                continue
+            if generation != self.generation:
+                continue
+            while not self.closed and not self.decoded.push((image, timestamp, generation), RTP_TIMEOUT):
+                pass
+
+    def nextFrame(self, timeout=RTP_TIMEOUT):
+        '''
+        :return: 下一帧 (图像, 时间戳)，超时时为None
+        '''
+        while True:
+            frame = self.decoded.pop(timeout)
+            if frame is None:
+                return None
+            if frame[2] == self.generation:
+                return frame[:2]
+
+    def waitForDisplay(self, timestamp, wait):
+        '''
+        按播放时钟等到该帧的显示时刻
+        迟到的帧在后面还有已解码的帧时丢弃，否则照常显示；连等待解码的帧也没有时说明播放跟不上发送，把时钟对齐到这一帧
+        :param wait: 等待函数，参数为秒数
+        :return: 是否显示这一帧
+        '''
+        delay = -self.clock.lateness(timestamp)
+        if self.clock.base is None or delay > CLOCK_RESYNC:
+            self.clock.start(timestamp)
+            return True
+        if delay > 0:
+            wait(delay)
+            return True
+        if -delay > DECODE_LATE:
+            if self.decoded.len() > 0:
+                self.dropped += 1
+                return False
+            if self.backlog() == 0:
+                self.clock.start(timestamp)
+        return True
+
+    def flush(self):
+        '''
+        丢弃已解码和正在解码的帧，并让时钟在下一帧重新对齐，用于暂停、跳转后重新开始播放
+        可以在任意线程调用：旧的帧按代号在两端被跳过，不直接清空队列
+        '''
+        self.generation += 1
+        self.clock.resync()
+
+    def close(self):
+        self.closed = True
+        self.decoded.close()
+        self.pool.shutdown(wait=False)
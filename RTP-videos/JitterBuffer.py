@@ -0,0 +1,125 @@
+'''
+客户端抖动缓冲区
+16位序号按最近收到的最大序号扩展成32位，跨越65535后继续递增
+包按扩展序号暂存，队首的帧收齐（从帧首包到带标记的末包连续且时间戳一致）后立即交出；
+队首的帧迟迟收不齐、而最新的包已经超出重排窗口时，放弃这一帧，缺失的包计为丢失
+'''
+
+from Constants import *
+
+
+class JitterBuffer:
+    def __init__(self, window=JITTER_WINDOW, isStart=None):
+        '''
+        :param window: 重排窗口，以包为单位
+        :param isStart: 判断负载是否是一帧的首包，默认每个包自成一帧
+        '''
+        self.window = window
+        self.isStart = isStart if isStart is not None else (lambda payload: True)
+        self.packets = {}
+        self.next_seq = None
+        self.max_seq = None
+        self.received = 0
+        self.late = 0
+        self.lost = 0
+        self.duplicate = 0
+        self.dropped_frames = 0
+
+    def extend(self, seq):
+        '''
+        :param seq: 16位序号
+        :return: 离最大扩展序号最近的32位扩展序号
+        '''
+        if self.max_seq is None:
+            return seq
+        candidate = (self.max_seq & ~0xFFFF) | seq
+        if candidate - self.max_seq > 1 << 15:
+            candidate -= 1 << 16
+        elif self.max_seq - candidate > 1 << 15:
+            candidate += 1 << 16
+        return candidate
+
+    def accepts(self, seq):
+        '''
+        :param seq: 16位序号
+        :return: push是否会收下这个包，迟到和重复的包不收
+        '''
+        ext = self.extend(seq)
+        return self.next_seq is None or (ext >= self.next_seq and ext not in self.packets)
+
+    def push(self, seq, timestamp, marker, payload):
+        '''
+        放入一个包
+        :return: 可以交出的帧的列表，每帧为 (时间戳, 负载列表)
+        '''
+        ext = self.extend(seq)
+        if self.next_seq is None:
+            self.next_seq = ext
+        if ext < self.next_seq:
+            self.late += 1
+            return []
+        if ext in self.packets:
+            self.duplicate += 1
+            return []
+        self.packets[ext] = (timestamp, marker, payload)
+        self.received += 1
+        if self.max_seq is None or ext > self.max_seq:
+            self.max_seq = ext
+        return self.release()
+
+    def takeFrame(self):
+        '''
+        :return: 队首收齐的帧，没有时为None
+        '''
+        first = self.packets.get(self.next_seq)
+        if first is None or not self.isStart(first[2]):
+            return None
+        end = self.next_seq
+        while True:
+            packet = self.packets.get(end)
+            if packet is None or packet[0] != first[0]:
+                return None
+            if packet[1]:
+                break
+            end += 1
+        payloads = [self.packets.pop(seq)[2] for seq in range(self.next_seq, end + 1)]
+        self.next_seq = end + 1
+        return first[0], payloads
+
+    def skip(self):
+        '''放弃队首的帧，前进到下一个帧首包'''
+        self.dropped_frames += 1
+        while True:
+            if self.packets.pop(self.next_seq, None) is None:
+                self.lost += 1
+            self.next_seq += 1
+            packet = self.packets.get(self.next_seq)
+            if self.next_seq > self.max_seq or (packet is not None and self.isStart(packet[2])):
+                return
+
+    def release(self):
+        frames = []
+        while self.packets:
+            frame = self.takeFrame()
+            if frame is not None:
+                frames.append(frame)
+            elif self.max_seq - self.next_seq >= self.window:
+                self.skip()
+            else:
+                break
+        return frames
+
+    def reset(self):
+        self.packets.clear()
+        self.next_seq = None
+        self.max_seq = None
+
+    def getStats(self):
+        return {
+            'received': self.received,
+            'late': self.late,
+            'lost': self.lost,
+            'duplicate': self.duplicate,
+            'dropped_frames': self.dropped_frames,
+            'pending': len(self.packets)
+        }
@@ -0,0 +1,405 @@
+'''
+无界面的压力测试客户端
+同时打开多个会话，按脚本发送DESCRIBE/SETUP/PLAY/跳转/PAUSE/TEARDOWN，收到的帧只做校验和，不解码也不播放
+接收路径与ClientController相同（抖动缓冲区、原地拼装帧），并定期发送RTCP接收者报告
+每个会话报告吞吐量、丢包、首帧时间、跳转时间和每种请求的往返时间
+
+用法：python LoadClient.py --sessions 50 --script play:10,seek:500,play:5,pause:1,play:3
+'''
+
+import argparse
+import json
+import socket
+import threading
+import time
+import zlib
+from Constants import *
+from Exception import *
+from RtspTools import RequestSender, ResponseParser, setVerbose
+from RtpPacket import HEADER_SIZE, parseHeader
+from RtpJpeg import unpackJpegHeader, JPEG_HEADER_SIZE
+from RtcpPacket import splitCompound, RTCP_SR
+from RtcpStats import ReceiverStats
+from JitterBuffer import JitterBuffer
+from FrameAssembler import FrameAssembler
+
+REQUEST_NAMES = {
+    DESCRIBE: 'Describe',
+    SETUP: 'Setup',
+    PLAY: 'Play',
+    PAUSE: 'Pause',
+    TEARDOWN: 'Teardown'
+}
+SCRIPT_ACTIONS = ('play', 'pause', 'seek')
+
+
+def parseScript(spec):
+    '''
+    解析会话脚本，例如 "play:10,seek:500,play:5,pause:1,play:3"
+    play:秒数 播放（已在播放时继续播放）该时长；pause:秒数 暂停该时长；seek:千分比 跳转到该位置并继续播放
+    :return: [(动作, 参数), ...]
+    '''
+    script = []
+    for item in spec.split(','):
+        action, _, value = item.strip().partition(':')
+        if action not in SCRIPT_ACTIONS:
+            raise ValueError('unknown action %s' % action)
+        script.append((action, float(value)))
+    return script
+
+
+def summarize(values):
+    '''
+    :return: 平均值和最大值（毫秒），没有数据时为None
+    '''
+    if not values:
+        return None
+    return {'mean': 1000 * sum(values) / len(values), 'max': 1000 * max(values), 'count': len(values)}
+
+
+class LoadSession:
+    def __init__(self, index, server_addr, server_port, rtp_port, filename, audio_payload=AUDIO_PAYLOAD_FLOAT,
+                 checksum=False):
+        '''
+        :param index: 会话编号，只用于报告
+        :param rtp_port: 本会话的RTP端口，RTCP使用下一个端口
+        :param filename: 请求的URL
+        :param checksum: 是否对收到的帧计算CRC32
+        '''
+        self.index = index
+        self.server_addr = server_addr
+        self.server_port = server_port
+        self.rtp_port = rtp_port
+        self.filename = filename
+        self.audio_payload = audio_payload
+        self.checksum = checksum
+
+        self.rtsp_socket = None
+        self.rtp_socket = None
+        self.rtcp_socket = None
+        self.server_rtcp_port = SERVER_RTCP_PORT
+        self.rtsp_seq = -1
+        self.session_id = 0
+        self.video_framerate = DEFAULT_VIDEO_FRAMERATE
+        self.audio_samplerate = DEFAULT_AUDIO_SAMPLERATE
+        self.total_frames = 0
+
+        self.reception_stats = None
+        self.video_jitter = JitterBuffer(isStart=lambda fragment: fragment[0] == 0)
+        self.audio_jitter = JitterBuffer()
+        self.assembler = FrameAssembler()
+        self.receive_reset = False
+        self.receive_thread = None
+        self.closed = False
+        self.playing = False
+
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.audio_chunks = 0
+        self.crc = 0
+        self.play_time = 0.0
+        self.play_started = None
+        self.first_play = None
+        self.first_frame = None
+        self.seek_sent = None
+        self.seek_target = None
+        self.seek_latency = []
+        self.control_latency = {name: [] for name in REQUEST_NAMES.values()}
+        self.error = None
+
+    def open(self):
+        self.rtsp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.rtsp_socket.settimeout(RTSP_RESPONSE_TIMEOUT)
+        try:
+            self.rtsp_socket.connect((self.server_addr, self.server_port))
+        except OSError:
+            raise ConError
+        self.rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtp_socket.settimeout(RTP_TIMEOUT)
+        self.rtcp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtcp_socket.setblocking(False)
+        try:
+            self.rtp_socket.bind(('', self.rtp_port))
+            self.rtcp_socket.bind(('', self.rtp_port + 1))
+        except OSError:
+            raise BindError
+
+    def request(self, kind, **kwargs):
+        '''
+        发送一个请求并等待应答
+        :param kind: 请求类型
+        :return: ResponseParser
+        '''
+        self.rtsp_seq += 1
+        sender = RequestSender(self.rtsp_socket, self.filename, self.rtp_port, self.rtsp_seq, self.session_id,
+                               audioPayload=self.audio_payload, **kwargs)
+        name = REQUEST_NAMES[kind]
+        sent = time.perf_counter()
+        getattr(sender, 'send' + name)()
+        try:
+            data = self.rtsp_socket.recv(MAX_RTSP_BANDWIDTH)
+        except OSError:
+            raise SocketError
+        self.control_latency[name].append(time.perf_counter() - sent)
+        parser = ResponseParser(data.decode('utf-8'), kind)
+        if parser.getStatusCode() != 200 or parser.getSeq() != self.rtsp_seq:
+            raise ParseError
+        if self.session_id == 0:
+            self.session_id = parser.getSessionId()
+        return parser
+
+    def describe(self):
+        parser = self.request(DESCRIBE)
+        self.video_framerate, self.audio_samplerate, self.total_frames = parser.getAVParameters()
+        if self.audio_payload not in parser.getAudioPayloads():
+            self.audio_payload = AUDIO_PAYLOAD_FLOAT
+
+    def setup(self):
+        parser = self.request(SETUP)
+        self.server_rtcp_port = parser.getServerPorts()[1]
+        self.reception_stats = ReceiverStats(0x10000 + self.index, self.video_framerate, self.audio_samplerate)
+        self.receive_thread = threading.Thread(target=self.receive)
+        self.receive_thread.setDaemon(True)
+        self.receive_thread.start()
+
+    def play(self, position=0):
+        sent = time.perf_counter()
+        if self.first_play is None:
+            self.first_play = sent
+        self.resetReception()
+        self.request(PLAY, startPosition=position)
+        self.playing = True
+        self.play_started = time.perf_counter()
+
+    def resetReception(self):
+        '''和ClientController一样，暂停或跳转前的残帧由接收线程在处理下一个包之前丢弃'''
+        self.receive_reset = True
+
+    def pause(self):
+        self.request(PAUSE)
+        self.stopClock()
+
+    def stopClock(self):
+        if self.playing:
+            self.play_time += time.perf_counter() - self.play_started
+            self.playing = False
+
+    def seek(self, permillage):
+        if self.playing:
+            self.pause()
+        position = int(permillage / 1000 * self.total_frames)
+        self.seek_target = position
+        self.seek_sent = time.perf_counter()
+        self.play(position)
+
+    def teardown(self):
+        self.stopClock()
+        self.request(TEARDOWN)
+
+    def run(self, script):
+        '''
+        执行脚本，出错时记录错误并结束会话
+        :param script: parseScript的返回值
+        '''
+        try:
+            self.open()
+            self.describe()
+            self.setup()
+            for (action, value) in script:
+                if action == 'play':
+                    if not self.playing:
+                        self.play()
+                    time.sleep(value)
+                elif action == 'pause':
+                    if self.playing:
+                        self.pause()
+                    time.sleep(value)
+                elif action == 'seek':
+                    self.seek(value)
+            self.teardown()
+        except Error as e:
+            self.error = e.text()
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        if self.receive_thread is not None:
+            self.receive_thread.join()
+        for sock in (self.rtsp_socket, self.rtp_socket, self.rtcp_socket):
+            if sock is not None:
+                sock.close()
+
+    def receive(self):
+        buffer = bytearray(MAX_UDP_BANDWIDTH)
+        view = memoryview(buffer)
+        next_report = time.time() + RTCP_INTERVAL
+        while not self.closed:
+            try:
+                size = self.rtp_socket.recv_into(buffer)
+                if size >= HEADER_SIZE:
+                    self.receiveIncomingPacket(view[:size], time.time())
+            except socket.timeout:
+                pass
+            except OSError:
+                return
+            if time.time() >= next_report:
+                next_report += RTCP_INTERVAL
+                self.exchangeRtcp()
+
+    def exchangeRtcp(self):
+        try:
+            while True:
+                for packet in splitCompound(self.rtcp_socket.recv(MAX_UDP_BANDWIDTH)):
+                    if packet.packetType() == RTCP_SR:
+                        self.reception_stats.onSenderReport(packet, time.time())
+        except OSError:
+            pass
+        try:
+            self.rtcp_socket.sendto(self.reception_stats.makeReceiverReport(time.time()),
+                                    (self.server_addr, self.server_rtcp_port))
+        except OSError:
+            pass
+
+    def receiveIncomingPacket(self, view, arrival):
+        if self.receive_reset:
+            self.receive_reset = False
+            self.video_jitter.reset()
+            self.audio_jitter.reset()
+            self.assembler.reset()
+        seq, marker, payload_type, timestamp = parseHeader(view)
+        self.packets += 1
+        self.bytes += len(view)
+        if payload_type == VIDEO_PAYLOAD_TYPE:
+            self.reception_stats.onPacket(VIDEO, seq, timestamp, arrival)
+            offset = unpackJpegHeader(view[HEADER_SIZE:])[0]
+            fragment = view[HEADER_SIZE + JPEG_HEADER_SIZE:]
+            if self.video_jitter.accepts(seq):
+                self.assembler.write(timestamp, offset, fragment)
+            for (timestamp, fragments) in self.video_jitter.push(seq, timestamp, marker, (offset, len(fragment))):
+                self.restoreFrame(fragments, timestamp)
+        elif payload_type in AUDIO_PAYLOAD_TYPES:
+            self.reception_stats.onPacket(AUDIO, seq, timestamp, arrival)
+            self.audio_chunks += len(self.audio_jitter.push(seq, timestamp, marker, None))
+
+    def restoreFrame(self, fragments, timestamp):
+        size = 0
+        for (offset, length) in fragments:
+            if offset != size:
+                return
+            size += length
+        frame = self.assembler.take(timestamp, size)
+        if frame is None:
+            return
+        now = time.perf_counter()
+        self.frames += 1
+        if self.checksum:
+            self.crc = zlib.crc32(frame, self.crc)
+        if self.first_frame is None and self.first_play is not None:
+            self.first_frame = now - self.first_play
+        if self.seek_sent is not None and 0 <= timestamp - self.seek_target <= SEEK_MATCH_FRAMES:
+            self.seek_latency.append(now - self.seek_sent)
+            self.seek_sent = None
+
+    def report(self):
+        video = self.reception_stats.getStream(VIDEO) if self.reception_stats is not None else None
+        expected = video.expected() if video is not None else 0
+        lost = video.lost() if video is not None else 0
+        result = {
+            'session': self.index,
+            'error': self.error,
+            'play_seconds': self.play_time,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'audio_chunks': self.audio_chunks,
+            'fps': self.frames / self.play_time if self.play_time > 0 else 0.0,
+            'mbps': 8 * self.bytes / self.play_time / 1e6 if self.play_time > 0 else 0.0,
+            'video_loss': max(lost, 0) / expected if expected > 0 else 0.0,
+            'jitter_buffer': self.video_jitter.getStats(),
+            'first_frame_ms': 1000 * self.first_frame if self.first_frame is not None else None,
+            'seek_ms': summarize(self.seek_latency),
+            'control_ms': {name: summarize(values) for (name, values) in self.control_latency.items() if values}
+        }
+        if self.checksum:
+            result['crc32'] = self.crc
+        return result
+
+
+def runSessions(server_addr, server_port, count, script, filename=DEFAULT_FILENAME, rtp_base=LOAD_RTP_BASE,
+                ramp=LOAD_RAMP, audio_payload=AUDIO_PAYLOAD_FLOAT, checksum=False):
+    '''
+    并发运行多个会话，全部结束后返回
+    :param count: 会话数
+    :param script: parseScript的返回值
+    :param rtp_base: 第一个会话的RTP端口，之后每个会话占用两个端口
+    :param ramp: 相邻两个会话开始的间隔（秒）
+    :return: 每个会话的报告
+    '''
+    url = 'rtp://%s:%d/%s' % (server_addr, server_port, filename)
+    sessions = [LoadSession(i, server_addr, server_port, rtp_base + 2 * i, url, audio_payload, checksum)
+                for i in range(count)]
+    threads = []
+    for session in sessions:
+        thread = threading.Thread(target=session.run, args=(script,))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(ramp)
+    for thread in threads:
+        thread.join()
+    return [session.report() for session in sessions]
+
+
+def aggregate(reports):
+    '''
+    :return: 所有成功会话的汇总
+    '''
+    ok = [report for report in reports if report['error'] is None]
+    first_frames = [report['first_frame_ms'] for report in ok if report['first_frame_ms'] is not None]
+    return {
+        'sessions': len(reports),
+        'failed': len(reports) - len(ok),
+        'fps_mean': sum(report['fps'] for report in ok) / len(ok) if ok else 0.0,
+        'fps_min': min((report['fps'] for report in ok), default=0.0),
+        'mbps_total': sum(report['mbps'] for report in ok),
+        'video_loss_mean': sum(report['video_loss'] for report in ok) / len(ok) if ok else 0.0,
+        'first_frame_ms_mean': sum(first_frames) / len(first_frames) if first_frames else None,
+        'first_frame_ms_max': max(first_frames, default=None)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SERVER_RTSP_PORT)
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--script', type=parseScript, default=parseScript('play:10'),
+                        help='comma separated actions: play:SECONDS, pause:SECONDS, seek:PERMILLAGE')
+    parser.add_argument('--file', default=DEFAULT_FILENAME)
+    parser.add_argument('--rtp-base', type=int, default=LOAD_RTP_BASE,
+                        help='RTP port of the first session, each session uses two ports')
+    parser.add_argument('--ramp', type=float, default=LOAD_RAMP, help='seconds between session starts')
+    parser.add_argument('--audio-payload', type=int, default=AUDIO_PAYLOAD_FLOAT, choices=AUDIO_PAYLOAD_TYPES)
+    parser.add_argument('--checksum', action='store_true', help='CRC32 every received frame')
+    parser.add_argument('--json', default=None, help='write the reports to this file')
+    args = parser.parse_args()
+    setVerbose(False)
+    reports = runSessions(args.server, args.port, args.sessions, args.script, args.file, args.rtp_base,
+                          args.ramp, args.audio_payload, args.checksum)
+    for report in reports:
+        first_frame = report['first_frame_ms']
+        print('session %d: %.1f fps, %.2f Mbit/s, loss %.2f%%, first frame %s ms%s' % (
+            report['session'], report['fps'], report['mbps'], 100 * report['video_loss'],
+            '%.0f' % first_frame if first_frame is not None else '-',
+            ', error: %s' % report['error'] if report['error'] else ''))
+    summary = aggregate(reports)
+    print(summary)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'sessions': reports}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import os
+import sys
+import mmap
+import struct
+import threading
+import cv2
+import numpy as np
+from Constants import *
+from Exception import ParseError
+from AudioSamples import decodeBlock
+
+PACK_MAGIC = b'RTPPACK1'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('<8sHHdIIIQQQ')
+PACK_RESOLUTION = struct.Struct('<HH')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4')])
+AUDIO_DTYPE = np.dtype('<f4')
+
+
+def packName(filename):
+    return os.path.splitext(filename)[0] + PACK_SUFFIX
+
+
+class MediaPacker:
+    '''
+    离线打包：把视频各分辨率的JPEG帧和音频PCM写入同一个容器文件
+    布局为 文件头 | 分辨率表 | 帧数据 | 音频数据 | 帧索引，帧索引为定长的 (偏移, 长度) 表
+    '''
+
+    def __init__(self, filename, resolutions=(HIGH_RESOLUTION, LOW_RESOLUTION)):
+        self.filename = filename
+        self.resolutions = list(resolutions)
+
+    def run(self, target=None):
+        target = target or packName(self.filename)
+        cap = cv2.VideoCapture(self.filename)
+        framerate = cap.get(cv2.CAP_PROP_FPS)
+        entries = [[] for _ in self.resolutions]
+        with open(target + '.tmp', 'wb') as f:
+            f.write(bytes(PACK_HEADER.size + PACK_RESOLUTION.size * len(self.resolutions)))
+            while True:
+                res, frame = cap.read()
+                if not res:
+                    break
+                for (i, size) in enumerate(self.resolutions):
+                    resized = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                    data = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, JPEG_DEFAULT_QUALITY])[1].tobytes()
+                    entries[i].append((f.tell(), len(data)))
+                    f.write(data)
+            cap.release()
+            totalframes = len(entries[0])
+
+            audio_offset = f.tell()
+            samplerate, channels, audio_samples = self.writeAudio(f)
+
+            index_offset = f.tell()
+            index = np.zeros((len(self.resolutions), totalframes), dtype=INDEX_DTYPE)
+            for (i, column) in enumerate(entries):
+                if column:
+                    index[i] = np.array(column, dtype=INDEX_DTYPE)
+            f.write(index.tobytes())
+
+            f.seek(0)
+            f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(self.resolutions), framerate, totalframes,
+                                     samplerate, channels, index_offset, audio_offset, audio_samples))
+            for size in self.resolutions:
+                f.write(PACK_RESOLUTION.pack(*size))
+        os.replace(target + '.tmp', target)
+        return target
+
+    def writeAudio(self, f):
+        from moviepy.editor import AudioFileClip
+        clip = AudioFileClip(self.filename)
+        samplerate, channels = clip.fps, 2
+        total = int(clip.duration * samplerate)
+        block_size = int(AUDIO_BLOCK_SECONDS * samplerate)
+        written = 0
+        for start in range(0, total, block_size):
+            block = decodeBlock(clip, start, min(start + block_size, total), channels)
+            f.write(block.astype(AUDIO_DTYPE, copy=False).tobytes())
+            written += len(block)
+        clip.close()
+        return samplerate, channels, written
+
+
+class MediaPackReader:
+    '''通过mmap只读访问打包文件，帧和音频都直接切片返回，不做拷贝'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        (magic, version, num_resolutions, self.framerate, self.totalframes, self.samplerate, self.channels,
+         index_offset, audio_offset, audio_samples) = PACK_HEADER.unpack_from(self.mm, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ParseError
+        self.resolutions = {}
+        for i in range(num_resolutions):
+            size = PACK_RESOLUTION.unpack_from(self.mm, PACK_HEADER.size + i * PACK_RESOLUTION.size)
+            self.resolutions[size] = i
+        self.index = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=num_resolutions * self.totalframes,
+                                   offset=index_offset).reshape(num_resolutions, self.totalframes)
+        self.audio = np.frombuffer(self.mm, dtype=AUDIO_DTYPE, count=audio_samples * self.channels,
+                                   offset=audio_offset).reshape(audio_samples, self.channels)
+
+    def hasResolution(self, size):
+        return tuple(size) in self.resolutions
+
+    def getVideoFrame(self, index, size):
+        if index >= self.totalframes:
+            return None
+        offset, length = self.index[self.resolutions[tuple(size)], index]
+        return self.view[offset:offset + length]
+
+    def getAudio(self):
+        return self.audio
+
+    def close(self):
+        '''关闭文件；映射由仍在读取这个版本的会话持有，最后一个引用释放后回收'''
+        self.file.close()
+
+
+pack_readers = {}
+pack_lock = threading.Lock()
+
+
+def openPack(filename):
+    '''
+    打开媒体文件对应的打包文件，同一文件在进程内只映射一次
+    打包文件比媒体文件旧时视为过期，不再使用；打包文件更新后旧版本的读取器被淘汰
+    :param filename: 原始媒体文件名
+    :return: MediaPackReader，没有打包文件或打包文件过期时为None
+    '''
+    name = packName(filename)
+    if not os.path.exists(name):
+        return None
+    mtime = os.path.getmtime(name)
+    if os.path.exists(filename) and mtime < os.path.getmtime(filename):
+        return None
+    key = (name, mtime)
+    with pack_lock:
+        reader = pack_readers.get(key)
+        if reader is None:
+            for old in [k for k in pack_readers if k[0] == name]:
+                pack_readers.pop(old).close()
+            reader = MediaPackReader(name)
+            pack_readers[key] = reader
+        return reader
+
+
+def main():
+    for filename in sys.argv[1:]:
+        print('packing', filename, '...')
+        print('written', MediaPacker(filename).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,59 @@
 import cv2
 import threading
 import numpy as np
-from RtpPacket import RtpPacket
-from utils import LinkList
-from math import ceil
+from collections import deque
+from concurrent.futures import Future
+from RtpPacket import packHeader
+from RtpJpeg import fragmentJpeg
+from RtpText import packCue
+from utils import RingBuffer
 from moviepy.editor import AudioFileClip
 from Constants import *
-from SrtParser import SrtParser
-import os
+from SrtParser import getSubtitles
+from FrameCache import getSharedCache
+from MediaPack import openPack
+from SeekIndex import getSeekIndex
+from AudioSamples import ClipSamples, openPcm
+from AudioCodec import encodeAudio
+from EncodePool import encodeImage, getEncodePool
 
 class VideoStream:
-    def __init__(self, filename, consume_semaphore, yield_semaphore, event, step=1, lowres=False):
-        self.max_frame = 64000
+    def __init__(self, filename, event, step=1, lowres=False, mtu=RTP_MTU, capacity=SERVER_VIDEO_BUFFER):
+        self.mtu = mtu
         self.filename = filename
-        self.cap = cv2.VideoCapture(self.filename)
-        self.framerate = self.cap.get(5)
+        self.cap = None
+        self.pack = openPack(self.filename)
+        if self.pack is not None:
+            self.framerate = self.pack.framerate
+            self.totalframes = self.pack.totalframes
+        else:
+            self.cap = cv2.VideoCapture(self.filename)
+            self.framerate = self.cap.get(5)
+            self.totalframes = int(self.cap.get(7))
+        self.seek_index = None
+        if self.pack is None:
+            self.seek_index = getSeekIndex(self.filename, self.framerate, self.totalframes)
         self.low_res = lowres
-        self.totalframes = int(self.cap.get(7))
+        self.rung = None
         self.frameseq = 0
         self.current_frame = 0
+        self.cap_position = 0
+        self.cache = getSharedCache()
         self.step = step
-        self.consume_semaphore = consume_semaphore
-        self.yield_semaphore = yield_semaphore
         self.event = event
-        self.buf = LinkList()
+        self.buf = RingBuffer(capacity)
+        self.generation = 0
+        self.seek_to = None
+        self.seek_lock = threading.Lock()
         self.yield_thread = None
-        self.subtitle_required = False
-        self.subs = None
-        self.createSubReader()
-
-    def createSubReader(self):
-        self.subname = self.filename.split('.')[0] + '.srt'
-        if os.path.exists(self.subname):
-            self.subs = SrtParser(self.subname, self.framerate, self.totalframes)
+        self.timestamp = None
 
     def packRTP(self, payload, seq, current_frame, isLast):
-        V, P, X, CC, PT, seqNum, M, SSRC, timestamp = 2, 0, 0, 0, 26, seq, 0, 0, current_frame
-        if isLast:
-            M = 1
-        rtpPacket = RtpPacket()
-        rtpPacket.encode(V, P, X, CC, seqNum, M, PT, SSRC, payload, current_frame)
-        return rtpPacket.getPacket()
+        '''
+        :param payload: fragmentJpeg给出的 (JPEG主头部, 分片数据)
+        :return: (RTP头部, JPEG主头部, 分片数据)，按分散-聚集方式作为三个缓冲区发送，互不拼接
+        '''
+        return (packHeader(seq, 1 if isLast else 0, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC, current_frame),) + payload
 
     def yieldFrame(self):
         if self.yield_thread is None:
@@ -48,39 +61,169 @@ class VideoStream:
             self.yield_thread.setDaemon(True)
             self.yield_thread.start()
 
-    def nextFrame(self):
-        data = self.buf.pop()
-        return data
+    def nextFrame(self, timeout=None):
+        '''
+        取出缓冲区中的下一项，跳过定位之前生成的，再编上序号
+        :return: 该帧的RTP包列表，超时时为None
+        '''
+        item = self.buf.pop(timeout)
+        while item is not None and item[0] != self.generation:
+            item = self.buf.pop(timeout)
+        return self.numberFrame(item[1]) if item is not None else None
+
+    def readFrame(self, index):
+        '''
+        从解码器读出指定帧，距离较近时顺序跳帧，否则重新定位
+        :param index: 帧序号（从0开始）
+        :return: 解码后的图像，读取失败时为None
+        '''
+        if self.cap is None:
+            # 媒体包没有所需的分辨率或画质时才需要解码原始文件
+            self.cap = cv2.VideoCapture(self.filename)
+            self.cap_position = 0
+        if index < self.cap_position or index - self.cap_position > MAX_GRAB_GAP:
+            self.seekCapture(index)
+        while self.cap_position < index:
+            if not self.cap.grab():
+                return None
+            self.cap_position += 1
+        res, frame = self.cap.read()
+        if not res:
+            return None
+        self.cap_position += 1
+        return frame
+
+    def seekCapture(self, index):
+        '''
+        把解码器定位到index之前最近的关键帧，之后由readFrame顺序跳帧到index
+        :param index: 帧序号
+        '''
+        if self.seek_index is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.cap_position = index
+            return
+        keyframe = self.seek_index.keyframeBefore(index)
+        if keyframe <= self.cap_position <= index:
+            # 解码器已经在同一个GOP里，顺序跳帧比回到关键帧更快
+            return
+        self.cap.set(cv2.CAP_PROP_POS_MSEC, self.seek_index.frameTime(keyframe) * 1000)
+        self.cap_position = keyframe
+
+    def getPhotoSize(self):
+        if self.rung is not None:
+            return self.rung[0]
+        return HIGH_RESOLUTION if not self.low_res else LOW_RESOLUTION
+
+    def getQuality(self):
+        return self.rung[1] if self.rung is not None else JPEG_DEFAULT_QUALITY
+
+    def encodeFrame(self, index, photo_size, quality=JPEG_DEFAULT_QUALITY):
+        '''
+        取得一帧的JPEG，依次查找媒体包和共享缓存，都没有时解码并编码
+        :param index: 帧序号
+        :param photo_size: 输出分辨率
+        :param quality: JPEG质量
+        :return: JPEG字节流；交给编码进程池时为Future；读取失败时为None
+        '''
+        if self.pack is not None and quality == JPEG_DEFAULT_QUALITY \
+                and self.pack.hasResolution(photo_size):
+            return self.pack.getVideoFrame(index, photo_size)
+        key = (self.filename, index, photo_size, quality)
+        stashed, ticket = self.cache.begin(key)
+        if stashed is not None:
+            return stashed
+        try:
+            frame = self.readFrame(index)
+            if frame is None:
+                self.cache.finish(key, None, ticket)
+                return None
+            pool = getEncodePool()
+            if pool is not None:
+                future = pool.submit(frame, photo_size, quality=quality)
+                future.add_done_callback(lambda f: self.cache.finish(
+                    key, None if f.cancelled() or f.exception() else f.result(), ticket))
+                return future
+            stashed = encodeImage(frame, photo_size, quality=quality)
+        except Exception:
+            # 出错时也要结束这一帧的编码，否则等待同一帧的会话要等到超时
+            self.cache.finish(key, None, ticket)
+            raise
+        self.cache.finish(key, stashed, ticket)
+        return stashed
+
+    def prepareFrame(self):
+        '''
+        开始准备下一帧，使用编码进程池时不等待编码完成
+        :return: (时间戳, 分辨率, JPEG字节流或Future)，播放结束时为None
+        '''
+        index = self.current_frame + self.step - 1
+        if 0 < self.totalframes <= index:
+            return None
+        photo_size = self.getPhotoSize()
+        stashed = self.encodeFrame(index, photo_size, self.getQuality())
+        if stashed is None:
+            return None
+        self.current_frame += self.step
+        return self.current_frame, photo_size, stashed
+
+    def packFrame(self, prepared):
+        '''
+        取得编码结果并分片，编码失败的帧没有分片
+        :param prepared: prepareFrame的返回值
+        :return: (时间戳, 负载列表)
+        '''
+        timestamp, (width, height), stashed = prepared
+        if isinstance(stashed, Future):
+            if stashed.exception() is not None:
+                return timestamp, []
+            stashed = stashed.result()
+        return timestamp, fragmentJpeg(stashed, width, height, self.mtu)
+
+    def numberFrame(self, fragments):
+        '''
+        给分片编上序号并加上RTP头部
+        序号在取出时才分配，定位后丢弃的帧不占用序号，接收端不会把它们当作丢包；时间戳记在timestamp中，字幕轨据此发送字幕
+        :param fragments: packFrame的返回值
+        :return: 该帧的RTP包列表
+        '''
+        timestamp, payloads = fragments
+        self.timestamp = timestamp
+        packets = []
+        for (i, payload) in enumerate(payloads):
+            self.frameseq += 1
+            packets.append(self.packRTP(payload, self.frameseq, timestamp, i == len(payloads) - 1))
+        return packets
+
+    def nextPackets(self):
+        '''
+        编码下一帧并打包
+        :return: 该帧的RTP包列表，播放结束时为None
+        '''
+        self.applySeek()
+        prepared = self.prepareFrame()
+        if prepared is None:
+            return None
+        return self.numberFrame(self.packFrame(prepared))
 
     def getFrame(self):
+        '''
+        生产者线程：使用编码进程池时提前提交若干帧，按提交顺序取回结果放入缓冲区
+        '''
+        pending = deque()
         while True:
             self.event.wait()
-            res, frame = None, None
-            for i in range(self.step):
-                res, frame = self.cap.read()
-            if res:
-                self.current_frame += self.step
-                photo_size = (480, 270) if not self.low_res else (320, 180)
-                frame = cv2.resize(frame, photo_size, interpolation=cv2.INTER_AREA)
-                if self.subs is not None:
-                    text = self.subs.next()
-                    if self.subtitle_required and text is not None:
-                        cv2.putText(frame, text[1:], (50, 50), cv2.FONT_HERSHEY_COMPLEX, 0.5, (255, 255, 255))
-                stashed = cv2.imencode('.jpg', frame)[1]
-                stashed = np.array(stashed).tobytes()
-                num_slices = ceil(len(stashed) / self.max_frame)
-                for i in range(num_slices):
-                    self.yield_semaphore.acquire()
-                    if i < num_slices - 1:
-                        slice = stashed[i * self.max_frame:(i + 1) * self.max_frame]
-                    else:
-                        slice = stashed[i * self.max_frame:]
-                    self.frameseq += 1
-                    slice = self.packRTP(slice, self.frameseq, self.current_frame, i == num_slices - 1)
-                    self.buf.push(slice)
-                    self.consume_semaphore.release()
-            else:
+            pool = getEncodePool()
+            lookahead = pool.workers if pool is not None else 1
+            generation = self.applySeek()
+            prepared = self.prepareFrame()
+            if prepared is not None:
+                pending.append((generation, prepared))
+            elif not pending:
                 break
+            if len(pending) >= lookahead or prepared is None:
+                generation, prepared = pending.popleft()
+                if not self.buf.push((generation, self.packFrame(prepared))):
+                    break
 
     def getTotalFrames(self):
         return self.totalframes
@@ -88,11 +231,35 @@ class VideoStream:
     def getFramerate(self):
         return self.framerate
 
+    def getSeekIndex(self):
+        return self.seek_index
+
+    def close(self):
+        '''停止生产者线程，之后不能再使用这个流'''
+        self.buf.close()
+        self.event.set()
+
     def setPosition(self, pos):
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
-        if self.subs is not None:
-            self.subs.set(pos)
-        self.current_frame = pos
+        '''
+        定位到指定帧，缓冲区中定位前生成的帧随后被丢弃
+        只提交给生产者，由它在准备下一帧之前执行，current_frame只由生产者修改
+        :param pos: 请求的帧号
+        :return: 开始帧号
+        '''
+        with self.seek_lock:
+            self.seek_to = pos
+            self.generation += 1
+        return pos
+
+    def applySeek(self):
+        '''
+        生产者执行提交的定位
+        :return: 接下来准备的帧所属的代数
+        '''
+        with self.seek_lock:
+            if self.seek_to is not None:
+                self.current_frame, self.seek_to = self.seek_to, None
+            return self.generation
 
     def setStep(self, step):
         self.step = step
@@ -100,39 +267,96 @@ class VideoStream:
     def setLowResolution(self, lowres):
         self.low_res = lowres
 
-    def setSubtitles(self, subtitleRequired):
-        if subtitleRequired:
-            if self.subs is not None:
-                self.subtitle_required = True
-        else:
-            self.subtitle_required = False
+    def setRung(self, size, quality):
+        '''
+        切换画质，从下一帧开始生效
+        :param size: 分辨率
+        :param quality: JPEG质量
+        '''
+        self.rung = (size, quality)
+
+
+class SubtitleStream:
+    '''
+    字幕轨：跟随已发出的视频帧发送字幕包，与视频帧的编码无关，带不带字幕的观众可以共用同样的视频帧
+    字幕开始时发送一次，显示期间每隔SUBTITLE_REPEAT秒重发，开始播放或跳转后立即重发
+    '''
+
+    def __init__(self, filename, framerate):
+        self.subname = filename.split('.')[0] + '.srt'
+        subtitles = getSubtitles(self.subname, framerate)
+        self.reader = subtitles.createReader() if subtitles is not None else None
+        self.repeat = max(1, int(SUBTITLE_REPEAT * (framerate if framerate > 0 else DEFAULT_VIDEO_FRAMERATE)))
+        self.frameseq = 0
+        self.sent = None
+
+    def isAvailable(self):
+        return self.reader is not None
+
+    def reset(self):
+        '''开始播放或跳转时调用，当前的字幕在下一帧重发'''
+        self.sent = None
+
+    def nextPackets(self, timestamp):
+        '''
+        :param timestamp: 刚发出的视频帧的时间戳，即帧序号加一
+        :return: 需要随这一帧发出的字幕包列表
+        '''
+        if self.reader is None or timestamp is None:
+            return []
+        index = self.reader.find(timestamp - 1)
+        if index < 0:
+            return []
+        if self.sent is not None and self.sent[0] == index and 0 <= timestamp - self.sent[1] < self.repeat:
+            return []
+        self.sent = (index, timestamp)
+        parser = self.reader.parser
+        start, end = parser.starts[index] + 1, parser.ends[index] + 1
+        self.frameseq += 1
+        header = packHeader(self.frameseq, 1, SUBTITLE_PAYLOAD_TYPE, SUBTITLE_SSRC, start)
+        return [(header, packCue(start, end, parser.text(index)[1:]))]
 
 
 class AudioStream:
-    def __init__(self, filename, consume_semaphore, yield_semaphore, event, step=1, vfps=DEFAULT_VIDEO_FRAMERATE):
-        self.max_frame = 64000
+    def __init__(self, filename, event, step=1, vfps=DEFAULT_VIDEO_FRAMERATE, seekindex=None,
+                 capacity=SERVER_AUDIO_BUFFER):
         self.filename = filename
-        self.clip = AudioFileClip(self.filename)
-        self.samplerate = self.clip.fps
+        self.seek_index = seekindex
+        self.pack = openPack(self.filename)
+        if self.pack is not None:
+            self.clip = None
+            self.samplerate = self.pack.samplerate
+            self.samples = self.pack.getAudio()
+        else:
+            # AudioFileClip会启动一个ffmpeg解码进程，只在没有PCM缓存时才打开；两者都按它的默认采样率输出
+            self.clip = None
+            self.samplerate = DEFAULT_AUDIO_SAMPLERATE
+            self.samples = openPcm(self.filename)
+            if self.samples is None:
+                self.clip = AudioFileClip(self.filename, fps=self.samplerate)
+                self.samples = ClipSamples(self.clip)
         self.frameseq = 0
         self.current_clip = 0.0
         self.step = step
-        self.consume_semaphore = consume_semaphore
-        self.yield_semaphore = yield_semaphore
         self.event = event
-        self.buf = LinkList()
+        self.buf = RingBuffer(capacity)
+        self.generation = 0
+        self.seek_to = None
+        self.seek_bias = 0
+        self.seek_lock = threading.Lock()
         self.vfps = vfps
         self.setAPV(self.vfps)
         self.arrbuf = np.zeros((self.apv, 2), dtype=np.float32)
+        self.payload_type = AUDIO_PAYLOAD_FLOAT
+        self.chunk_start = 0
+        self.cache = getSharedCache()
         self.yield_thread = None
 
-    def packRTP(self, payload, seq, isLast):
-        V, P, X, CC, PT, seqNum, M, SSRC, timestamp = 2, 0, 0, 0, 97, seq, 0, 0, 0
-        if isLast:
-            M = 1
-        rtpPacket = RtpPacket()
-        rtpPacket.encode(V, P, X, CC, seqNum, M, PT, SSRC, payload, timestamp)
-        return rtpPacket.getPacket()
+    def packRTP(self, payload, seq, isLast, timestamp=0):
+        '''
+        :return: (RTP头部, 负载)
+        '''
+        return packHeader(seq, 1 if isLast else 0, self.payload_type, AUDIO_SSRC, timestamp), payload
 
     def yieldFrame(self):
         if self.yield_thread is None:
@@ -140,37 +364,135 @@ class AudioStream:
             self.yield_thread.setDaemon(True)
             self.yield_thread.start()
 
-    def nextFrame(self):
-        data = self.buf.pop()
-        return data
+    def nextFrame(self, timeout=None):
+        '''
+        取出缓冲区中的下一项，跳过定位之前生成的，再编上序号
+        :return: RTP包，超时时为None
+        '''
+        item = self.buf.pop(timeout)
+        while item is not None and item[0] != self.generation:
+            item = self.buf.pop(timeout)
+        return self.numberChunk(item[1]) if item is not None else None
+
+    def nextSamples(self):
+        '''
+        取出下一段音频样本，完整的一段直接返回样本数组的切片，不做拷贝
+        :return: (开始样本序号, 形状为 (apv, 2) 的float32数组)，播放结束时为None
+        '''
+        start = int(self.current_clip * self.apv)
+        if start >= len(self.samples):
+            return None
+        chunk = self.samples[start:start + self.apv]
+        if len(chunk) == self.apv and chunk.flags['C_CONTIGUOUS']:
+            return start, chunk
+        self.arrbuf[:len(chunk)] = chunk
+        self.arrbuf[len(chunk):] = 0
+        return start, self.arrbuf.copy()
+
+    def nextChunk(self):
+        '''
+        取出下一段音频并按协商的负载类型编码，压缩格式的编码结果在会话间共享
+        :return: 音频负载，播放结束时为None
+        '''
+        item = self.nextSamples()
+        if item is None:
+            return None
+        start, chunk = item
+        self.chunk_start = start
+        if self.payload_type == AUDIO_PAYLOAD_FLOAT:
+            return encodeAudio(self.payload_type, chunk)
+        key = (self.filename, start, self.apv, self.payload_type)
+        payload, ticket = self.cache.begin(key)
+        if payload is None:
+            try:
+                payload = encodeAudio(self.payload_type, chunk)
+            finally:
+                self.cache.finish(key, payload, ticket)
+        return payload
+
+    def nextPayload(self):
+        '''
+        取出下一段音频并编码
+        :return: (时间戳, 负载)，播放结束时为None
+        '''
+        chunk = self.nextChunk()
+        if chunk is None:
+            return None
+        self.current_clip += self.step
+        return self.chunk_start & 0xFFFFFFFF, chunk
+
+    def numberChunk(self, chunk):
+        '''
+        给一段音频编上序号并加上RTP头部，序号在取出时才分配
+        :param chunk: nextPayload的返回值
+        :return: RTP包
+        '''
+        timestamp, payload = chunk
+        self.frameseq += 1
+        return self.packRTP(payload, self.frameseq, True, timestamp)
+
+    def nextPacket(self):
+        '''
+        取出下一段音频并打包
+        :return: RTP包，播放结束时为None
+        '''
+        self.applySeek()
+        chunk = self.nextPayload()
+        return self.numberChunk(chunk) if chunk is not None else None
 
     def getFrame(self):
         while True:
             self.event.wait()
-            subclip = self.clip.subclip(self.current_clip * self.apv / self.samplerate,
-                                        (self.current_clip + 1) * self.apv / self.samplerate)
-            for (i, frame) in enumerate(subclip.iter_frames()):
-                self.arrbuf[i % self.apv][0] = frame[0]
-                self.arrbuf[i % self.apv][1] = frame[1]
-            self.yield_semaphore.acquire()
-            self.frameseq += 1
-            slice = self.arrbuf.tobytes()
-            slice = self.packRTP(slice, self.frameseq, True)
-            self.buf.push(slice)
-            self.consume_semaphore.release()
-            self.current_clip += self.step
+            generation = self.applySeek()
+            chunk = self.nextPayload()
+            if chunk is None:
+                break
+            if not self.buf.push((generation, chunk)):
+                break
 
     def getSamplerate(self):
         return self.samplerate
 
+    def close(self):
+        self.buf.close()
+        self.event.set()
+
     def setPosition(self, pos):
-        self.current_clip = (pos - 2) // 4
+        '''
+        定位到视频的指定帧，和VideoStream一样交给生产者执行
+        :param pos: 视频帧号
+        '''
+        if self.seek_index is not None:
+            sample = self.seek_index.audioSample(pos, self.samplerate)
+        else:
+            sample = pos * self.samplerate / self.vfps
+        with self.seek_lock:
+            self.seek_to = sample / self.apv
+            self.seek_bias = 0
+            self.generation += 1
+
+    def applySeek(self):
+        '''
+        生产者执行提交的定位和偏移
+        :return: 接下来取出的音频所属的代数
+        '''
+        with self.seek_lock:
+            if self.seek_to is not None:
+                self.current_clip = self.seek_to
+            self.current_clip += self.seek_bias
+            self.seek_to, self.seek_bias = None, 0
+            return self.generation
 
     def setStep(self, step):
         self.step = step
 
+    def setPayloadType(self, payload_type):
+        self.payload_type = payload_type
+
     def setBias(self, bias):
-        self.current_clip += bias
+        with self.seek_lock:
+            self.seek_bias += bias
+            self.generation += 1
 
     def setAPV(self, vfps):
         self.apv = 4 * int(self.samplerate / vfps)
@@ -0,0 +1,446 @@
+'''
+协议编解码的微基准测试
+对RTP、RTCP、RTSP的编码和解析逐项测量每次操作的耗时（ns/op）和内存分配（tracemalloc统计的块数和字节数），负载取实际发送的大小
+每一项在计时之前先做一次往返校验，编码再解码的结果必须和输入一致
+结果可以保存为基线，之后和基线对比，耗时或分配变差超过阈值时以非零状态退出，便于在提交前检查
+耗时取多轮的中位数并记录四分位距，疑似退化的测试项先重新测量，仍然退化才算失败
+
+用法：python Microbench.py [--save baseline.json] [--baseline baseline.json] [--threshold 0.5] [--filter rtp]
+'''
+
+import gc
+import sys
+import json
+import time
+import statistics
+import argparse
+import platform
+import tracemalloc
+from Constants import *
+from RtpPacket import RtpPacket, packHeader, parseHeader, HEADER_SIZE
+from RtpJpeg import packJpegHeader, unpackJpegHeader, fragmentJpeg, JPEG_HEADER_SIZE
+from RtcpPacket import RtcpPacket, ReportBlock, packetLength, splitCompound, RTCP_SR, RTCP_RR
+from RtspTools import RequestSender, RequestParser, ResponseSender, ResponseParser, setVerbose
+
+VIDEO_PAYLOAD_SIZE = RTP_MTU - HEADER_SIZE
+AUDIO_PAYLOAD_SIZE = AUDIO_FRAMES_PER_CHUNK * DEFAULT_APV
+MEDIA_URL = 'rtp://127.0.0.1:%d/videos/eve.mp4' % SERVER_RTSP_PORT
+COMPARED_METRICS = ('ns_per_op', 'blocks_per_op')
+
+
+class CaptureSocket:
+    '''代替套接字，只保留最后一次发送的数据'''
+
+    def __init__(self):
+        self.data = b''
+
+    def send(self, data):
+        self.data = data
+        return len(data)
+
+
+class Case:
+    def __init__(self, name, op, check, size=0):
+        '''
+        :param name: 测试项名称
+        :param op: 被测的操作，无参数，返回值在统计分配时保留，用来计入结果对象本身
+        :param check: 往返校验，不通过时抛出AssertionError
+        :param size: 处理的字节数，仅用于报告
+        '''
+        self.name = name
+        self.op = op
+        self.check = check
+        self.size = size
+
+
+def rtpCases():
+    video = bytes(range(256)) * (VIDEO_PAYLOAD_SIZE // 256) + bytes(VIDEO_PAYLOAD_SIZE % 256)
+    audio = bytes(AUDIO_PAYLOAD_SIZE)
+    fields = (2, 0, 0, 0, 4660, 1, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC)
+
+    def encode(payload, pt, ssrc):
+        def op():
+            packet = RtpPacket()
+            packet.encode(2, 0, 0, 0, 4660, 1, pt, ssrc, payload, 123456)
+            return packet.getPacket()
+        return op
+
+    def decoded(stream):
+        packet = RtpPacket()
+        packet.decode(stream)
+        return (packet.version(), packet.seqNum(), packet.getMarker(), packet.payloadType(), packet.ssrc(),
+                packet.timestamp(), bytes(packet.getPayload()))
+
+    encoded = encode(video, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC)()
+    received = memoryview(bytearray(encoded))
+
+    def checkEncode(payload, pt, ssrc):
+        def check():
+            assert decoded(encode(payload, pt, ssrc)()) == (2, 4660, True, pt, ssrc, 123456, payload)
+        return check
+
+    def checkHeader():
+        header = packHeader(4660, 1, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC, 123456)
+        packet = RtpPacket()
+        assert packet.encodeHeader(*fields, 123456) == header
+        assert parseHeader(memoryview(header + video)) == (4660, 1, VIDEO_PAYLOAD_TYPE, 123456)
+
+    def decodeOp():
+        packet = RtpPacket()
+        packet.decode(received)
+        packet.seqNum(), packet.timestamp(), packet.getMarker(), packet.payloadType()
+        return packet.getPayload()
+
+    def checkDecode():
+        assert decoded(received) == (2, 4660, True, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC, 123456, video)
+
+    def checkPackInto():
+        packet = RtpPacket()
+        packet.decode(received)
+        buffer = bytearray(RTP_MTU)
+        assert bytes(buffer[:packet.packInto(buffer)]) == encoded
+
+    target = bytearray(RTP_MTU)
+    jpeg = video[:VIDEO_PAYLOAD_SIZE - JPEG_HEADER_SIZE]
+
+    def packIntoOp():
+        packet = RtpPacket()
+        packet.decode(received)
+        return packet.packInto(target)
+
+    def checkJpeg():
+        frame = jpeg * 20
+        fragments = fragmentJpeg(frame, 960, 540)
+        assert all(len(header) + len(data) <= VIDEO_PAYLOAD_SIZE for (header, data) in fragments)
+        restored = bytearray(len(frame))
+        for (header, data) in fragments:
+            offset, _, width, height = unpackJpegHeader(header)
+            assert (width, height) == (960, 536)
+            restored[offset:offset + len(data)] = data
+        assert restored == frame
+
+    return [
+        Case('rtp.encode.video', encode(video, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC),
+             checkEncode(video, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC), len(video)),
+        Case('rtp.encode.audio', encode(audio, AUDIO_PAYLOAD_L16, AUDIO_SSRC),
+             checkEncode(audio, AUDIO_PAYLOAD_L16, AUDIO_SSRC), len(audio)),
+        Case('rtp.packHeader', lambda: packHeader(4660, 1, VIDEO_PAYLOAD_TYPE, VIDEO_SSRC, 123456), checkHeader,
+             HEADER_SIZE),
+        Case('rtp.decode', decodeOp, checkDecode, len(encoded)),
+        Case('rtp.parseHeader', lambda: parseHeader(received), checkHeader, HEADER_SIZE),
+        Case('rtp.packInto', packIntoOp, checkPackInto, len(encoded)),
+        Case('jpeg.header', lambda: unpackJpegHeader(packJpegHeader(65536, 960, 540)), checkJpeg, JPEG_HEADER_SIZE)
+    ]
+
+
+def rtcpCases():
+    values = (VIDEO_SSRC, 12, 345, 70000, 260, 0x12345678, 6553)
+    ntp = int((time.time() + 2208988800) * (1 << 32))
+
+    def blockOp():
+        block = ReportBlock()
+        block.encode(*values)
+        return block.getBlock()
+
+    def readBlock(block):
+        return (block.ssrc(), block.frac(), block.cumulative(), block.seq(), block.jitter(), block.lsr(),
+                block.dlsr())
+
+    def checkBlock():
+        block = ReportBlock()
+        block.decode(bytes(blockOp()))
+        assert readBlock(block) == values
+
+    def blocks():
+        first, second = ReportBlock(), ReportBlock()
+        first.encode(*values)
+        second.encode(AUDIO_SSRC, *values[1:])
+        return [first, second]
+
+    def senderOp():
+        report = RtcpPacket()
+        report.encode(2, 0, 0, RTCP_SR, packetLength(0, True), VIDEO_SSRC, ntp, 123456, 1000, 1400000, [], b'',
+                      True)
+        return report.getPacket()
+
+    def receiverOp():
+        report = RtcpPacket()
+        report.encode(2, 0, 2, RTCP_RR, packetLength(2, False), 0x1234, 0, 0, 0, 0, blocks(), b'', False)
+        return report.getPacket()
+
+    compound = bytes(senderOp() + receiverOp())
+
+    def checkReports():
+        sender, receiver = splitCompound(compound)
+        assert sender.packetType() == RTCP_SR and sender.ssrc() == VIDEO_SSRC
+        assert (sender.ntpTimestamp(), sender.rtpTimestamp()) == (ntp, 123456)
+        assert (sender.packetCount(), sender.octetCount()) == (1000, 1400000)
+        assert receiver.packetType() == RTCP_RR and receiver.countOfReportBlocks() == 2
+        assert readBlock(receiver.getBlockByIndex(0)) == values
+        assert readBlock(receiver.getBlockByIndex(1)) == (AUDIO_SSRC,) + values[1:]
+        assert sender.sizeOfPacket() + receiver.sizeOfPacket() == len(compound)
+
+    def decodeOp():
+        packets = splitCompound(compound)
+        receiver = packets[1]
+        for index in range(receiver.countOfReportBlocks()):
+            block = receiver.getBlockByIndex(index)
+            block.frac(), block.cumulative(), block.jitter()
+        return packets
+
+    return [
+        Case('rtcp.block', blockOp, checkBlock, len(blockOp())),
+        Case('rtcp.encode.sr', senderOp, checkReports, len(senderOp())),
+        Case('rtcp.encode.rr', receiverOp, checkReports, len(receiverOp())),
+        Case('rtcp.decode.compound', decodeOp, checkReports, len(compound))
+    ]
+
+
+def rtspCases():
+    client = CaptureSocket()
+    sender = RequestSender(client, MEDIA_URL, 25000, 3, 123456, startPosition=1500, step=2, audiobias=40,
+                           audioPayload=AUDIO_PAYLOAD_L16)
+    sender.sendSetup()
+    setup = client.data.decode()
+    sender.sendPlay()
+    play = client.data.decode()
+
+    server = CaptureSocket()
+    responder = ResponseSender(server, 3, 123456, MEDIA_URL, '127.0.0.1', 25000, 25001, 25002, 25003,
+                               29.97, DEFAULT_AUDIO_SAMPLERATE, 5400)
+    responder.sendDescribe()
+    describe = server.data.decode()
+    responder.sendSetup()
+    setup_reply = server.data.decode()
+
+    def sendOp():
+        sender.sendPlay()
+        return client.data
+
+    def checkRequests():
+        request = RequestParser(setup)
+        assert (request.getMethod(), request.getCseq(), request.getFilename()) == (SETUP, 3, 'videos/eve.mp4')
+        assert request.getClientPorts() == (25000, 25001) and request.getAudioPayload() == AUDIO_PAYLOAD_L16
+        request = RequestParser(play)
+        assert (request.getMethod(), request.getStartPosition(), request.getStep()) == (PLAY, 1500, 2)
+        assert (request.getAudioBias(), request.isLowResolution()) == (40, False)
+
+    def checkResponses():
+        response = ResponseParser(describe, DESCRIBE)
+        assert (response.getStatusCode(), response.getSeq(), response.getSessionId()) == (200, 3, 123456)
+        assert response.getAVParameters() == (29.97, DEFAULT_AUDIO_SAMPLERATE, 5400)
+        assert response.getAudioPayloads() == list(AUDIO_PAYLOAD_TYPES)
+        response = ResponseParser(setup_reply, SETUP)
+        assert response.getServerPorts() == (25002, 25003) and response.getSessionId() == 123456
+
+    return [
+        Case('rtsp.request.format', sendOp, checkRequests, len(play)),
+        Case('rtsp.request.setup', lambda: RequestParser(setup), checkRequests, len(setup)),
+        Case('rtsp.request.play', lambda: RequestParser(play), checkRequests, len(play)),
+        Case('rtsp.response.describe', lambda: ResponseParser(describe, DESCRIBE), checkResponses, len(describe)),
+        Case('rtsp.response.setup', lambda: ResponseParser(setup_reply, SETUP), checkResponses, len(setup_reply))
+    ]
+
+
+def allCases():
+    return rtpCases() + rtcpCases() + rtspCases()
+
+
+def timeOp(op, number, repeat):
+    '''
+    :return: 每一轮的每次耗时（纳秒）
+    '''
+    rounds = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                op()
+            rounds.append((time.perf_counter_ns() - start) / number)
+    finally:
+        gc.enable()
+    return rounds
+
+
+def spread(rounds):
+    '''
+    :return: 各轮耗时的四分位距，只有一轮时为0
+    '''
+    if len(rounds) < 2:
+        return 0.0
+    q1, _, q3 = statistics.quantiles(rounds, n=4)
+    return q3 - q1
+
+
+def calibrate(op, budget):
+    '''
+    :return: 一轮大约耗时budget秒所需的次数
+    '''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            op()
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget / 10 or number >= 1 << 20:
+            return max(1, int(number * budget / elapsed))
+        number *= 2
+
+
+def measureAllocations(op, number=MICRO_ALLOC_OPS):
+    '''
+    用tracemalloc统计每次操作的分配
+    结果全部保留到统计结束，所以计入的是留下来的对象（结果本身和其中缓存的字段）；峰值另外给出单次操作里临时对象占用的内存
+    :return: (每次留下的块数, 每次留下的字节数, 单次操作的峰值字节数)
+    '''
+    keep = [None] * number
+    trace = tracemalloc.Filter(False, tracemalloc.__file__)
+    op()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        keep[0] = op()
+        peak = tracemalloc.get_traced_memory()[1] - before
+        first = tracemalloc.take_snapshot().filter_traces([trace])
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(1, number):
+            keep[i] = op()
+        end = tracemalloc.get_traced_memory()[0]
+        second = tracemalloc.take_snapshot().filter_traces([trace])
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in second.compare_to(first, 'filename'))
+    del keep
+    return blocks / (number - 1), (end - start) / (number - 1), peak
+
+
+def runCase(case, budget, repeat):
+    case.check()
+    number = calibrate(case.op, budget)
+    rounds = timeOp(case.op, number, repeat)
+    ns = statistics.median(rounds)
+    blocks, retained, peak = measureAllocations(case.op)
+    return {
+        'name': case.name,
+        'bytes': case.size,
+        'ns_per_op': ns,
+        'ns_iqr': spread(rounds),
+        'ns_min': min(rounds),
+        'blocks_per_op': blocks,
+        'bytes_per_op': retained,
+        'peak_bytes_per_op': peak,
+        'mb_per_s': case.size * 1000 / ns if ns else None,
+        'number': number
+    }
+
+
+def compareResults(current, baseline, threshold=MICRO_REGRESSION):
+    '''
+    按测试项对比两次结果，耗时或留下的块数增加超过threshold（相对值）视为退化
+    块数很少时相对值没有意义，至少多出一块才算
+    耗时的增加还要超过MICRO_NOISE_NS和两次结果的四分位距之和，抖动大的测试项不会因为噪声被判为退化
+    :return: [(测试项, 指标, 基线值, 当前值, 是否退化), ...]
+    '''
+    previous = {case['name']: case for case in baseline.get('cases', [])}
+    rows = []
+    for case in current['cases']:
+        old = previous.get(case['name'])
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = old.get(metric), case.get(metric)
+            if before is None or after is None:
+                continue
+            if metric == 'blocks_per_op':
+                regressed = after - before >= 1 and after > before * (1 + threshold)
+            else:
+                noise = max(MICRO_NOISE_NS, old.get('ns_iqr', 0) + case.get('ns_iqr', 0))
+                regressed = before > 0 and after - before > max(before * threshold, noise)
+            rows.append((case['name'], metric, before, after, regressed))
+    return rows
+
+
+def remeasure(output, baseline, cases, args):
+    '''
+    耗时疑似退化的测试项最多重新测量MICRO_RETRIES次，保留中位数较小的一次，一次偶然的干扰不会让检查失败
+    :param output: 本次结果，原地替换重新测量的项
+    :param cases: 测试项名 -> 测试项
+    '''
+    for _ in range(MICRO_RETRIES):
+        suspects = {name for (name, metric, before, after, regressed) in
+                    compareResults(output, baseline, args.threshold) if regressed and metric == 'ns_per_op'}
+        if not suspects:
+            return
+        print('re-measuring', ', '.join(sorted(suspects)))
+        for (i, result) in enumerate(output['cases']):
+            if result['name'] in suspects:
+                retry = runCase(cases[result['name']], args.budget, args.repeat)
+                if retry['ns_per_op'] < result['ns_per_op']:
+                    output['cases'][i] = retry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this string')
+    parser.add_argument('--budget', type=float, default=MICRO_BUDGET, help='seconds per timing round')
+    parser.add_argument('--repeat', type=int, default=MICRO_REPEAT, help='timing rounds, the median is kept')
+    parser.add_argument('--save', default=None, help='write the results to this file, e.g. as a new baseline')
+    parser.add_argument('--baseline', default=None, help='earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=MICRO_REGRESSION,
+                        help='relative slowdown that counts as a regression')
+    args = parser.parse_args()
+    setVerbose(False)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    cases = {}
+    results = []
+    failed = []
+    print('%-24s %10s %8s %10s %10s %8s' % ('case', 'ns/op', 'blocks', 'bytes', 'peak', 'MB/s'))
+    for case in allCases():
+        if args.filter not in case.name:
+            continue
+        cases[case.name] = case
+        try:
+            result = runCase(case, args.budget, args.repeat)
+        except AssertionError:
+            print('%-24s round trip check FAILED' % case.name)
+            failed.append(case.name)
+            continue
+        print('%-24s %10.0f %8.2f %10.0f %10.0f %8s' % (
+            case.name, result['ns_per_op'], result['blocks_per_op'], result['bytes_per_op'],
+            result['peak_bytes_per_op'], '%.0f' % result['mb_per_s'] if result['mb_per_s'] is not None else '-'))
+        results.append(result)
+
+    output = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {'python': platform.python_version(), 'system': platform.platform()},
+        'cases': results
+    }
+    if baseline is not None:
+        remeasure(output, baseline, cases, args)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(output, f, indent=2)
+        print('written', args.save)
+
+    regressions = []
+    if baseline is not None:
+        for (name, metric, before, after, regressed) in compareResults(output, baseline, args.threshold):
+            if regressed:
+                regressions.append((name, metric))
+            print('%-24s %-14s %10.2f -> %10.2f%s' % (name, metric, before, after, '  REGRESSION' if regressed else ''))
+
+    if failed or regressions:
+        print('%d failed check(s), %d regression(s)' % (len(failed), len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import time
+import threading
+from Constants import *
+
+
+class PacingScheduler:
+    '''
+    全局发送调度器
+    所有会话的RTP包按发送时刻放进时间轮，一帧的各个分片均匀分布在一个帧间隔内，由唯一的发送线程按刻度发出
+    时间轮为空时发送线程在条件变量上等待，不再空转
+    '''
+
+    def __init__(self, tick=PACING_TICK, slots=PACING_SLOTS):
+        self.tick = tick
+        self.wheel = [[] for _ in range(slots)]
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.origin = time.monotonic()
+        self.cursor = 0
+        self.pending = 0
+        self.thread = None
+
+    def tickOf(self, moment):
+        return int((moment - self.origin) / self.tick)
+
+    def schedule(self, sender, packets, addr, deadline, spread=0.0):
+        '''
+        安排一组包的发送
+        :param sender: 发送这些包的BatchSender
+        :param packets: 包列表
+        :param addr: 目的地址
+        :param deadline: 第一个包的发送时刻（time.monotonic）
+        :param spread: 包在多长时间内均匀发出
+        '''
+        count = len(packets)
+        with self.ready:
+            if self.pending == 0:
+                # 时间轮为空，发送线程停在旧的刻度上，直接跳到当前刻度
+                self.cursor = max(self.cursor, self.tickOf(time.monotonic()))
+            horizon = self.cursor + len(self.wheel) - 1
+            for (i, packet) in enumerate(packets):
+                tick = self.tickOf(deadline + spread * i / count)
+                tick = min(max(tick, self.cursor), horizon)
+                self.wheel[tick % len(self.wheel)].append((sender, packet, addr))
+            self.pending += count
+            self.ready.notify()
+        self.start()
+
+    def waitUntil(self, moment):
+        delay = moment - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backlog(self):
+        return self.pending
+
+    def start(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run)
+                    self.thread.setDaemon(True)
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            with self.ready:
+                while self.pending == 0:
+                    self.ready.wait()
+            now = self.tickOf(time.monotonic())
+            while self.cursor <= now:
+                with self.lock:
+                    slot = self.cursor % len(self.wheel)
+                    items, self.wheel[slot] = self.wheel[slot], []
+                    self.cursor += 1
+                    self.pending -= len(items)
+                if items:
+                    self.flush(items)
+            self.waitUntil(self.origin + self.cursor * self.tick)
+
+    def flush(self, items):
+        '''同一刻度内经同一套接字发出的包，不论属于哪个会话，合并成一次批量发送'''
+        batches = {}
+        for (sender, packet, addr) in items:
+            if id(sender) not in batches:
+                batches[id(sender)] = (sender, [])
+            batches[id(sender)][1].append((packet, addr))
+        for (sender, batch) in batches.values():
+            sender.sendItems(batch)
+
+
+pacing_scheduler = PacingScheduler()
+
+
+def getPacingScheduler():
+    return pacing_scheduler
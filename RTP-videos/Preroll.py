@@ -0,0 +1,112 @@
+'''
+客户端预缓冲
+缓冲量以毫秒计：开始播放、跳转或恢复播放时先缓冲，缓冲量达到高水位后才开始播放
+播放中缓冲量跌破低水位视为卡顿，重新缓冲到高水位；每次缓冲结束记录一个事件，供统计和监控使用
+等待使用条件变量，接收线程放入数据时唤醒播放线程，不再空转
+'''
+
+import time
+import threading
+from Constants import *
+
+
+class PrerollController:
+    def __init__(self, level, low=PREROLL_LOW_MS, high=PREROLL_HIGH_MS):
+        '''
+        :param level: 返回当前缓冲量（毫秒）的函数
+        :param low: 低水位（毫秒），播放中低于它时重新缓冲
+        :param high: 高水位（毫秒），缓冲达到它时开始播放
+        '''
+        self.level = level
+        self.low = low
+        self.high = high
+        self.condition = threading.Condition()
+        self.buffering = True
+        self.startup = True
+        self.ended = False
+        self.since = time.monotonic()
+        self.events = []
+        self.listeners = []
+
+    def addListener(self, callback):
+        '''
+        :param callback: 每次缓冲结束时调用，参数为该次缓冲的事件
+        '''
+        self.listeners.append(callback)
+
+    def reset(self):
+        '''从头预缓冲，用于开始播放、跳转和恢复播放'''
+        with self.condition:
+            self.buffering = True
+            self.startup = True
+            self.ended = False
+            self.since = time.monotonic()
+            self.condition.notify_all()
+
+    def onData(self):
+        '''接收线程放入数据后调用'''
+        with self.condition:
+            if not self.buffering or self.level() < self.high:
+                return
+            event = self.resume()
+        self.publish(event)
+
+    def finish(self):
+        '''已收到最后一帧，不再等待缓冲，播完剩下的数据'''
+        with self.condition:
+            self.ended = True
+            if not self.buffering:
+                return
+            event = self.resume()
+        self.publish(event)
+
+    def resume(self):
+        now = time.monotonic()
+        event = {
+            'time': time.time(),
+            'duration': now - self.since,
+            'level': self.level(),
+            'startup': self.startup
+        }
+        self.events.append(event)
+        self.buffering = False
+        self.startup = False
+        self.condition.notify_all()
+        return event
+
+    def publish(self, event):
+        for callback in self.listeners:
+            callback(event)
+
+    def waitForPlayback(self, timeout=RTP_TIMEOUT):
+        '''
+        播放线程每取一帧之前调用，缓冲中时阻塞等待
+        :param timeout: 最长等待时间
+        :return: 是否可以播放
+        '''
+        with self.condition:
+            if not self.buffering and not self.ended and self.level() < self.low:
+                self.buffering = True
+                self.since = time.monotonic()
+            if self.buffering:
+                self.condition.wait_for(lambda: not self.buffering, timeout)
+            return not self.buffering
+
+    def getRebufferEvents(self):
+        '''
+        :return: 播放中卡顿后的重新缓冲事件，不含开始播放时的预缓冲
+        '''
+        with self.condition:
+            return [event for event in self.events if not event['startup']]
+
+    def getStats(self):
+        with self.condition:
+            rebuffers = [event for event in self.events if not event['startup']]
+            startups = [event['duration'] for event in self.events if event['startup']]
+            return {
+                'buffering': self.buffering,
+                'level_ms': self.level(),
+                'startup_ms': 1000 * startups[-1] if startups else None,
+                'rebuffers': len(rebuffers),
+                'rebuffer_ms': 1000 * sum(event['duration'] for event in rebuffers)
+            }
@@ -0,0 +1,88 @@
+'''
+按接收端反馈自动调整画质
+阶梯上每一级是 (分辨率, JPEG质量)，从上到下码率递减
+丢包、抖动或发送落后超过阈值时立即降一级，连续若干次反馈都良好时升一级；切换只影响之后编码的帧，不需要暂停播放
+'''
+
+from Constants import *
+
+
+def parseLadder(spec):
+    '''
+    解析命令行中的阶梯，例如 "480x270:95,320x180:70"
+    :return: [((宽, 高), 质量), ...]
+    '''
+    rungs = []
+    for item in spec.split(','):
+        size, quality = item.strip().split(':')
+        width, height = size.split('x')
+        rungs.append(((int(width), int(height)), int(quality)))
+    return rungs
+
+
+class QualityController:
+    '''一个会话的画质控制'''
+
+    def __init__(self, ladder=None, ceiling=HIGH_RESOLUTION):
+        self.ladder = ladder if ladder is not None else quality_ladder
+        self.top = 0
+        self.level = 0
+        self.good_reports = 0
+        self.setCeiling(ceiling)
+
+    def setCeiling(self, ceiling):
+        '''
+        客户端请求的分辨率作为上限，阶梯从第一级不超过该分辨率的位置开始
+        :param ceiling: 客户端请求的分辨率
+        '''
+        top = len(self.ladder) - 1
+        for (i, (size, _)) in enumerate(self.ladder):
+            if size[0] <= ceiling[0] and size[1] <= ceiling[1]:
+                top = i
+                break
+        self.top = top
+        self.level = max(self.level, top)
+        self.good_reports = 0
+
+    def getRung(self):
+        return self.ladder[self.level]
+
+    def update(self, report, late_ratio=0.0):
+        '''
+        根据一次反馈调整级别
+        :param report: SessionStats中视频流最近的接收者报告，没有时为None
+        :param late_ratio: 上次调整以来发送落后于计划的帧所占比例
+        :return: 级别是否改变
+        '''
+        loss = report['fraction_lost'] if report is not None else 0.0
+        jitter = report['jitter'] if report is not None else 0
+        if loss > LADDER_LOSS_DOWN or jitter > LADDER_JITTER_DOWN or late_ratio > LADDER_LATE_DOWN:
+            self.good_reports = 0
+            if self.level < len(self.ladder) - 1:
+                self.level += 1
+                return True
+            return False
+        if report is not None and loss <= LADDER_LOSS_UP and late_ratio <= LADDER_LATE_UP:
+            self.good_reports += 1
+            if self.good_reports >= LADDER_HOLD and self.level > self.top:
+                self.level -= 1
+                self.good_reports = 0
+                return True
+        else:
+            self.good_reports = 0
+        return False
+
+
+quality_ladder = list(QUALITY_LADDER)
+adaptive_quality = True
+
+
+def configureLadder(ladder=None, enabled=True):
+    global adaptive_quality
+    if ladder:
+        quality_ladder[:] = ladder
+    adaptive_quality = enabled
+
+
+def isAdaptive():
+    return adaptive_quality
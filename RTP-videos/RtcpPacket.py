@@ -1,6 +1,8 @@
 RTCP_HEADER_SIZE = 8
 RTCP_SENDER_INFO_SIZE = 20
 REPORT_BLOCK_SIZE = 24
+RTCP_SR = 200
+RTCP_RR = 201
 
 
 def fillword(target, integer, index):
@@ -98,7 +100,7 @@ class RtcpPacket:
         fillword(self.header, ssrc, 4)
 
         self.senderInfo = bytearray(RTCP_SENDER_INFO_SIZE)
-        ntpmsw, ntplsw = ntptimestamp >> 32, ntptimestamp & (1 << 32 - 1)
+        ntpmsw, ntplsw = ntptimestamp >> 32, ntptimestamp & ((1 << 32) - 1)
         fillword(self.senderInfo, ntpmsw, 0)
         fillword(self.senderInfo, ntplsw, 4)
         fillword(self.senderInfo, rtptimestamp, 8)
@@ -114,8 +116,12 @@ class RtcpPacket:
         :return:
         '''
         self.header = bytearray(byteStream[:RTCP_HEADER_SIZE])
-        self.senderInfo = byteStream[RTCP_HEADER_SIZE:RTCP_HEADER_SIZE + RTCP_SENDER_INFO_SIZE]
-        blockStart = RTCP_HEADER_SIZE + RTCP_SENDER_INFO_SIZE
+        self.isSender = self.packetType() == RTCP_SR
+        blockStart = RTCP_HEADER_SIZE
+        self.senderInfo = bytearray(RTCP_SENDER_INFO_SIZE)
+        if self.isSender:
+            self.senderInfo = byteStream[RTCP_HEADER_SIZE:RTCP_HEADER_SIZE + RTCP_SENDER_INFO_SIZE]
+            blockStart += RTCP_SENDER_INFO_SIZE
         blockNumber = self.countOfReportBlocks()
         self.blocks = []
         for i in range(blockNumber):
@@ -123,7 +129,7 @@ class RtcpPacket:
             block = ReportBlock()
             block.decode(blockStream)
             self.blocks.append(block)
-        self.extensions = byteStream[blockStart + blockNumber * REPORT_BLOCK_SIZE:]
+        self.extensions = byteStream[blockStart + blockNumber * REPORT_BLOCK_SIZE:self.sizeOfPacket()]
 
     def version(self):
         return int(self.header[0] >> 6)
@@ -131,8 +137,17 @@ class RtcpPacket:
     def countOfReportBlocks(self):
         return self.header[0] & 31
 
+    def packetType(self):
+        return self.header[1]
+
     def lengthOfPacket(self):
-        return self.header[2] << 8 + self.header[3]
+        return (self.header[2] << 8) + self.header[3]
+
+    def sizeOfPacket(self):
+        '''
+        :return: 整个RTCP包的字节数，长度字段是以4字节为单位的长度减一
+        '''
+        return (self.lengthOfPacket() + 1) * 4
 
     def getBlockByIndex(self, index):
         return self.blocks[index]
@@ -146,6 +161,12 @@ class RtcpPacket:
     def rtpTimestamp(self):
         return getWord(self.senderInfo, 8)
 
+    def packetCount(self):
+        return getWord(self.senderInfo, 12)
+
+    def octetCount(self):
+        return getWord(self.senderInfo, 16)
+
     def getPacket(self):
         '''
         :return: 可以直接发送RTCP包（字节流)
@@ -157,3 +178,31 @@ class RtcpPacket:
             packet = packet + b.getBlock()
         packet = packet + self.extensions
         return packet
+
+
+def packetLength(rc, isSender, ext=b''):
+    '''
+    :return: 长度字段的值
+    '''
+    size = RTCP_HEADER_SIZE + rc * REPORT_BLOCK_SIZE + len(ext)
+    if isSender:
+        size += RTCP_SENDER_INFO_SIZE
+    return size // 4 - 1
+
+
+def splitCompound(byteStream):
+    '''
+    拆分复合RTCP包
+    :param byteStream: 收到的数据报
+    :return: RtcpPacket的列表
+    '''
+    packets = []
+    start = 0
+    while len(byteStream) - start >= RTCP_HEADER_SIZE:
+        packet = RtcpPacket()
+        packet.decode(byteStream[start:])
+        if packet.version() != 2 or packet.sizeOfPacket() > len(byteStream) - start:
+            break
+        packets.append(packet)
+        start += packet.sizeOfPacket()
+    return packets
@@ -0,0 +1,86 @@
+import socket
+import threading
+import time
+from Constants import *
+from RtcpPacket import splitCompound, RTCP_RR
+
+
+class RtcpService:
+    '''
+    服务器的RTCP端点
+    所有会话共用SETUP中通告的服务器RTCP端口：定期向正在播放的会话发送发送者报告，收到的接收者报告按来源地址交给对应会话的统计对象
+    '''
+
+    def __init__(self, port=SERVER_RTCP_PORT, interval=RTCP_INTERVAL):
+        self.port = port
+        self.interval = interval
+        self.sock = None
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.threads = None
+
+    def register(self, addr, worker):
+        '''
+        :param addr: 客户端的RTCP地址
+        :param worker: 会话，需要有state和stats属性
+        '''
+        with self.lock:
+            self.sessions[addr] = worker
+        self.start()
+
+    def unregister(self, addr):
+        with self.lock:
+            self.sessions.pop(addr, None)
+
+    def getSessions(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def start(self):
+        with self.lock:
+            if self.threads is not None:
+                return
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                self.sock.bind(('0.0.0.0', self.port))
+            except OSError:
+                pass
+            self.threads = [threading.Thread(target=self.receive), threading.Thread(target=self.report)]
+            for thread in self.threads:
+                thread.setDaemon(True)
+                thread.start()
+
+    def receive(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(MAX_UDP_BANDWIDTH)
+            except OSError:
+                continue
+            arrival = time.time()
+            with self.lock:
+                worker = self.sessions.get(addr)
+            if worker is None:
+                continue
+            for packet in splitCompound(data):
+                if packet.packetType() == RTCP_RR:
+                    worker.stats.onReceiverReport(packet, arrival)
+
+    def report(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                sessions = list(self.sessions.items())
+            for (addr, worker) in sessions:
+                if worker.state != PLAYING:
+                    continue
+                try:
+                    self.sock.sendto(worker.stats.makeSenderReport(), addr)
+                except OSError:
+                    continue
+
+
+rtcp_service = RtcpService()
+
+
+def getRtcpService():
+    return rtcp_service
@@ -0,0 +1,253 @@
+'''
+RTCP统计
+服务器端按会话统计发出的包数和字节数并生成发送者报告，解析接收者报告得到丢包率、抖动和往返时延
+客户端按RFC 3550附录A统计扩展序号、丢包和到达间隔抖动，并生成接收者报告
+'''
+
+import time
+import threading
+from Constants import *
+from RtpPacket import HEADER_SIZE
+from RtcpPacket import RtcpPacket, ReportBlock, RTCP_SR, RTCP_RR, packetLength
+
+NTP_OFFSET = 2208988800
+MAX_DROPOUT = 3000
+MAX_MISORDER = 100
+
+
+def ntpTimestamp(moment=None):
+    '''
+    :param moment: Unix时间，默认为当前时间
+    :return: 64位NTP时间戳
+    '''
+    moment = time.time() if moment is None else moment
+    return int((moment + NTP_OFFSET) * (1 << 32)) & ((1 << 64) - 1)
+
+
+def ntpMiddle(ntp):
+    '''NTP时间戳的中间32位，即报告块中的LSR，单位为1/65536秒'''
+    return (ntp >> 16) & 0xFFFFFFFF
+
+
+def packetSize(packet):
+    return sum(len(buf) for buf in packet) if isinstance(packet, (list, tuple)) else len(packet)
+
+
+def packetTimestamp(packet):
+    header = packet[0] if isinstance(packet, (list, tuple)) else packet
+    return int.from_bytes(bytes(header[4:8]), 'big')
+
+
+class SenderStats:
+    '''一个媒体流已发出的包数、负载字节数和最近的RTP时间戳'''
+
+    def __init__(self, ssrc):
+        self.ssrc = ssrc
+        self.packets = 0
+        self.octets = 0
+        self.timestamp = 0
+        self.lock = threading.Lock()
+
+    def record(self, packets):
+        if not packets:
+            return
+        octets = sum(packetSize(packet) for packet in packets) - HEADER_SIZE * len(packets)
+        with self.lock:
+            self.packets += len(packets)
+            self.octets += octets
+            self.timestamp = packetTimestamp(packets[-1])
+
+    def makeReport(self, ntp):
+        with self.lock:
+            packets, octets, timestamp = self.packets, self.octets, self.timestamp
+        report = RtcpPacket()
+        report.encode(2, 0, 0, RTCP_SR, packetLength(0, True), self.ssrc, ntp, timestamp,
+                      packets & 0xFFFFFFFF, octets & 0xFFFFFFFF, [], b'', True)
+        return report.getPacket()
+
+
+class SessionStats:
+    '''服务器端一个会话的统计'''
+
+    def __init__(self):
+        self.video = SenderStats(VIDEO_SSRC)
+        self.audio = SenderStats(AUDIO_SSRC)
+        self.reports = {}
+        self.lock = threading.Lock()
+
+    def makeSenderReport(self):
+        '''
+        :return: 视频和音频两个发送者报告组成的复合RTCP包
+        '''
+        ntp = ntpTimestamp()
+        return self.video.makeReport(ntp) + self.audio.makeReport(ntp)
+
+    def onReceiverReport(self, packet, arrival=None):
+        '''
+        记录接收者报告中的各个报告块
+        :param packet: 解码后的RtcpPacket
+        :param arrival: 到达时间（Unix时间）
+        '''
+        now = ntpMiddle(ntpTimestamp(arrival))
+        for i in range(packet.countOfReportBlocks()):
+            block = packet.getBlockByIndex(i)
+            rtt = None
+            if block.lsr() != 0:
+                rtt = ((now - block.lsr() - block.dlsr()) & 0xFFFFFFFF) / 65536
+            with self.lock:
+                self.reports[block.ssrc()] = {
+                    'fraction_lost': block.frac() / 256,
+                    'cumulative_lost': block.cumulative(),
+                    'highest_seq': block.seq(),
+                    'jitter': block.jitter(),
+                    'rtt': rtt,
+                    'time': time.time() if arrival is None else arrival
+                }
+
+    def getReport(self, ssrc):
+        '''
+        :return: 最近一次接收者报告中该流的统计，没有时为None
+        '''
+        with self.lock:
+            return self.reports.get(ssrc)
+
+    def summary(self):
+        parts = []
+        for (name, sender) in (('video', self.video), ('audio', self.audio)):
+            report = self.getReport(sender.ssrc)
+            text = '%s sent %d pkts' % (name, sender.packets)
+            if report is not None:
+                text += ', lost %.1f%% (%d total), jitter %d' % (
+                    report['fraction_lost'] * 100, report['cumulative_lost'], report['jitter'])
+                if report['rtt'] is not None:
+                    text += ', rtt %.1f ms' % (report['rtt'] * 1000)
+            parts.append(text)
+        return '; '.join(parts)
+
+
+class ReceptionStats:
+    '''
+    客户端一个媒体流的接收统计
+    抖动只在每帧的第一个包上计算，同一帧的分片由发送端在帧间隔内均匀发出，逐包计算会把平滑发送误算成抖动
+    '''
+
+    def __init__(self, ssrc, clock_rate, scale=1.0):
+        '''
+        :param ssrc: 媒体流的同步源标识符
+        :param clock_rate: 抖动使用的时钟频率
+        :param scale: 一个RTP时间戳单位对应的时钟周期数
+        '''
+        self.ssrc = ssrc
+        self.clock_rate = clock_rate
+        self.scale = scale
+        self.base_seq = None
+        self.max_seq = 0
+        self.cycles = 0
+        self.received = 0
+        self.expected_prior = 0
+        self.received_prior = 0
+        self.last_timestamp = None
+        self.transit = None
+        self.jitter = 0.0
+        self.lsr = 0
+        self.sr_arrival = None
+
+    def update(self, seq, timestamp, arrival):
+        '''
+        :param seq: 16位序号
+        :param timestamp: RTP时间戳
+        :param arrival: 到达时间（秒）
+        '''
+        if self.base_seq is None:
+            self.base_seq = self.max_seq = seq
+        else:
+            delta = (seq - self.max_seq) & 0xFFFF
+            if 0 < delta < MAX_DROPOUT:
+                if seq < self.max_seq:
+                    self.cycles += 1 << 16
+                self.max_seq = seq
+            elif delta >= (1 << 16) - MAX_MISORDER or delta == 0:
+                pass
+            else:
+                self.base_seq = self.max_seq = seq
+                self.cycles = 0
+                self.received = self.expected_prior = self.received_prior = 0
+        self.received += 1
+        if timestamp != self.last_timestamp:
+            self.last_timestamp = timestamp
+            transit = arrival * self.clock_rate - timestamp * self.scale
+            if self.transit is not None:
+                self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+            self.transit = transit
+
+    def extendedMax(self):
+        return self.cycles + self.max_seq
+
+    def expected(self):
+        return self.extendedMax() - self.base_seq + 1 if self.base_seq is not None else 0
+
+    def lost(self):
+        return self.expected() - self.received
+
+    def onSenderReport(self, packet, arrival):
+        self.lsr = ntpMiddle(packet.ntpTimestamp())
+        self.sr_arrival = arrival
+
+    def makeBlock(self, now):
+        '''
+        生成报告块，同时开始新的统计区间
+        :param now: 当前时间（秒）
+        :return: ReportBlock
+        '''
+        expected = self.expected()
+        expected_interval = expected - self.expected_prior
+        received_interval = self.received - self.received_prior
+        self.expected_prior, self.received_prior = expected, self.received
+        lost_interval = expected_interval - received_interval
+        fraction = 0
+        if expected_interval > 0 and lost_interval > 0:
+            fraction = min((lost_interval << 8) // expected_interval, 255)
+        dlsr = int((now - self.sr_arrival) * 65536) & 0xFFFFFFFF if self.sr_arrival is not None else 0
+        block = ReportBlock()
+        block.encode(self.ssrc, fraction, min(max(self.lost(), 0), 0xFFFFFF), self.extendedMax() & 0xFFFFFFFF,
+                     int(self.jitter) & 0xFFFFFFFF, self.lsr, dlsr)
+        return block
+
+
+class ReceiverStats:
+    '''客户端一个会话的接收统计'''
+
+    def __init__(self, ssrc, framerate, samplerate):
+        self.ssrc = ssrc
+        framerate = framerate if framerate > 0 else DEFAULT_VIDEO_FRAMERATE
+        self.streams = {
+            VIDEO: ReceptionStats(VIDEO_SSRC, VIDEO_CLOCK_RATE, VIDEO_CLOCK_RATE / framerate),
+            AUDIO: ReceptionStats(AUDIO_SSRC, max(samplerate, 1))
+        }
+        self.lock = threading.Lock()
+
+    def onPacket(self, media_type, seq, timestamp, arrival):
+        stream = self.streams.get(media_type)
+        if stream is not None:
+            with self.lock:
+                stream.update(seq, timestamp, arrival)
+
+    def onSenderReport(self, packet, arrival):
+        with self.lock:
+            for stream in self.streams.values():
+                if stream.ssrc == packet.ssrc():
+                    stream.onSenderReport(packet, arrival)
+
+    def makeReceiverReport(self, now):
+        '''
+        :return: 接收者报告，每个收到过包的媒体流一个报告块
+        '''
+        with self.lock:
+            blocks = [stream.makeBlock(now) for stream in self.streams.values() if stream.base_seq is not None]
+        report = RtcpPacket()
+        report.encode(2, 0, len(blocks), RTCP_RR, packetLength(len(blocks), False), self.ssrc, 0, 0, 0, 0,
+                      blocks, b'', False)
+        return report.getPacket()
+
+    def getStream(self, media_type):
+        return self.streams.get(media_type)
@@ -0,0 +1,42 @@
+'''
+RTP/JPEG 分片（RFC 2435）
+每个分片前加8字节的JPEG主头部：类型相关字段(8) | 分片偏移(24) | 类型(8) | Q(8) | 宽/8 | 高/8
+与RFC不同的是负载携带完整的JFIF码流（含量化表和哈夫曼表），接收端按偏移拼回即可直接解码，无需重建文件头
+'''
+
+import struct
+from Constants import *
+
+JPEG_HEADER = struct.Struct('!IBBBB')
+JPEG_HEADER_SIZE = JPEG_HEADER.size
+JPEG_TYPE = 1
+JPEG_Q = 255
+
+
+def packJpegHeader(offset, width, height, q=JPEG_Q):
+    return JPEG_HEADER.pack(offset & 0xFFFFFF, JPEG_TYPE, q, (width // 8) & 255, (height // 8) & 255)
+
+
+def unpackJpegHeader(payload):
+    '''
+    解析JPEG主头部
+    :param payload: RTP负载
+    :return: (分片偏移, Q, 宽, 高)
+    '''
+    word, _, q, width, height = JPEG_HEADER.unpack_from(payload)
+    return word & 0xFFFFFF, q, width * 8, height * 8
+
+
+def fragmentJpeg(jpeg, width, height, mtu=RTP_MTU):
+    '''
+    把一帧JPEG按MTU切成RTP/JPEG负载
+    :param jpeg: 编码后的JPEG字节流
+    :param width: 图像宽度
+    :param height: 图像高度
+    :param mtu: 单个RTP包（含RTP头）的最大字节数
+    :return: 负载列表，依次对应帧内各分片；每个负载是 (JPEG主头部, 分片数据)，分片数据是原字节流的memoryview，不拷贝
+    '''
+    chunk = mtu - HEADER_SIZE - JPEG_HEADER_SIZE
+    view = memoryview(jpeg)
+    return [(packJpegHeader(offset, width, height), view[offset:offset + chunk])
+            for offset in range(0, len(jpeg), chunk)]
@@ -1,76 +1,130 @@
-from time import time
+import struct
 
 HEADER_SIZE = 12
 from Constants import *
 
+RTP_HEADER = struct.Struct('!BBHII')
+
+
+def headerFields(seqnum, marker, pt, ssrc, timestamp, version=2, padding=0, extension=0, cc=0):
+    '''
+    :return: 按RTP_HEADER顺序排列的头部字段
+    '''
+    return ((version << 6) | (padding << 5) | (extension << 4) | cc, (marker << 7) | pt,
+            seqnum & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc & 0xFFFFFFFF)
+
+
+def packHeader(seqnum, marker, pt, ssrc, timestamp, version=2, padding=0, extension=0, cc=0):
+    '''
+    只编码RTP头部
+    :return: 12字节的头部，和负载一起作为缓冲区列表分散-聚集发送，负载不需要拷贝
+    '''
+    return RTP_HEADER.pack(*headerFields(seqnum, marker, pt, ssrc, timestamp, version, padding, extension, cc))
+
+
+def parseHeader(view):
+    '''
+    直接从接收缓冲区解析RTP头部，不创建RtpPacket对象
+    :param view: 数据报（memoryview）
+    :return: (序号, 标记位, 负载类型, 时间戳)
+    '''
+    _, second, seq, timestamp, _ = RTP_HEADER.unpack_from(view)
+    return seq, second >> 7, second & 127, timestamp
+
 
 class RtpPacket:
-    header = bytearray(HEADER_SIZE)
+    '''
+    RTP包
+    编码时头部由预编译的struct一次写出，负载保持原对象；解码时只保留memoryview，头部字段在第一次访问时才解析
+    '''
+    __slots__ = ('header', 'payload', 'fields', 'data')
 
     def __init__(self):
-        pass
+        self.header = b''
+        self.payload = b''
+        self.fields = None
+        self.data = None
 
     def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, timestamp):
         """Encode the RTP packet with header fields and payload."""
-        # timestamp = int(time())
-        header = bytearray(HEADER_SIZE)
-        # Fill the header bytearray with RTP header fields
-        header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
-        header[1] = (marker << 7) | pt
-        header[2] = (seqnum >> 8) & 255  # upper bits
-        header[3] = seqnum & 255
-        header[4] = timestamp >> 24 & 255
-        header[5] = timestamp >> 16 & 255
-        header[6] = timestamp >> 8 & 255
-        header[7] = timestamp & 255
-        header[8] = ssrc >> 24 & 255
-        header[9] = ssrc >> 16 & 255
-        header[10] = ssrc >> 8 & 255
-        header[11] = ssrc & 255
-
-        self.header = header
-
-        # Get the payload from the argument
+        self.fields = headerFields(seqnum, marker, pt, ssrc, timestamp, version, padding, extension, cc)
+        self.header = RTP_HEADER.pack(*self.fields)
         self.payload = payload
+        self.data = None
+
+    def encodeHeader(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, timestamp):
+        """Encode only the header and return it, for scatter-gather sends."""
+        self.fields = headerFields(seqnum, marker, pt, ssrc, timestamp, version, padding, extension, cc)
+        self.header = RTP_HEADER.pack(*self.fields)
+        self.data = None
+        return self.header
 
     def decode(self, byteStream):
-        """Decode the RTP packet."""
-        self.header = bytearray(byteStream[:HEADER_SIZE])
-        self.payload = byteStream[HEADER_SIZE:]
+        """Decode the RTP packet without copying it; fields and payload are sliced on first access."""
+        self.data = byteStream
+        self.header = None
+        self.payload = None
+        self.fields = None
+
+    def getFields(self):
+        if self.fields is None:
+            self.fields = RTP_HEADER.unpack_from(self.header if self.data is None else self.data)
+        return self.fields
 
     def version(self):
         """Return RTP version."""
-        return int(self.header[0] >> 6)
+        return self.getFields()[0] >> 6
 
     def seqNum(self):
         """Return sequence (frame) number."""
-        seqNum = self.header[2] << 8 | self.header[3]
-        return int(seqNum)
+        return self.getFields()[2]
 
     def timestamp(self):
         """Return timestamp."""
-        timestamp = self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7]
-        return int(timestamp)
+        return self.getFields()[3]
+
+    def ssrc(self):
+        return self.getFields()[4]
 
     def payloadType(self):
         """Return payload type."""
-        pt = self.header[1] & 127
-        return int(pt)
+        return self.getFields()[1] & 127
 
     def getPayload(self):
         """Return payload."""
+        if self.payload is None:
+            self.payload = memoryview(self.data)[HEADER_SIZE:]
         return self.payload
 
+    def getHeader(self):
+        if self.header is None:
+            self.header = memoryview(self.data)[:HEADER_SIZE]
+        return self.header
+
+    def getBuffers(self):
+        """Return the header and payload as separate buffers, without joining them."""
+        return self.getHeader(), self.getPayload()
+
+    def packInto(self, buffer, offset=0):
+        """Write the packet into a preallocated buffer and return its length."""
+        payload = self.getPayload()
+        end = offset + HEADER_SIZE + len(payload)
+        RTP_HEADER.pack_into(buffer, offset, *self.getFields())
+        buffer[offset + HEADER_SIZE:end] = payload
+        return end - offset
+
     def getPacket(self):
         """Return RTP packet."""
-        return self.header + self.payload
+        if self.data is not None:
+            return self.data
+        return b''.join((self.header, self.payload))
 
     def getMarker(self):
-        return (self.header[1] & (1 << 7)) != 0
+        return (self.getFields()[1] & (1 << 7)) != 0
 
     def getType(self):
-        media_type = int(self.header[1] & 127)
-        if media_type == 26:
+        media_type = self.payloadType()
+        if media_type == VIDEO_PAYLOAD_TYPE:
             return VIDEO
-        elif media_type == 97:
+        elif media_type in AUDIO_PAYLOAD_TYPES:
             return AUDIO
@@ -0,0 +1,66 @@
+'''
+RTP字幕轨
+每条字幕一个包，时间戳为字幕的开始帧（与视频时间戳同为帧号），负载为8字节头部加UTF-8文本：开始帧(32) | 结束帧(32) | 文本
+字幕出现时发送，显示期间每隔SUBTITLE_REPEAT秒重发一次，丢包后最多晚这么久出现；客户端按视频时间戳自行决定显示哪一条
+'''
+
+import struct
+import threading
+from Constants import *
+
+CUE_HEADER = struct.Struct('!II')
+CUE_HEADER_SIZE = CUE_HEADER.size
+
+
+def packCue(start, end, text, mtu=RTP_MTU):
+    '''
+    :param start: 开始帧的时间戳
+    :param end: 结束帧的时间戳（含）
+    :param text: 字幕
+    :return: RTP负载，超过一个包的文本被截断
+    '''
+    data = text.encode('utf-8')[:mtu - HEADER_SIZE - CUE_HEADER_SIZE]
+    return CUE_HEADER.pack(start & 0xFFFFFFFF, end & 0xFFFFFFFF) + data
+
+
+def unpackCue(payload):
+    '''
+    :param payload: RTP负载
+    :return: (开始帧, 结束帧, 字幕)
+    '''
+    start, end = CUE_HEADER.unpack_from(payload)
+    return start, end, bytes(payload[CUE_HEADER_SIZE:]).decode('utf-8', errors='ignore')
+
+
+class CueTrack:
+    '''
+    客户端收到的字幕
+    接收线程放入，播放线程按正在显示的视频时间戳查找；已经结束的字幕在查找时清除
+    '''
+
+    def __init__(self):
+        self.cues = {}
+        self.lock = threading.Lock()
+
+    def add(self, start, end, text):
+        with self.lock:
+            self.cues[start] = (end, text)
+
+    def lookup(self, timestamp):
+        '''
+        :param timestamp: 视频时间戳
+        :return: 该帧显示的字幕，没有时为None
+        '''
+        with self.lock:
+            found = None
+            for start in list(self.cues):
+                end, text = self.cues[start]
+                if end < timestamp:
+                    del self.cues[start]
+                elif start <= timestamp and (found is None or start > found[0]):
+                    found = (start, text)
+            return found[1] if found is not None else None
+
+    def clear(self):
+        with self.lock:
+            self.cues.clear()
@@ -2,14 +2,31 @@ from Constants import *
 import time
 import re
 from Exception import *
+from AudioCodec import AUDIO_PAYLOAD_NAMES
+
+verbose = True
+
+
+def setVerbose(enabled):
+    '''是否打印收发的RTSP消息，压力测试时关闭'''
+    global verbose
+    verbose = enabled
+
+
+def isVerbose():
+    return verbose
 
 
 class ResponseParser:
     def __init__(self, data, request_sent):
-        print('\nReceived: ', data)
+        if verbose:
+            print('\nReceived: ', data)
         self.request_sent = request_sent
         self.cseq = None
         self.video_framerate, self.audio_samplerate, self.totalframes = 0, 0, 0
+        self.audio_payloads = [AUDIO_PAYLOAD_FLOAT]
+        self.subtitle_payload = None
+        self.server_rtp_port, self.server_rtcp_port = SERVER_RTP_PORT, SERVER_RTCP_PORT
         self.parse(data)
 
     def parse(self, data):
@@ -25,13 +42,31 @@ class ResponseParser:
                 self.session_id = self.session_id[:-1]
             self.session_id = int(self.session_id)
             self.status_code = int(lines[0].split(' ')[1])
+            if self.request_sent == SETUP:
+                match = re.search(r'server_port=(\d+)-(\d+)', data)
+                if match is not None:
+                    self.server_rtp_port, self.server_rtcp_port = int(match.groups()[0]), int(match.groups()[1])
             if self.request_sent == DESCRIBE:
-                self.video_framerate = float(lines[9][12:])
-                self.audio_samplerate = int(lines[10][13:])
-                self.totalframes = int(lines[11][14:])
+                self.parseSdp(lines)
         except:
             raise ParseError
 
+    def parseSdp(self, lines):
+        '''按字段名解析SDP，不依赖行的位置'''
+        attributes = {}
+        for line in lines:
+            line = line.strip()
+            if line.startswith('m=audio'):
+                self.audio_payloads = [int(pt) for pt in line.split(' ')[3:]]
+            elif line.startswith('m=text'):
+                self.subtitle_payload = int(line.split(' ')[3])
+            elif line.startswith('a='):
+                key, _, value = line[2:].partition(':')
+                attributes[key] = value
+        self.video_framerate = float(attributes['framerate'])
+        self.audio_samplerate = int(attributes['samplerate'])
+        self.totalframes = int(attributes['totalframes'])
+
     def getSeq(self):
         return self.cseq
 
@@ -44,6 +79,18 @@ class ResponseParser:
     def getAVParameters(self):
         return self.video_framerate, self.audio_samplerate, self.totalframes
 
+    def getAudioPayloads(self):
+        return self.audio_payloads
+
+    def getSubtitlePayload(self):
+        '''
+        :return: 字幕轨的负载类型，没有字幕时为None
+        '''
+        return self.subtitle_payload
+
+    def getServerPorts(self):
+        return self.server_rtp_port, self.server_rtcp_port
+
 
 class RequestSender():
     def __init__(
@@ -53,7 +100,7 @@ class RequestSender():
             startPosition=0, step=1,
             audiobias=0,
             lowres=False,
-            subtitleRequired=False
+            audioPayload=AUDIO_PAYLOAD_FLOAT
     ):
         self.socket = socket
         self.filename = filename
@@ -63,20 +110,22 @@ class RequestSender():
         self.start_position = startPosition
         self.step = step
         self.audio_bias = audiobias
-        self.subtitleRequired = 'True' if subtitleRequired else 'False'
+        self.audio_payload = audioPayload
         if lowres:
             self.resolution = 'low'
         else:
             self.resolution = 'high'
 
     def send(self, request):
-        print('\nSend: ', request)
+        if verbose:
+            print('\nSend: ', request)
         self.socket.send(request.encode())
 
     def sendSetup(self):
         request = 'SETUP %s RTSP/1.0\n' \
                   'CSeq: %d\n' \
-                  'Transport: RTP/UDP; client_port=%d-%d' % (self.filename, self.cseq, self.port, self.port + 1)
+                  'Transport: RTP/UDP; client_port=%d-%d\n' \
+                  'AudioPayload: %d' % (self.filename, self.cseq, self.port, self.port + 1, self.audio_payload)
         self.send(request)
 
     def sendPlay(self):
@@ -86,10 +135,9 @@ class RequestSender():
                   'Range: npt=%d-\n' \
                   'Step: %d\n' \
                   'AudioBias: %d\n' \
-                  'Resolution: %s\n' \
-                  'Subtitles: %s' % (self.filename, self.cseq,
-                                     self.session, self.start_position,
-                                     self.step, self.audio_bias, self.resolution, self.subtitleRequired)
+                  'Resolution: %s' % (self.filename, self.cseq,
+                                      self.session, self.start_position,
+                                      self.step, self.audio_bias, self.resolution)
         self.send(request)
 
     def sendPause(self):
@@ -127,9 +175,11 @@ class ResponseSender:
         self.client_rtp_port, self.client_rtcp_port = client_rtp_port, client_rtcp_port
         self.server_rtp_port, self.server_rtcp_port = server_rtp_port, server_rtcp_port
         self.video_framerate, self.audio_samplerate, self.total_frames = video_framerate, audio_samplerate, total_frames
+        self.subtitles = False
 
     def send(self, response):
-        print('Send: ', response)
+        if verbose:
+            print('Send: ', response)
         self.socket.send(response.encode('utf-8'))
 
     def sendSetup(self):
@@ -166,15 +216,24 @@ class ResponseSender:
         self.send(response)
 
     def sendDescribe(self):
+        audio_rtpmap = ''.join('a=rtpmap:%d %s/%d/2\r\n' % (pt, AUDIO_PAYLOAD_NAMES[pt], self.audio_samplerate)
+                               for pt in AUDIO_PAYLOAD_TYPES)
+        text = ''
+        if self.subtitles:
+            text = 'm=text %d RTP/AVP %d\r\n' \
+                   'a=rtpmap:%d SUBTITLE/90000\r\n' % (self.client_rtp_port, SUBTITLE_PAYLOAD_TYPE,
+                                                        SUBTITLE_PAYLOAD_TYPE)
         sdp = 'm=video %d RTP/AVP 26\r\n' \
-              'm=audio %d RTP/AVP 97\r\n' \
-              'a=rtpmap:26 H264/90000\r\n' \
+              'm=audio %d RTP/AVP %s\r\n' \
+              'a=rtpmap:26 JPEG/90000\r\n' \
+              '%s' \
+              '%s' \
               'a=framerate:%f\r\n' \
               'a=samplerate:%d\r\n' \
               'a=totalframes:%d\r\n' \
               'c=IN IP4 %s\r\n' % (
-                  self.client_rtp_port, self.client_rtp_port, self.video_framerate, self.audio_samplerate,
-                  self.total_frames, self.local_ip)
+                  self.client_rtp_port, self.client_rtp_port, ' '.join(str(pt) for pt in AUDIO_PAYLOAD_TYPES),
+                  audio_rtpmap, text, self.video_framerate, self.audio_samplerate, self.total_frames, self.local_ip)
         response = 'RTSP/1.0 200 OK\r\n' \
                    'CSeq: %d\r\n' \
                    'Session: %d\r\n' \
@@ -185,23 +244,25 @@ class ResponseSender:
                    '\r\n' % (self.cseq, self.session_id, self.url, len(sdp), sdp)
         self.send(response)
 
-    def setAVParameters(self, framerate, samplerate, totalframes):
+    def setAVParameters(self, framerate, samplerate, totalframes, subtitles=False):
         self.video_framerate = framerate
         self.audio_samplerate = samplerate
         self.total_frames = totalframes
+        self.subtitles = subtitles
 
 
 class RequestParser:
     def __init__(self, data):
-        print('Receive: ', data)
+        if verbose:
+            print('Receive: ', data)
         self.method = None
         self.url = None
         self.version = None
         self.cseq = None
         self.client_rtp_port, self.client_rtcp_port = None, None
         self.start_position = None
-        self.subtitleRequired = False
         self.audio_bias = 0
+        self.audio_payload = AUDIO_PAYLOAD_FLOAT
         self.parse(data)
 
     def strToMethod(self, str):
@@ -217,12 +278,14 @@ class RequestParser:
         if self.method == SETUP:
             match = re.search(r'client_port\s*=\s*(\d+)-(\d+)', lines[2]).groups()
             self.client_rtp_port, self.client_rtcp_port = int(match[0]), int(match[1])
+            match = re.search(r'AudioPayload:\s*(\d+)', data)
+            if match is not None and int(match.groups()[0]) in AUDIO_PAYLOAD_TYPES:
+                self.audio_payload = int(match.groups()[0])
         if self.method == PLAY:
             self.start_position = int(lines[3][11:-1])
             self.step = int(lines[4][6:])
             self.audio_bias = int(lines[5][11:])
             self.resolution = lines[6][12:]
-            self.subtitleRequired = (lines[7][11:] == 'True')
             if self.resolution == 'high':
                 self.lowres = False
             else:
@@ -255,5 +318,5 @@ class RequestParser:
     def isLowResolution(self):
         return self.lowres
 
-    def isSubtitleRequired(self):
-        return self.subtitleRequired
+    def getAudioPayload(self):
+        return self.audio_payload
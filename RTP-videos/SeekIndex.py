@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import shutil
+import threading
+import subprocess
+from bisect import bisect_right
+import numpy as np
+from Constants import *
+
+
+def seekIndexName(filename):
+    return os.path.splitext(filename)[0] + SEEK_INDEX_SUFFIX
+
+
+class SeekIndex:
+    '''
+    持久化的定位索引：帧号 -> 关键帧和显示时间
+    只有ffprobe探测得到的精确索引才写入文件，估算的索引每次启动重新探测
+    音频偏移由同一次探测得到的音视频起始时间计算，保证定位后音画对齐
+    '''
+
+    def __init__(self, filename, framerate, totalframes):
+        self.filename = filename
+        self.framerate = framerate
+        self.totalframes = totalframes
+        self.keyframes = None
+        self.frame_times = None
+        self.audio_start = 0.0
+        self.exact = False
+        if not self.load():
+            self.build()
+            if self.exact:
+                self.save()
+
+    def load(self):
+        name = seekIndexName(self.filename)
+        if not os.path.exists(name) or os.path.getmtime(name) < os.path.getmtime(self.filename):
+            return False
+        try:
+            with np.load(name) as data:
+                self.keyframes = data['keyframes']
+                self.frame_times = data['frame_times']
+                self.audio_start = float(data['audio_start'])
+                self.exact = bool(data['exact'])
+        except (OSError, KeyError, ValueError):
+            return False
+        return self.exact
+
+    def save(self):
+        name = seekIndexName(self.filename)
+        try:
+            with open(name, 'wb') as f:
+                np.savez(f, keyframes=self.keyframes, frame_times=self.frame_times,
+                         audio_start=self.audio_start, exact=self.exact)
+        except OSError:
+            pass
+
+    def build(self):
+        if shutil.which('ffprobe') is None or not self.probe():
+            self.keyframes = np.arange(max(self.totalframes, 1), dtype=np.int64)
+            self.frame_times = self.keyframes / self.framerate
+            self.audio_start = 0.0
+            self.exact = False
+
+    def probe(self):
+        '''
+        用ffprobe读出各流的起始时间，以及第一路视频流每个包的显示时间和关键帧标记
+        :return: 是否探测成功
+        '''
+        streams = self.runProbe('-show_entries', 'stream=codec_type,start_time')
+        packets = self.runProbe('-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags')
+        if streams is None or packets is None:
+            return False
+        video_start, audio_start = None, None
+        for stream in streams.get('streams', []):
+            if stream.get('codec_type') == 'video' and video_start is None:
+                video_start = float(stream.get('start_time', 0.0))
+            if stream.get('codec_type') == 'audio' and audio_start is None:
+                audio_start = float(stream.get('start_time', 0.0))
+        packets = [p for p in packets.get('packets', []) if 'pts_time' in p]
+        if video_start is None or not packets:
+            return False
+        packets.sort(key=lambda p: float(p['pts_time']))
+        self.frame_times = np.array([float(p['pts_time']) for p in packets]) - video_start
+        is_key = np.array(['K' in p.get('flags', '') for p in packets])
+        self.keyframes = np.flatnonzero(is_key).astype(np.int64)
+        if len(self.keyframes) == 0 or self.keyframes[0] != 0:
+            self.keyframes = np.concatenate(([0], self.keyframes))
+        self.audio_start = (audio_start if audio_start is not None else video_start) - video_start
+        self.exact = True
+        return True
+
+    def runProbe(self, *options):
+        '''
+        :param options: ffprobe的选项
+        :return: 解析后的JSON输出，失败时为None
+        '''
+        command = ['ffprobe', '-v', 'error', '-of', 'json', *options, self.filename]
+        try:
+            output = subprocess.run(command, capture_output=True, check=True).stdout
+            return json.loads(output)
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            return None
+
+    def keyframeBefore(self, pos):
+        i = bisect_right(self.keyframes, pos) - 1
+        return int(self.keyframes[max(i, 0)])
+
+    def frameTime(self, pos):
+        if 0 <= pos < len(self.frame_times):
+            return float(self.frame_times[pos])
+        return pos / self.framerate
+
+    def audioSample(self, pos, samplerate):
+        return max(int(round((self.frameTime(pos) - self.audio_start) * samplerate)), 0)
+
+
+seek_indices = {}
+seek_pending = {}
+seek_lock = threading.Lock()
+
+
+def getSeekIndex(filename, framerate, totalframes):
+    '''
+    取得媒体文件的定位索引，同一文件在进程内只加载一次
+    探测在锁外进行，只有请求同一文件的会话等待，其他文件的会话不受影响
+    :return: SeekIndex，文件不存在时为None
+    '''
+    if not os.path.exists(filename):
+        return None
+    key = (filename, os.path.getmtime(filename))
+    while True:
+        with seek_lock:
+            index = seek_indices.get(key)
+            if index is not None:
+                return index
+            event = seek_pending.get(key)
+            if event is None:
+                event = seek_pending[key] = threading.Event()
+                break
+        event.wait()
+    index = None
+    try:
+        index = SeekIndex(filename, framerate, totalframes)
+    finally:
+        with seek_lock:
+            if index is not None:
+                seek_indices[key] = index
+            del seek_pending[key]
+        event.set()
+    return index
+
+
+def main():
+    import cv2
+    for filename in sys.argv[1:]:
+        cap = cv2.VideoCapture(filename)
+        index = getSeekIndex(filename, cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        print(filename, len(index.keyframes), 'keyframes', 'exact' if index.exact else 'estimated')
+
+
+if __name__ == '__main__':
+    main()
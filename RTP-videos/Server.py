@@ -1,10 +1,44 @@
+import time
 import socket
+import argparse
 import threading
-from MediaStream import VideoStream, AudioStream
+from MediaStream import VideoStream, AudioStream, SubtitleStream
 from Constants import *
 import random
-from RtspTools import ResponseSender, RequestParser
+from RtspTools import ResponseSender, RequestParser, setVerbose, isVerbose
 from Exception import *
+from UdpBatch import BatchSender, getSendStats
+from PacingScheduler import getPacingScheduler
+from EncodePool import configureEncodePool
+from BroadcastGroup import configureBroadcast, getBroadcastRegistry
+from RtcpStats import SessionStats
+from RtcpService import getRtcpService
+from AudioSamples import configurePcmCache
+from QualityLadder import QualityController, configureLadder, isAdaptive, parseLadder
+
+
+shared_rtp_socket = None
+shared_batch_sender = None
+shared_lock = threading.Lock()
+
+
+def getSharedRtpSocket():
+    '''所有会话共用一个RTP套接字，绑定在SETUP中通告的服务器端口上，调度器可以把各会话的包合并发送'''
+    global shared_rtp_socket, shared_batch_sender
+    with shared_lock:
+        if shared_rtp_socket is None:
+            shared_rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                shared_rtp_socket.bind(('0.0.0.0', SERVER_RTP_PORT))
+            except OSError:
+                pass
+            shared_batch_sender = BatchSender(shared_rtp_socket)
+        return shared_rtp_socket
+
+
+def getSharedBatchSender():
+    getSharedRtpSocket()
+    return shared_batch_sender
 
 
 class ServerWorker:
@@ -24,6 +58,7 @@ class ServerWorker:
         self.cseq = 0
         self.url = None
         self.audio_bias = 0
+        self.audio_payload = AUDIO_PAYLOAD_FLOAT
 
         self.event = threading.Event()
         self.state = INIT
@@ -31,48 +66,69 @@ class ServerWorker:
         self.video_thread = None
         self.audio_thread = None
 
-        self.rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.video_yield_semaphore = threading.Semaphore(1)
-        self.video_consume_semaphore = threading.Semaphore(0)
-        self.audio_yield_semaphore = threading.Semaphore(1)
-        self.audio_consume_semaphore = threading.Semaphore(0)
+        self.rtp_socket = self.createRtpSocket()
+        self.batch_sender = self.createBatchSender()
+        self.pacer = getPacingScheduler()
+        self.pace_start = 0
+        self.frames_paced = 0
         self.synchronize_semaphore = threading.Semaphore(0)
 
         self.video_stream = None
         self.audio_stream = None
+        self.subtitle_stream = None
         self.total_frames = 0
         self.video_framerate = 0
         self.audio_samplerate = 0
         self.client_teardown = False
         self.low_res = False
-        self.subtitle_required = False
+        self.group = None
+        self.stats = SessionStats()
+        self.quality = QualityController()
+        self.last_report_time = None
+        self.window_frames = 0
+        self.window_late = 0
 
     def playVideo(self):
         while True:
             self.event.wait()
-            self.video_consume_semaphore.acquire()
-            frame = self.video_stream.nextFrame()
-            if frame is not None:
-                self.rtp_socket.sendto(frame, (self.client_addr, self.client_rtp_port))
-                self.video_yield_semaphore.release()
+            packets = self.video_stream.nextFrame(RTP_TIMEOUT)
+            if packets is not None:
+                interval = self.frameInterval()
+                deadline = self.pace_start + self.frames_paced * interval
+                self.frames_paced += 1
+                self.pacer.waitUntil(deadline - PACING_LEAD)
+                late = time.monotonic() > deadline
+                self.pacer.schedule(self.batch_sender, packets, (self.client_addr, self.client_rtp_port),
+                                    deadline, interval)
+                self.stats.video.record(packets)
+                self.sendSubtitles(deadline)
+                self.adaptQuality(late)
                 self.synchronize_semaphore.release()
                 # self.event.wait(TIME_ELAPSED)
-            else:
-                break
 
     def playAudio(self):
         while True:
             # self.event.wait(TIME_ELAPSED)
             self.event.wait()
-            self.audio_consume_semaphore.acquire()
-            for i in range(4):
+            for i in range(AUDIO_FRAMES_PER_CHUNK):
                 self.synchronize_semaphore.acquire()
             frame = self.audio_stream.nextFrame()
             if frame is not None:
-                self.rtp_socket.sendto(frame, (self.client_addr, self.client_rtp_port))
-                self.audio_yield_semaphore.release()
-            else:
-                break
+                self.pacer.schedule(self.batch_sender, [frame], (self.client_addr, self.client_rtp_port),
+                                    time.monotonic())
+                self.stats.audio.record([frame])
+
+    def sendSubtitles(self, deadline):
+        '''随刚发出的视频帧发送字幕包'''
+        packets = self.subtitle_stream.nextPackets(self.video_stream.timestamp)
+        if packets:
+            self.pacer.schedule(self.batch_sender, packets, (self.client_addr, self.client_rtp_port), deadline)
+
+    def createRtpSocket(self):
+        return getSharedRtpSocket()
+
+    def createBatchSender(self):
+        return getSharedBatchSender()
 
     def createThreads(self):
         if self.video_thread is None:
@@ -85,6 +141,9 @@ class ServerWorker:
             self.audio_thread.start()
 
     def handleSetup(self):
+        getRtcpService().register((self.client_addr, self.client_rtcp_port), self)
+        if self.audio_stream is not None:
+            self.audio_stream.setPayloadType(self.audio_payload)
         self.sender.sendSetup()
         if self.state == INIT:
             self.state = READY
@@ -93,43 +152,113 @@ class ServerWorker:
         self.sender.sendPlay()
         if self.state == READY:
             self.state = PLAYING
+            if self.joinBroadcast():
+                return
             self.createThreads()
-            if self.start_position > 0:
-                self.event.clear()
-                self.video_stream.setPosition(self.start_position)
-                self.audio_stream.setPosition(self.start_position)
-            if self.audio_bias != 0:
-                self.event.clear()
-                self.audio_stream.setBias(self.audio_bias)
-            self.video_stream.setSubtitles(self.subtitle_required)
-            self.video_stream.setLowResolution(self.low_res)
-            self.video_stream.setStep(self.step)
-            self.audio_stream.setStep(self.step)
-            self.event.set()
-            self.video_stream.yieldFrame()
-            self.audio_stream.yieldFrame()
+            self.configureStreams()
+            self.startStreaming()
+
+    def joinBroadcast(self):
+        '''
+        从头开始、没有音频偏移的播放请求尝试加入广播组
+        :return: 是否已加入
+        '''
+        registry = getBroadcastRegistry()
+        if registry.window <= 0 or self.start_position > 0 or self.audio_bias != 0:
+            return False
+        key = (self.media, self.low_res, self.step, self.audio_payload)
+        self.group = registry.join(key, self.media, self.batch_sender, self.session_id,
+                                   (self.client_addr, self.client_rtp_port), self.stats)
+        return True
+
+    def leaveBroadcast(self):
+        '''离开广播组，之后单独播放时从组的包序号继续编号'''
+        if self.group is not None:
+            getBroadcastRegistry().leave(self.group, self.session_id)
+            self.video_stream.frameseq, self.audio_stream.frameseq = self.group.getSequenceNumbers()
+            self.group = None
+
+    def configureStreams(self):
+        if self.start_position > 0:
+            self.event.clear()
+            position = self.video_stream.setPosition(self.start_position)
+            self.audio_stream.setPosition(position)
+        if self.audio_bias != 0:
+            self.event.clear()
+            self.audio_stream.setBias(self.audio_bias)
+        self.subtitle_stream.reset()
+        self.video_stream.setLowResolution(self.low_res)
+        self.video_stream.setStep(self.step)
+        self.audio_stream.setStep(self.step)
+        if isAdaptive():
+            self.quality.setCeiling(LOW_RESOLUTION if self.low_res else HIGH_RESOLUTION)
+            self.video_stream.setRung(*self.quality.getRung())
+
+    def adaptQuality(self, late):
+        '''
+        每发出一帧调用一次；收到新的接收者报告，或者没有报告但已经过了一个RTCP周期时，按反馈调整画质
+        :param late: 这一帧是否晚于计划的发送时刻才准备好
+        '''
+        if not isAdaptive():
+            return
+        self.window_frames += 1
+        self.window_late += late
+        report = self.stats.getReport(VIDEO_SSRC)
+        fresh = report is not None and report['time'] != self.last_report_time
+        if not fresh and self.window_frames < RTCP_INTERVAL / self.frameInterval():
+            return
+        if fresh:
+            self.last_report_time = report['time']
+        late_ratio = self.window_late / self.window_frames
+        self.window_frames, self.window_late = 0, 0
+        if self.quality.update(report if fresh else None, late_ratio):
+            size, quality = self.quality.getRung()
+            if isVerbose():
+                print('session %d: switching to %dx%d at quality %d' % (self.session_id, size[0], size[1], quality))
+            self.video_stream.setRung(size, quality)
+
+    def frameInterval(self):
+        if self.video_framerate > 0:
+            return 1 / self.video_framerate
+        return 1 / DEFAULT_VIDEO_FRAMERATE
+
+    def resetPacing(self):
+        '''重新开始计时，随机错开起始相位，避免同时开始的会话在同一时刻集中发送'''
+        self.pace_start = time.monotonic() + random.uniform(0, self.frameInterval())
+        self.frames_paced = 0
+
+    def startStreaming(self):
+        self.resetPacing()
+        self.event.set()
+        self.video_stream.yieldFrame()
+        self.audio_stream.yieldFrame()
 
     def handlePause(self):
         self.sender.sendPause()
         if self.state == PLAYING:
             self.state = READY
             self.event.clear()
+            self.leaveBroadcast()
 
     def handleTeardown(self):
         self.sender.sendTeardown()
         self.event.clear()
+        self.leaveBroadcast()
+        getRtcpService().unregister((self.client_addr, self.client_rtcp_port))
         self.state = INIT
         self.client_teardown = True
 
     def handleDescribe(self):
-        self.video_stream = VideoStream(self.media, self.video_consume_semaphore, self.video_yield_semaphore,
-                                        self.event, lowres=self.low_res)
+        self.video_stream = VideoStream(self.media, self.event, lowres=self.low_res)
         self.total_frames = self.video_stream.getTotalFrames()
         self.video_framerate = self.video_stream.getFramerate()
-        self.audio_stream = AudioStream(self.media, self.audio_consume_semaphore, self.audio_yield_semaphore,
-                                        self.event, vfps=self.video_framerate)
+        self.audio_stream = AudioStream(self.media, self.event, vfps=self.video_framerate,
+                                        seekindex=self.video_stream.getSeekIndex())
+        self.audio_stream.setPayloadType(self.audio_payload)
         self.audio_samplerate = self.audio_stream.getSamplerate()
-        self.sender.setAVParameters(self.video_framerate, self.audio_samplerate, self.total_frames)
+        self.subtitle_stream = SubtitleStream(self.media, self.video_framerate)
+        self.sender.setAVParameters(self.video_framerate, self.audio_samplerate, self.total_frames,
+                                    self.subtitle_stream.isAvailable())
         self.sender.sendDescribe()
 
     def handleRtspRequest(self, request):
@@ -143,9 +272,9 @@ class ServerWorker:
             self.step = my_parser.getStep()
             self.audio_bias = my_parser.getAudioBias()
             self.low_res = my_parser.isLowResolution()
-            self.subtitle_required = my_parser.isSubtitleRequired()
         if method == SETUP:
             self.client_rtp_port, self.client_rtcp_port = my_parser.getClientPorts()
+            self.audio_payload = my_parser.getAudioPayload()
         self.sender = ResponseSender(
             self.rtsp_socket, self.cseq, self.session_id,
             self.url, self.local_ip,
@@ -175,17 +304,43 @@ class ServerWorker:
                     self.handleRtspRequest(data.decode('utf-8'))
                 else:
                     break
+            except OSError:
+                break
             except:
                 if self.client_teardown:
                     break
+        if not self.client_teardown:
+            self.dropSession()
         self.rtsp_socket.close()
 
+    def dropSession(self):
+        '''客户端没有发TEARDOWN就断开了：和TEARDOWN一样停止发送、离开广播组并停止发送者报告'''
+        self.event.clear()
+        self.leaveBroadcast()
+        getRtcpService().unregister((self.client_addr, self.client_rtcp_port))
+        self.state = INIT
+
     def run(self):
         self.listen_thread = threading.Thread(target=self.listen)
         self.listen_thread.setDaemon(True)
         self.listen_thread.start()
 
 
+def reportSendStats(interval=STATS_INTERVAL):
+    while True:
+        time.sleep(interval)
+        datagrams, syscalls, saved = getSendStats().rate()
+        print('RTP: %.0f datagrams/s, %.0f syscalls/s, %.0f syscalls/s saved by batching' % (datagrams, syscalls, saved))
+        for worker in getRtcpService().getSessions():
+            print('session %d: %s' % (worker.session_id, worker.stats.summary()))
+
+
+def startStatsReporter():
+    reporter = threading.Thread(target=reportSendStats)
+    reporter.setDaemon(True)
+    reporter.start()
+
+
 class Server:
     def __init__(self, port=SERVER_RTSP_PORT):
         self.port = port
@@ -207,7 +362,36 @@ class Server:
 
 
 def main():
-    my_server = Server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=SERVER_RTSP_PORT)
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='serve every session from a single asyncio event loop')
+    parser.add_argument('--stats', action='store_true', help='print RTP send statistics periodically')
+    parser.add_argument('--encode-workers', type=int, default=ENCODE_WORKERS,
+                        help='JPEG encoder processes, 0 encodes in each stream thread')
+    parser.add_argument('--encode-depth', type=int, default=ENCODE_QUEUE_DEPTH,
+                        help='decoded frames that may wait for an encoder')
+    parser.add_argument('--broadcast-window', type=float, default=BROADCAST_WINDOW,
+                        help='seconds during which new viewers of the same content join one shared stream')
+    parser.add_argument('--ladder', type=parseLadder, default=None,
+                        help='quality rungs from best to worst, e.g. 480x270:95,320x180:70')
+    parser.add_argument('--no-adapt', action='store_true', help='keep the resolution the client asked for')
+    parser.add_argument('--quiet', action='store_true', help='do not print RTSP messages')
+    parser.add_argument('--pcm-cache', action='store_true',
+                        help='decode each audio track once into a float32 .pcm.npy file next to the media')
+    args = parser.parse_args()
+    setVerbose(not args.quiet)
+    configureEncodePool(args.encode_workers, args.encode_depth)
+    configureBroadcast(args.broadcast_window)
+    configureLadder(args.ladder, not args.no_adapt)
+    configurePcmCache(args.pcm_cache)
+    if args.stats:
+        startStatsReporter()
+    if args.use_async:
+        from AsyncServer import AsyncServer
+        my_server = AsyncServer(args.port)
+    else:
+        my_server = Server(args.port)
     my_server.run()
 
 
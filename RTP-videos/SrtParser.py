@@ -1,11 +1,20 @@
+'''
+SRT字幕
+字幕按帧号区间建立索引：开始帧和结束帧各一个有序数组，查找用二分，顺序播放时用游标直接命中，不再为每一帧建一个字符串表
+索引只读，同一文件在进程内只解析一次，各会话通过SubtitleReader各自保存游标
+'''
+
+import os
+import threading
+from bisect import bisect_right
 import srt
 
 
 class SubEntry:
     def __init__(self, content, start_timedelta, end_timedelta, framerate):
         self._content = content
-        self._start_frame = int((start_timedelta.seconds + start_timedelta.microseconds / 1000000) * framerate)
-        self._end_frame = int((end_timedelta.seconds + end_timedelta.microseconds / 1000000) * framerate)
+        self._start_frame = int(start_timedelta.total_seconds() * framerate)
+        self._end_frame = int(end_timedelta.total_seconds() * framerate)
 
     def content(self):
         return self._content
@@ -18,39 +27,103 @@ class SubEntry:
 
 
 class SrtParser:
-    def __init__(self, filename, framerate, totalframes, encoding='utf-8'):
+    def __init__(self, filename, framerate, encoding='utf-8'):
         self.filename = filename
         self.framerate = framerate
-        self.totalframes = totalframes
         self.encoding = encoding
-        self.position = 0
         self.process()
-        self.createReader()
 
     def process(self):
-        raw = ''
         with open(self.filename, 'r', encoding=self.encoding) as f:
             raw = f.read()
-        subs = list(srt.parse(raw))
-        self.subs = [SubEntry(s.content, s.start, s.end, self.framerate) for s in subs]
+        self.subs = sorted((SubEntry(s.content, s.start, s.end, self.framerate) for s in srt.parse(raw)),
+                           key=lambda entry: entry.start())
         self.num_subs = len(self.subs)
+        self.starts = [entry.start() for entry in self.subs]
+        self.ends = [entry.end() for entry in self.subs]
+
+    def find(self, frame):
+        '''
+        :param frame: 帧号
+        :return: 开始帧不晚于frame的最后一条字幕的序号，没有时为-1
+        '''
+        return bisect_right(self.starts, frame) - 1
+
+    def owns(self, index, frame):
+        '''
+        :return: find(frame)是否等于index，用于判断游标是否仍然有效
+        '''
+        if index >= self.num_subs:
+            return False
+        return (index < 0 or self.starts[index] <= frame) and \
+            (index + 1 == self.num_subs or self.starts[index + 1] > frame)
+
+    def covers(self, index, frame):
+        return 0 <= index < self.num_subs and self.starts[index] <= frame <= self.ends[index]
+
+    def text(self, index):
+        return self.subs[index].content()
 
     def createReader(self):
-        currentIndex = 0
-        self.reader = ['' for i in range(self.totalframes)]
-        for i in range(self.totalframes):
-            if self.subs[currentIndex].end() < i:
-                currentIndex += 1
-            if currentIndex < self.num_subs:
-                if self.subs[currentIndex].start() <= i and self.subs[currentIndex].end() >= i:
-                    self.reader[i] = self.subs[currentIndex].content()
+        return SubtitleReader(self)
+
+
+class SubtitleReader:
+    '''
+    一个会话的字幕读取位置
+    顺序播放时游标所在的字幕或下一条字幕就能命中，跳转后用二分重新定位
+    '''
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.position = 0
+        self.cursor = -1
+
+    def find(self, frame):
+        '''
+        :param frame: 帧号
+        :return: 该帧显示的字幕的序号，没有时为-1
+        '''
+        parser = self.parser
+        if not parser.owns(self.cursor, frame):
+            if parser.owns(self.cursor + 1, frame):
+                self.cursor += 1
             else:
-                break
+                self.cursor = parser.find(frame)
+        return self.cursor if parser.covers(self.cursor, frame) else -1
+
+    def lookup(self, frame):
+        '''
+        :param frame: 帧号
+        :return: 该帧显示的字幕，没有时为空字符串
+        '''
+        index = self.find(frame)
+        return self.parser.text(index) if index >= 0 else ''
 
     def next(self):
-        data = self.reader[self.position]
+        data = self.lookup(self.position)
         self.position += 1
         return data
 
     def set(self, pos):
-        self.position = pos
\ No newline at end of file
+        self.position = pos
+
+
+subtitle_files = {}
+subtitle_lock = threading.Lock()
+
+
+def getSubtitles(filename, framerate):
+    '''
+    取得字幕文件的索引，同一文件在进程内只解析一次，文件修改后重新解析
+    :return: SrtParser，文件不存在时为None
+    '''
+    if not os.path.exists(filename):
+        return None
+    key = (filename, os.path.getmtime(filename), framerate)
+    with subtitle_lock:
+        parser = subtitle_files.get(key)
+        if parser is None:
+            parser = SrtParser(filename, framerate)
+            subtitle_files[key] = parser
+        return parser
@@ -0,0 +1,97 @@
+'''
+字幕叠加
+客户端把字幕轨的文字画到解码后的PIL图像上，服务器发送的帧不含字幕
+每条字幕在每种分辨率下只用cv2.putText光栅化一次（putText不处理换行，多行字幕逐行绘制），
+得到文字外接矩形大小的透明度掩码并缓存，之后每帧只按掩码在外接矩形内粘贴白色
+'''
+
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from PIL import Image
+from Constants import *
+
+SUBTITLE_FONT = cv2.FONT_HERSHEY_COMPLEX
+
+
+class SubtitleMask:
+    def __init__(self, text, size, origin=SUBTITLE_ORIGIN, scale=SUBTITLE_FONT_SCALE, thickness=1):
+        '''
+        光栅化一条字幕
+        :param text: 字幕
+        :param size: 帧的分辨率，超出画面的部分在这里裁掉
+        :param origin: 文字基线的起点，和putText的参数相同
+        '''
+        lines = text.split('\n')
+        sizes = [cv2.getTextSize(line, SUBTITLE_FONT, scale, thickness) for line in lines]
+        width = max(w for (w, h), b in sizes)
+        height = max(h for (w, h), b in sizes)
+        baseline = max(b for (w, h), b in sizes)
+        pad = thickness + 1
+        canvas = np.zeros(((height + baseline) * len(lines) + 2 * pad, width + 2 * pad), dtype=np.uint8)
+        for i, line in enumerate(lines):
+            cv2.putText(canvas, line, (pad, height + pad + (height + baseline) * i),
+                        SUBTITLE_FONT, scale, 255, thickness)
+        left, top = origin[0] - pad, origin[1] - height - pad
+        right, bottom = min(left + canvas.shape[1], size[0]), min(top + canvas.shape[0], size[1])
+        x, y = max(left, 0), max(top, 0)
+        alpha = canvas[y - top:max(bottom - top, 0), x - left:max(right - left, 0)]
+        rows, cols = np.nonzero(alpha)
+        if len(rows) == 0:
+            self.box = None
+            return
+        self.box = (x + cols.min(), y + rows.min(), x + cols.max() + 1, y + rows.max() + 1)
+        alpha = alpha[rows.min():rows.max() + 1, cols.min():cols.max() + 1]
+        self.image = Image.fromarray(alpha)
+
+    def paste(self, image):
+        '''
+        把白色字幕混合进PIL图像（原地修改），PIL按掩码只处理外接矩形
+        :param image: 与掩码分辨率相同的RGB图像
+        '''
+        if self.box is not None:
+            image.paste((255, 255, 255), tuple(int(v) for v in self.box), self.image)
+        return image
+
+
+class MaskCache:
+    '''按 (字幕, 分辨率) 缓存掩码，条目数超过上限时按LRU淘汰'''
+
+    def __init__(self, capacity=SUBTITLE_MASK_CACHE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, size):
+        key = (text, tuple(size))
+        with self.lock:
+            mask = self.entries.get(key)
+            if mask is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return mask
+            self.misses += 1
+        mask = SubtitleMask(text, size)
+        with self.lock:
+            self.entries[key] = mask
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return mask
+
+
+shared_masks = MaskCache()
+
+
+def drawSubtitleImage(image, text):
+    '''
+    在客户端叠加字幕轨的文字
+    :param image: 解码后的PIL图像（原地修改）
+    :param text: 字幕
+    :return: image
+    '''
+    if not text:
+        return image
+    return shared_masks.get(text, image.size).paste(image)
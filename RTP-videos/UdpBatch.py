@@ -0,0 +1,197 @@
+'''
+批量UDP发送
+Linux下通过ctypes调用sendmmsg，一次系统调用发出一帧的全部分片；每个包也可以是缓冲区列表，按分散-聚集方式发送
+经ctypes逐个填写iovec的开销比拼接一个MTU大小的数据报还大，所以sendmmsg先把每个包的缓冲区拼接成一个，sendmsg直接发送缓冲区列表
+其他平台依次退回到sendmsg和sendto
+'''
+
+import sys
+import time
+import socket
+import ctypes
+import threading
+from Constants import *
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_uint16),
+        ('sin_addr', ctypes.c_uint8 * 4),
+        ('sin_zero', ctypes.c_uint8 * 8)
+    ]
+
+
+def loadSendmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+libc_sendmmsg = loadSendmmsg()
+
+
+class SendStats:
+    '''统计发出的数据报数和系统调用数，用于计算每秒节省的系统调用'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.datagrams = 0
+        self.syscalls = 0
+        self.last_time = time.time()
+        self.last_datagrams = 0
+        self.last_syscalls = 0
+
+    def record(self, datagrams, syscalls):
+        with self.lock:
+            self.datagrams += datagrams
+            self.syscalls += syscalls
+
+    def rate(self):
+        '''
+        :return: 自上次调用以来每秒的 (数据报数, 系统调用数, 节省的系统调用数)
+        '''
+        with self.lock:
+            now = time.time()
+            elapsed = max(now - self.last_time, 1e-6)
+            datagrams = (self.datagrams - self.last_datagrams) / elapsed
+            syscalls = (self.syscalls - self.last_syscalls) / elapsed
+            self.last_time, self.last_datagrams, self.last_syscalls = now, self.datagrams, self.syscalls
+        return datagrams, syscalls, datagrams - syscalls
+
+
+send_stats = SendStats()
+
+
+def getSendStats():
+    return send_stats
+
+
+class BatchSender:
+    def __init__(self, sock, fallback=None, max_batch=UDP_BATCH_SIZE):
+        self.sock = sock
+        self.fallback = fallback if fallback is not None else sock.sendto
+        self.max_batch = max_batch
+        self.use_sendmmsg = libc_sendmmsg is not None and sock.family == socket.AF_INET
+        self.use_sendmsg = fallback is None and hasattr(sock, 'sendmsg')
+        self.addresses = {}
+        self.lock = threading.Lock()
+        self.stats = send_stats
+
+    def sockaddr(self, addr):
+        native = self.addresses.get(addr)
+        if native is None:
+            native = sockaddr_in()
+            native.sin_family = socket.AF_INET
+            native.sin_port = socket.htons(addr[1])
+            native.sin_addr[:] = socket.inet_aton(socket.gethostbyname(addr[0]))
+            with self.lock:
+                self.addresses[addr] = native
+        return native
+
+    def sendBatch(self, packets, addr):
+        '''
+        向同一地址发送一组数据报
+        :param packets: 数据报列表，每个数据报是字节流或缓冲区列表
+        :param addr: 目的地址
+        '''
+        self.sendItems([(packet, addr) for packet in packets])
+
+    def sendItems(self, items):
+        '''
+        发送一组数据报，每个数据报可以有各自的目的地址
+        发往某个地址失败（如对端不可达）时只跳过这个数据报，不影响同一批里发往其他会话的数据报
+        :param items: (数据报, 目的地址) 的列表
+        '''
+        sent = 0
+        if self.use_sendmmsg and len(items) > 1:
+            sent = self.sendmmsg(items)
+        for (packet, addr) in items[sent:]:
+            self.trySendOne(packet, addr)
+
+    def trySendOne(self, packet, addr):
+        try:
+            self.sendOne(packet, addr)
+        except OSError:
+            pass
+
+    def sendOne(self, packet, addr):
+        if isinstance(packet, (list, tuple)):
+            if self.use_sendmsg:
+                self.sock.sendmsg(packet, [], 0, addr)
+            else:
+                self.fallback(b''.join(packet), addr)
+        else:
+            self.fallback(packet, addr)
+        self.stats.record(1, 1)
+
+    def sendmmsg(self, items):
+        sent = 0
+        while sent < len(items):
+            batch = items[sent:sent + self.max_batch]
+            keep = []
+            messages = (mmsghdr * len(batch))()
+            for (i, (packet, addr)) in enumerate(batch):
+                name = self.sockaddr(addr)
+                buffers = (b''.join(packet),) if isinstance(packet, (list, tuple)) else (packet,)
+                vectors = (iovec * len(buffers))()
+                for (j, buf) in enumerate(buffers):
+                    vectors[j].iov_base, vectors[j].iov_len = bufferAddress(buf, keep), len(buf)
+                keep.append(vectors)
+                header = messages[i].msg_hdr
+                header.msg_name = ctypes.cast(ctypes.byref(name), ctypes.c_void_p)
+                header.msg_namelen = ctypes.sizeof(name)
+                header.msg_iov = vectors
+                header.msg_iovlen = len(buffers)
+            count = libc_sendmmsg(self.sock.fileno(), messages, len(batch), 0)
+            if count <= 0:
+                # 批中第一个数据报出错，单独重试一次以跳过它，其余的继续批量发送
+                self.trySendOne(*batch[0])
+                sent += 1
+                continue
+            sent += count
+            self.stats.record(count, 1)
+        return sent
+
+
+def bufferAddress(buf, keep):
+    '''
+    取得缓冲区的地址，keep用于在系统调用返回前保持引用
+    '''
+    if isinstance(buf, bytes):
+        pointer = ctypes.c_char_p(buf)
+        keep.append(pointer)
+        return ctypes.cast(pointer, ctypes.c_void_p).value
+    try:
+        array = (ctypes.c_char * len(buf)).from_buffer(buf)
+    except TypeError:
+        return bufferAddress(bytes(buf), keep)
+    keep.append(array)
+    return ctypes.addressof(array)
@@ -1,86 +1,110 @@
-import random
+import time
+import threading
 from Constants import *
 
-class Queue:
+class RingBuffer:
+    '''
+    预分配的单生产者单消费者环形缓冲区
+    head只由消费者推进，tail只由生产者推进，读写本身不加锁；满或空时通过事件阻塞等待，可设置超时
+    '''
+
     def __init__(self, capacity):
         self.capacity = capacity
-        self.size = 0
         self.head = 0
         self.tail = 0
-        self.arr = [float('nan')] * self.capacity
-
+        self.arr = [None] * self.capacity
+        self.closed = False
+        self.not_empty = threading.Event()
+        self.not_full = threading.Event()
+        self.not_full.set()
 
     def isEmpty(self):
-        return self.size == 0
-
+        return self.tail == self.head
 
     def isFull(self):
-        return self.size == self.capacity
-
+        return self.tail - self.head >= self.capacity
 
     def getSize(self):
-        return self.size
-
-
-    def push(self, x):
-        if self.isFull():
-            return -1
-        else:
-            self.arr[self.tail] = x
-            self.tail = (self.tail + 1) % self.capacity
-            self.size += 1
-            return self.size
-
-
-    def pop(self):
-        if self.isEmpty():
-            return
-        else:
-            elem = self.arr[self.head]
-            self.head = (self.head + 1) % self.capacity
-            self.size -= 1
-            return elem
-
-
-class Node:
-    def __init__(self, data):
-        self.next = None
-        self.data = data
-
-
-class LinkList:
-    def __init__(self):
-        self.head = None
-        self.tail = None
-        self.size = 0
-
-
-    def push(self, x):
-        if self.size == 0:
-            self.head = Node(x)
-            self.tail = self.head
-            self.size += 1
-        else:
-            new_node = Node(x)
-            self.tail.next = new_node
-            self.tail = new_node
-            self.size += 1
-
-
-    def pop(self):
-        if self.size == 0:
-            return
-        elif self.size == 1:
-            data = self.head.data
-            self.head = self.tail = None
-            self.size -= 1
-            return data
-        else:
-            data = self.head.data
-            self.head = self.head.next
-            self.size -= 1
-            return data
-
+        return self.tail - self.head
 
     def len(self):
-        return self.size
+        return self.tail - self.head
+
+    def wait(self, event, ready, timeout):
+        if ready():
+            return True
+        event.clear()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ready() and not self.closed:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            event.wait(remaining)
+            event.clear()
+        return ready()
+
+    def push(self, x, timeout=None):
+        '''
+        放入一个元素
+        :param x: 元素
+        :param timeout: 缓冲区满时的最长等待时间，0表示不等待，None表示一直等待
+        :return: 是否放入成功
+        '''
+        if not self.wait(self.not_full, lambda: not self.isFull(), timeout):
+            return False
+        self.arr[self.tail % self.capacity] = x
+        self.tail += 1
+        if not self.not_empty.is_set():
+            self.not_empty.set()
+        return True
+
+    def pushMany(self, items, timeout=None):
+        '''
+        :return: 实际放入的元素个数
+        '''
+        count = 0
+        for x in items:
+            if not self.push(x, timeout if count == 0 else 0):
+                break
+            count += 1
+        return count
+
+    def pop(self, timeout=None):
+        '''
+        取出一个元素
+        :param timeout: 缓冲区空时的最长等待时间，0表示不等待，None表示一直等待
+        :return: 元素，超时时为None
+        '''
+        if not self.wait(self.not_empty, lambda: not self.isEmpty(), timeout):
+            return None
+        index = self.head % self.capacity
+        elem = self.arr[index]
+        self.arr[index] = None
+        self.head += 1
+        if not self.not_full.is_set():
+            self.not_full.set()
+        return elem
+
+    def popMany(self, maxcount, timeout=None):
+        '''
+        取出至多maxcount个元素，至少等到一个元素或超时
+        :return: 元素列表
+        '''
+        items = []
+        elem = self.pop(timeout)
+        while elem is not None:
+            items.append(elem)
+            if len(items) >= maxcount:
+                break
+            elem = self.pop(0)
+        return items
+
+    def clear(self):
+        '''丢弃缓冲区中的所有元素，只能在消费者一侧或消费者空闲时调用'''
+        while self.pop(0) is not None:
+            pass
+
+    def close(self):
+        self.closed = True
+        self.not_empty.set()
+        self.not_full.set()